@@ -1,15 +1,50 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_socketio import SocketIO
 from flask_cors import CORS
 from config import Config
+from app.presence import PresenceRegistry
+from app.presence_writer import PresenceWriter
+from app.lifecycle import ServerLifecycle
+from app.cluster import socketio_queue_options
+from app.identity_cache import IdentityCache
+from app.friend_graph import FriendGraph
+from app.password_hasher import PasswordHasher
+from app.avatars import AvatarPipeline
+from app.relay import MessageRelay
+from app.signaling import SignalCoalescer
+from app.metrics import Metrics
+from app.database import init_database
+from app.replicas import ReplicaRouter, RoutingSQLAlchemy
 
 # 在全局作用域创建扩展实例，但尚未绑定到任何特定的Flask app。
 # 这种模式允许我们在不同的应用实例（如生产、测试）中使用这些扩展。
-db = SQLAlchemy()
+# 会话按请求路由到主库或只读副本（见 app/replicas.py）
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 socketio = SocketIO()
+# 在线状态注册表，具体后端（进程内/共享存储）在 create_app 中根据配置决定
+presence = PresenceRegistry()
+# 上线/下线时对 users 表的写入缓冲区，由后台任务批量写入
+presence_writer = PresenceWriter()
+# 启动时对账数据库中的在线状态，关闭时排空连接并批量下线本进程的用户
+lifecycle = ServerLifecycle()
+# 已验证身份缓存，减少认证装饰器中重复的JWT解码和用户查询
+identity_cache = IdentityCache()
+# 好友关系图缓存，让好友判断和好友ID列表无需查询数据库
+friend_graph = FriendGraph()
+# bcrypt 密码哈希进程池，避免哈希计算占用请求线程
+password_hasher = PasswordHasher()
+# 头像处理流水线，在后台生成多尺寸的缩略图
+avatar_pipeline = AvatarPipeline()
+# 离线消息中转，P2P通道不可用时暂存端到端加密的消息
+relay = MessageRelay()
+# WebRTC 信令合并，把短时间内的多个 ICE 候选地址合并为一个事件
+signal_coalescer = SignalCoalescer()
+# 运行指标，以 Prometheus 文本格式在 /metrics 上导出
+metrics = Metrics()
+# 只读副本路由，只读接口的查询发往副本，并保证用户能读到自己刚写入的数据
+replicas = ReplicaRouter()
 
 def create_app(config_class=Config):
     """
@@ -27,19 +62,38 @@ def create_app(config_class=Config):
 
     # 将之前创建的扩展实例与当前的app实例进行绑定
     db.init_app(app)
+    # 按数据库类型设置连接池参数，SQLite 文件数据库还会在每个连接上开启 WAL 等 PRAGMA（见 app/database.py）
+    init_database(app, db)
+    replicas.init_app(app)
     migrate.init_app(app, db)
-    # 初始化SocketIO，允许所有来源的跨域连接
-    socketio.init_app(app, cors_allowed_origins="*")
+
+    # 在初始化SocketIO之前导入socket事件处理模块（放在函数内部以避免循环依赖）。
+    # 事件处理器在 socketio 尚未绑定服务器时注册，会被记录在 socketio.handlers 中，
+    # 之后每次 init_app 创建新的服务器时都会重新绑定，因此测试中多次创建应用也能正常处理事件。
+    from app import socket_events
+
+    # 初始化SocketIO，允许所有来源的跨域连接。
+    # 如果配置了消息队列（集群模式），各 worker 之间会通过队列转发 emit 和 disconnect 操作。
+    # 开发模式使用线程，生产模式使用与 SERVER_MODE 同名的协程库（eventlet / gevent）。
+    async_mode = 'threading' if app.config['SERVER_MODE'] == 'dev' else app.config['SERVER_MODE']
+    socketio.init_app(app, cors_allowed_origins="*", async_mode=async_mode,
+                      **socketio_queue_options(app))
+    presence.init_app(app)
+    presence_writer.init_app(app)
+    lifecycle.init_app(app)
+    identity_cache.init_app(app)
+    friend_graph.init_app(app)
+    password_hasher.init_app(app)
+    avatar_pipeline.init_app(app)
+    relay.init_app(app)
+    signal_coalescer.init_app(app)
+    metrics.init_app(app)
 
     # 导入并注册API蓝图
     # 蓝图有助于将应用模块化，使代码结构更清晰
     from app.api import bp as api_blueprint
     app.register_blueprint(api_blueprint, url_prefix='/api')
 
-    # 在应用初始化之后导入socket事件处理模块，以避免循环依赖问题。
-    # socket_events模块需要使用已经初始化完成的socketio实例。
-    from app import socket_events
-
     # 一个简单的根路由，用于检查后端服务是否正在运行
     @app.route('/')
     def index():
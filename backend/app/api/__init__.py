@@ -9,4 +9,4 @@ bp = Blueprint('api', __name__)
 # 在文件末尾导入API模块（如 users.py, friends.py 等）。
 # 这样做是为了将这些文件中定义的路由注册到上面创建的蓝图(bp)上。
 # 这是一种避免循环导入的常见Flask模式，因为这些被导入的模块自身也需要从 app.api 导入 bp。
-from app.api import users, friends, admin, online 
\ No newline at end of file
+from app.api import users, friends, admin, online, avatars, groups
\ No newline at end of file
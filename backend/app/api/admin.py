@@ -1,38 +1,159 @@
-from flask import jsonify, g
+import csv
+import io
+import json
+from flask import jsonify, g, request, current_app, Response, stream_with_context
 from flask_socketio import disconnect
+from sqlalchemy import func
 from app.api import bp
 from app.api.auth import admin_required
-from app.models import User
-from app.socket_events import get_sid_by_username
-from app import socketio, db
+from app.api.pagination import parse_page_args, make_etag, not_modified, paginate, list_response
+from app.models import User, ChatGroup, GroupMembership
+from app.groups import group_deleted
+from app import socketio, db, presence, presence_writer, identity_cache, friend_graph, replicas
 
 # 定义管理员操作的API端点
 
 @bp.route('/admin/users', methods=['GET'])
 @admin_required
+@replicas.read_only
 def get_all_users():
     """
     [管理员] 获取系统中所有用户的列表。
     
     权限要求:
         - 必须是管理员（由 @admin_required 装饰器保证）。
+    查询参数（可选，见 app/api/pagination.py）:
+        - limit: 每页条数。不提供时返回全部用户。
+        - after: 上一页最后一个用户的ID。
     返回数据:
-        - 一个包含所有用户信息的JSON数组。每个用户信息包括ID、用户名、邮箱、
-          在线状态、IP地址和是否为管理员的标志。
+        - 一个包含用户信息的JSON数组，按用户ID排序。每个用户信息包括ID、用户名、邮箱、
+          在线状态、IP地址和是否为管理员的标志。还有下一页时响应头中带有 X-Next-Cursor 和 Link。
+        - 带有弱ETag。客户端携带 If-None-Match 且用户表和在线状态都未变化时返回 304。
     安全考虑:
         - 此接口仅返回公开或半公开的用户数据，不会泄露密码哈希等敏感信息。
     """
-    # 从数据库中查询所有用户
-    users = User.query.all()
+    try:
+        limit, after = parse_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # 用户表的版本：行数和最大行版本号，任何插入、修改、删除之后都会变化。
+    # is_online 来自在线状态注册表、ip_address 可能来自在线状态写入缓冲区，两者的版本也并入ETag
+    presence_version = (presence.version(), presence_writer.version())
+    count, max_version = db.session.query(func.count(User.id), func.max(User.row_version)).one()
+    etag = make_etag('admin-users', count, max_version, presence_version, limit, after)
+    response = not_modified(etag)
+    if response:
+        return response
+
+    # 只查询需要返回的列，按用户ID做键集分页
+    query = db.session.query(User.id, User.username, User.email, User.ip_address, User.is_admin)
+    users, next_after = paginate(query, User.id, limit, after)
+    # 在线状态以在线状态注册表为准，一次批量查询得到本页的在线用户
+    online_usernames = presence.online_among(user.username for user in users)
     # 构建包含用户信息的字典列表，并将其转换为JSON响应
-    return jsonify([{
+    return list_response([{
         'id': user.id,
         'username': user.username,
         'email': user.email,
-        'is_online': user.is_online,
-        'ip_address': user.ip_address,
+        'is_online': user.username in online_usernames,
+        'ip_address': presence_writer.overlay(user.id, None, user.ip_address, None)[1],
         'is_admin': user.is_admin
-    } for user in users])
+    } for user in users], etag, limit, next_after)
+
+# 导出接口允许选择的列。is_online 来自在线状态注册表，其余均为 users 表中的列；
+# 密码哈希等敏感字段不在其中。
+EXPORT_COLUMNS = ('id', 'username', 'email', 'is_online', 'ip_address', 'port', 'is_admin',
+                  'gender', 'age', 'bio', 'avatar_url')
+DEFAULT_EXPORT_COLUMNS = ('id', 'username', 'email', 'is_online', 'ip_address', 'is_admin')
+
+@bp.route('/admin/users/export', methods=['GET'])
+@admin_required
+def export_users():
+    """
+    [管理员] 以流式响应导出用户表，适用于报表任务和大量用户的场景。
+
+    查询参数（均为可选）:
+        - format: 'ndjson'（默认，每行一个JSON对象）或 'csv'（第一行为表头）。
+        - columns: 逗号分隔的列名，取值见 EXPORT_COLUMNS，默认与用户列表接口相同。
+        - online: 为 1 时只导出在线用户。
+        - admin: 为 1 时只导出管理员。
+    实现方式:
+        - 按用户ID做分批的键集扫描，每批 ADMIN_EXPORT_BATCH_SIZE 行，只查询选中的列；
+          每批都是一次独立的短查询，不会长时间占用数据库连接或锁。
+        - 每批数据序列化后立即写出，内存占用与用户总数无关，第一批数据几乎立刻开始传输。
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': "format must be 'ndjson' or 'csv'"}), 400
+
+    columns = request.args.get('columns')
+    columns = [c.strip() for c in columns.split(',') if c.strip()] if columns else list(DEFAULT_EXPORT_COLUMNS)
+    unknown = [c for c in columns if c not in EXPORT_COLUMNS]
+    if not columns or unknown:
+        return jsonify({'error': f'Unknown columns: {", ".join(unknown)}' if unknown else 'No columns selected'}), 400
+
+    online_only = request.args.get('online') == '1'
+    admins_only = request.args.get('admin') == '1'
+    batch_size = current_app.config['ADMIN_EXPORT_BATCH_SIZE']
+
+    # 总是查询 id（用于键集翻页）和 username（用于查询在线状态）
+    db_columns = ['id', 'username'] + [c for c in columns if c not in ('id', 'username', 'is_online')]
+    query = db.session.query(*(getattr(User, c) for c in db_columns))
+    if admins_only:
+        query = query.filter(User.is_admin.is_(True))
+
+    def batches():
+        """按ID顺序逐批读取，每批返回 (行字典列表)。"""
+        last_id = 0
+        while True:
+            rows = query.filter(User.id > last_id).order_by(User.id).limit(batch_size).all()
+            if not rows:
+                return
+            last_id = rows[-1].id
+            online_usernames = presence.online_among(row.username for row in rows)
+            records = []
+            for row in rows:
+                is_online = row.username in online_usernames
+                if online_only and not is_online:
+                    continue
+                values = row._asdict()
+                values['is_online'] = is_online
+                # P2P连接信息以在线状态写入缓冲区中尚未写入数据库的值为准
+                state = presence_writer.state(row.id)
+                if state is not None:
+                    values.update((column, value) for column, value in zip(('ip_address', 'port'), state[1:])
+                                  if column in values)
+                records.append({c: values[c] for c in columns})
+            if records:
+                yield records
+            # 读完一批后结束事务、释放数据库连接，避免在客户端慢速接收时长期占用
+            db.session.close()
+
+    def generate_ndjson():
+        for records in batches():
+            yield ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for records in batches():
+            writer.writerows([record[c] for c in columns] for record in records)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # 没有任何数据时也要输出表头
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    if export_format == 'csv':
+        generator, mimetype, filename = generate_csv(), 'text/csv', 'users.csv'
+    else:
+        generator, mimetype, filename = generate_ndjson(), 'application/x-ndjson', 'users.ndjson'
+    response = Response(stream_with_context(generator), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
 
 @bp.route('/admin/users/<string:username>/disconnect', methods=['POST'])
 @admin_required
@@ -44,8 +165,8 @@ def disconnect_user(username):
         - username: 要强制下线的用户的用户名。
     业务逻辑:
         1. 查找目标用户是否存在。
-        2. 检查用户是否真的在线。
-        3. 如果在线，获取其对应的Socket.IO会话ID (SID)。
+        2. 从在线状态注册表中获取其对应的Socket.IO会话ID (SID)。
+        3. 如果没有SID且数据库也显示离线，说明用户本就离线。
         4. 调用 `disconnect()` 函数强制关闭其WebSocket连接。
         5. 处理数据库状态与实时会话状态不一致的边缘情况。
     返回:
@@ -59,12 +180,14 @@ def disconnect_user(username):
         # 如果用户不存在，返回404错误
         return jsonify({'error': 'User not found'}), 404
         
-    # 如果数据库记录显示用户已离线，直接返回成功信息
-    if not user_to_disconnect.is_online:
+    # 从在线状态注册表中获取用户的SID（多 worker 部署时注册表在进程间共享）
+    sid = presence.get_sid(username)
+
+    # 注册表和数据库（包括尚未写入的在线状态）都显示用户离线，直接返回成功信息
+    is_online = presence_writer.overlay(user_to_disconnect.id, user_to_disconnect.is_online, None, None)[0]
+    if not sid and not is_online:
         return jsonify({'message': 'User is already offline'}), 200
 
-    # 从内存中的在线用户字典里获取用户的SID
-    sid = get_sid_by_username(username)
     if sid:
         # 如果找到了SID，说明用户当前有活跃的Socket.IO连接
         # 调用disconnect会触发 socket_events.py 中的 'disconnect' 事件处理器，
@@ -74,10 +197,9 @@ def disconnect_user(username):
         return jsonify({'message': f'Disconnect signal sent to {username}.'}), 200
     else:
         # 边缘情况处理：数据库显示用户在线，但在Socket.IO的会话中找不到他。
-        # 这可能意味着上次非正常断开连接时，清理工作未能完成。
+        # 这可能意味着上次非正常断开连接时，清理工作未能完成（进程崩溃留下的记录会在下次启动时统一重置）。
         # 这里主动纠正数据库中的状态，确保数据一致性。
-        user_to_disconnect.is_online = False
-        db.session.commit()
+        presence_writer.set_offline(user_to_disconnect.id)
         return jsonify({'error': 'User is online in DB but not found in socket session. Status corrected.'}), 500
 
 @bp.route('/admin/users/<string:username>', methods=['DELETE'])
@@ -108,7 +230,18 @@ def delete_user(username):
     # 执行删除操作
     # 注意：由于我们在 User 模型中为相关的好友关系和好友请求设置了级联删除(cascade="all, delete-orphan")，
     # 所以在删除用户时，SQLAlchemy会自动删除所有与该用户相关的记录，无需手动清理。
+    # 在同一事务中让该用户及其好友在好友关系图缓存中的条目失效
+    friend_graph.record_user_removed(user_to_delete.id)
+    # 退出所有群，并解散该用户创建的群
+    owned_groups = [group.id for group in ChatGroup.query.filter_by(creator_id=user_to_delete.id)]
+    GroupMembership.query.filter_by(user_id=user_to_delete.id).delete()
+    GroupMembership.query.filter(GroupMembership.group_id.in_(owned_groups)).delete(synchronize_session=False)
+    ChatGroup.query.filter(ChatGroup.id.in_(owned_groups)).delete(synchronize_session=False)
     db.session.delete(user_to_delete)
     db.session.commit()
+    for group_id in owned_groups:
+        group_deleted(group_id)
+    # 让已缓存的身份失效，被删除用户手中的令牌随即无法再通过认证
+    identity_cache.invalidate_user(user_to_delete)
 
     return jsonify({'message': f'User {username} has been deleted successfully.'}), 200 
\ No newline at end of file
@@ -1,7 +1,7 @@
 from functools import wraps
-from flask import request, jsonify, g, current_app
+from flask import request, jsonify, g
 import jwt
-from app.models import User
+from app import identity_cache
 
 def token_required(f):
     """JWT认证装饰器
@@ -9,7 +9,8 @@ def token_required(f):
     功能:
         1. 从请求头 'Authorization' 中获取JWT。
         2. 解码并验证JWT的有效性（包括签名和过期时间）。
-        3. 从JWT负载中获取用户ID，并查询数据库确认用户存在。
+        3. 从JWT负载中获取用户ID，并确认用户存在。
+           令牌和用户都经过已验证身份缓存(identity_cache)，缓存命中时既不重新校验签名也不查询数据库。
         4. 将查询到的当前用户对象存储在Flask的全局对象 `g` 中，以便后续的视图函数使用。
         
     异常处理:
@@ -32,9 +33,9 @@ def token_required(f):
         try:
             # 2. 解码并验证JWT
             # 使用在Flask应用配置中定义的SECRET_KEY和HS256算法进行解码
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-            # 3. 从解码后的数据中获取用户ID，并查询数据库
-            g.current_user = User.query.get(data['user_id'])
+            user_id = identity_cache.decode_token(token)
+            # 3. 根据用户ID获取用户
+            g.current_user = identity_cache.get_user(user_id)
             # 如果根据ID找不到对应的用户，也视为token无效
             if not g.current_user:
                  return jsonify({'message': 'Token is invalid!'}), 401
@@ -75,8 +76,8 @@ def admin_required(f):
             return jsonify({'message': 'Token is missing!'}), 401
 
         try:
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-            g.current_user = User.query.get(data['user_id'])
+            user_id = identity_cache.decode_token(token)
+            g.current_user = identity_cache.get_user(user_id)
             if not g.current_user:
                 return jsonify({'message': 'Token is invalid!'}), 401
         except jwt.ExpiredSignatureError:
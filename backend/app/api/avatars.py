@@ -0,0 +1,54 @@
+import hashlib
+import re
+from flask import abort, current_app, request
+from app import avatar_pipeline
+from app.api import bp
+from app.concurrency import run_blocking
+
+# 头像文件名: <版本目录>/<尺寸>.<格式>，只允许字母数字、下划线和连字符，不会越出头像目录
+AVATAR_NAME = re.compile(r'[\w-]+(?:/[\w-]+)*/\d+\.(webp|jpg)')
+AVATAR_MIMETYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg'}
+# 同一个URL的内容永远不变，允许缓存一年
+AVATAR_MAX_AGE = 365 * 24 * 3600
+
+
+@bp.route('/avatars/<path:name>', methods=['GET'])
+def get_avatar(name):
+    """
+    下载头像文件，无需认证。
+    文件名由图片内容决定，响应带有 `Cache-Control: public, max-age=31536000, immutable` 和强 ETag，
+    支持 If-None-Match (304) 和 Range 请求 (206)。
+    配置了 AVATAR_OFFLOAD_HEADER 时只返回响应头，由前端代理（nginx 的 X-Accel-Redirect 或
+    Apache/lighttpd 的 X-Sendfile）直接发送文件；否则优先从内存中的热点缓存读取。
+    """
+    match = AVATAR_NAME.fullmatch(name)
+    if match is None:
+        abort(404)
+    name = 'avatars/' + name
+
+    response = current_app.response_class(mimetype=AVATAR_MIMETYPES[match.group(1)])
+    response.set_etag(hashlib.sha1(name.encode('utf-8')).hexdigest()[:24])
+    response.cache_control.public = True
+    response.cache_control.max_age = AVATAR_MAX_AGE
+    response.cache_control.immutable = True
+    # 客户端已有该文件时直接返回 304，不读取文件内容
+    if request.if_none_match.contains_weak(response.get_etag()[0]):
+        response.status_code = 304
+        return response
+
+    offload = current_app.config.get('AVATAR_OFFLOAD_HEADER')
+    if offload == 'X-Accel-Redirect':
+        response.headers[offload] = current_app.config.get('AVATAR_OFFLOAD_PREFIX', '/protected/') + name
+        return response
+    if offload and avatar_pipeline.storage.local_path(name):
+        response.headers[offload] = avatar_pipeline.storage.local_path(name)
+        return response
+
+    data = avatar_pipeline.cache.get(name)
+    if data is None:
+        data = run_blocking(avatar_pipeline.storage.read, name)
+        if data is None:
+            abort(404)
+        avatar_pipeline.cache.set(name, data)
+    response.set_data(data)
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
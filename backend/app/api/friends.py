@@ -1,37 +1,78 @@
-from flask import jsonify, g, request, url_for
+from datetime import datetime
+from flask import jsonify, g, request
+from sqlalchemy import func
 from app.api import bp
 from app.api.auth import token_required
-from app.models import User, FriendRequest
-from app import db, socketio
+from app.api.pagination import parse_page_args, make_etag, not_modified, paginate, list_response
+from app.avatars import AvatarLinks, requested_size
+from app.models import User, FriendRequest, friendships
+from app import db, socketio, identity_cache, replicas, presence_writer
 
 # 好友相关的所有API操作都需要token认证，因此都使用 @token_required 装饰器
+# 只读的接口还带有 @replicas.read_only，配置了只读副本时从副本读取（见 app/replicas.py）
 
 @bp.route('/friends', methods=['GET'])
 @token_required
+@replicas.read_only
 def get_friends():
     """
     获取当前登录用户的好友列表。
     
+    查询参数（可选，见 app/api/pagination.py）:
+        - limit: 每页条数。不提供时返回全部好友。
+        - after: 上一页最后一个好友的ID。
     返回:
-        - 一个包含所有好友信息的JSON数组。每个好友对象包括ID、用户名、在线状态、
+        - 一个包含好友信息的JSON数组。每个好友对象包括ID、用户名、在线状态、
           P2P连接信息以及完整的头像URL。
-        - 列表按好友添加时间排序（由数据库关系定义）。
+        - 列表按好友的用户ID排序；还有下一页时响应头中带有 X-Next-Cursor 和 Link。
+        - 带有弱ETag。客户端携带 If-None-Match 且列表（包括好友的在线状态）未变化时返回 304。
     """
     # g.current_user 是由 @token_required 装饰器设置的
     user = g.current_user
-    # user.friends 是在 User 模型中定义的 relationship，它会查询与当前用户关联的所有好友
-    friends = user.friends.all()
-    # 构建好友列表的JSON响应
-    return jsonify([{
-        'id': friend.id, 
-        'username': friend.username,
-        'is_online': friend.is_online,
-        'ip_address': friend.ip_address,
-        'port': friend.port,
-        # 使用 url_for 生成头像的完整外部URL，以便前端能直接访问
-        # 如果用户没有设置头像(avatar_url为空)，则返回null
-        'avatar_url': url_for('static', filename=friend.avatar_url, _external=True) if friend.avatar_url else None
-    } for friend in friends])
+    try:
+        limit, after = parse_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # 好友列表的版本：好友数量和好友中最大的行版本号。
+    # 新增好友、好友修改资料或上下线都会增大后者，删除好友会减少前者。
+    # 在线状态还会被尚未写入数据库的缓冲区覆盖，因此也带上缓冲区的版本（需要在读取列表之前取得）。
+    presence_version = presence_writer.version()
+    count, max_version = db.session.query(func.count(User.id), func.max(User.row_version)).join(
+        friendships, friendships.c.friend_id == User.id
+    ).filter(friendships.c.user_id == user.id).one()
+    etag = make_etag('friends', user.id, count, max_version, presence_version, limit, after,
+                     request.args.get('avatar_size'))
+    response = not_modified(etag)
+    if response:
+        return response
+
+    # 只查询需要返回的列，按好友ID做键集分页
+    query = db.session.query(
+        User.id, User.username, User.is_online, User.ip_address, User.port, User.avatar_url
+    ).join(friendships, friendships.c.friend_id == User.id).filter(friendships.c.user_id == user.id)
+    friends, next_after = paginate(query, User.id, limit, after)
+
+    # 头像的完整外部URL只需用 url_for 生成一次前缀，以便前端能直接访问。
+    # 好友列表中的头像默认使用 128px 的缩略图，可用 avatar_size 参数选择其他尺寸。
+    # 如果用户没有设置头像(avatar_url为空)，则返回null
+    links = AvatarLinks()
+    avatar_size = requested_size(128)
+    results = []
+    for friend in friends:
+        # 在线状态和P2P连接信息以在线状态写入缓冲区中尚未写入数据库的值为准
+        is_online, ip_address, port = presence_writer.overlay(
+            friend.id, friend.is_online, friend.ip_address, friend.port)
+        results.append({
+            'id': friend.id,
+            'username': friend.username,
+            'is_online': is_online,
+            'ip_address': ip_address,
+            'port': port,
+            'avatar_url': links.url(friend.avatar_url, avatar_size),
+            'avatar_url_template': links.template(friend.avatar_url)
+        })
+    return list_response(results, etag, limit, next_after)
 
 @bp.route('/friend-requests', methods=['POST'])
 @token_required
@@ -61,7 +102,7 @@ def send_friend_request():
         return jsonify({'error': 'You cannot send a friend request to yourself'}), 400
 
     # 2. 查找接收请求的用户
-    receiver = User.query.filter_by(username=receiver_username).first()
+    receiver = identity_cache.get_user_by_username(receiver_username)
     if not receiver:
         return jsonify({'error': 'User not found'}), 404
 
@@ -70,6 +111,7 @@ def send_friend_request():
         return jsonify({'error': 'You are already friends with this user'}), 400
 
     # 4. 检查是否已存在请求（无论是谁发给谁）
+    #    两个方向都是对 (requester_id, receiver_id) 唯一约束索引的精确查找
     existing_request = FriendRequest.query.filter(
         ((FriendRequest.requester_id == requester.id) & (FriendRequest.receiver_id == receiver.id)) |
         ((FriendRequest.requester_id == receiver.id) & (FriendRequest.receiver_id == requester.id))
@@ -80,50 +122,58 @@ def send_friend_request():
         return jsonify({'error': f'A friend request already exists with status: {existing_request.status}'}), 400
 
     # 5. 创建新的好友请求记录，状态为'pending'
-    new_request = FriendRequest(requester_id=requester.id, receiver_id=receiver.id, status='pending')
+    new_request = FriendRequest(requester_id=requester.id, receiver_id=receiver.id, status='pending',
+                                timestamp=datetime.utcnow())
     db.session.add(new_request)
-    db.session.commit()
-
-    # 5.1 通过WebSocket向接收方实时推送新好友请求的通知
-    #     使用接收方的用户名作为房间名(room)，确保只有他能收到
-    socketio.emit('new_friend_request', {
+    db.session.flush()
+    # 在提交之前准备好通知内容，提交后对象属性会过期，再访问会重新查询数据库
+    notification = {
         'id': new_request.id,
         'requester_id': requester.id,
         'requester_username': requester.username,
         'timestamp': new_request.timestamp.isoformat() + 'Z' # 使用ISO 8601格式的时间戳
-    }, room=receiver.username)
+    }
+    receiver_room, receiver_id = receiver.username, receiver.id
+    db.session.commit()
+    # 接收方收到通知后会立即拉取好友请求列表，让其在窗口期内从主库读取
+    replicas.record_write(receiver_id)
+
+    # 5.1 通过WebSocket向接收方实时推送新好友请求的通知
+    #     使用接收方的用户名作为房间名(room)，确保只有他能收到
+    socketio.emit('new_friend_request', notification, room=receiver_room)
 
     return jsonify({'message': 'Friend request sent successfully'}), 201
 
 @bp.route('/friend-requests', methods=['GET'])
 @token_required
+@replicas.read_only
 def get_friend_requests():
     """
     获取当前用户收到的、所有待处理的好友请求。
     
     返回:
-        - 一个包含所有待处理请求信息的JSON数组。每个请求对象包括请求ID、
-        发送者ID、发送者用户名和请求时间戳。
+        - 一个包含所有待处理请求信息的JSON数组，按请求时间排序。每个请求对象包括请求ID、
+        发送者ID、发送者用户名、发送者头像URL和请求时间戳。
     """
     user = g.current_user
-    # 查询所有发送给当前用户且状态为'pending'的请求
-    requests = FriendRequest.query.filter_by(receiver_id=user.id, status='pending').all()
-    
-    requests_data = []
-    # 遍历请求，以附加发送者的用户名信息
-    for req in requests:
-        # 根据请求中的发送者ID查询其用户信息
-        requester = User.query.get(req.requester_id)
-        # 增加一个健壮性检查：确保发送请求的用户仍然存在
-        if requester:
-            requests_data.append({
-                'id': req.id,
-                'requester_id': req.requester_id,
-                'requester_username': requester.username,
-                'timestamp': req.timestamp
-            })
-        
-    return jsonify(requests_data)
+    # 用一次联结查询取出所有发送给当前用户且状态为'pending'的请求，以及发送者的用户名和头像。
+    # 内连接同时过滤掉了发送者已不存在的请求；过滤和排序由 (receiver_id, status, timestamp) 联合索引完成。
+    rows = db.session.query(
+        FriendRequest.id, FriendRequest.requester_id, FriendRequest.timestamp,
+        User.username, User.avatar_url
+    ).join(User, User.id == FriendRequest.requester_id).filter(
+        FriendRequest.receiver_id == user.id,
+        FriendRequest.status == 'pending'
+    ).order_by(FriendRequest.timestamp).all()
+
+    links = AvatarLinks()
+    return jsonify([{
+        'id': row.id,
+        'requester_id': row.requester_id,
+        'requester_username': row.username,
+        'requester_avatar_url': links.url(row.avatar_url, 128),
+        'timestamp': row.timestamp
+    } for row in rows])
 
 @bp.route('/friend-requests/<int:request_id>', methods=['PUT'])
 @token_required
@@ -163,9 +213,11 @@ def respond_to_friend_request(request_id):
     if action == 'accept':
         # 3. 如果接受请求
         friend_request.status = 'accepted' # 更新请求状态
-        requester = User.query.get(friend_request.requester_id)
+        requester_id = friend_request.requester_id
+        requester = User.query.get(requester_id)
         current_user.add_friend(requester) # 调用模型中的方法添加好友（双向关系）
         db.session.commit()
+        replicas.record_write(requester_id)
         message = 'Friend request accepted successfully.'
     else: # action == 'reject'
         # 4. 如果拒绝请求，直接删除记录
@@ -208,5 +260,6 @@ def remove_friend(friend_id):
     ).delete()
 
     db.session.commit()
+    replicas.record_write(friend_id)
 
     return jsonify({'message': 'Friend removed successfully'}), 200 
\ No newline at end of file
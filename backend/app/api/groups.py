@@ -0,0 +1,159 @@
+from flask import jsonify, g, request, current_app
+from sqlalchemy import func
+from app.api import bp
+from app.api.auth import token_required
+from app.models import User, ChatGroup, GroupMembership
+from app.groups import member_joined, member_left, group_deleted
+from app import db, presence, friend_graph
+
+# 群聊相关的所有API操作都需要token认证。群消息通过 Socket.IO 的 'group_message' 事件收发（见 socket_events.py）
+
+def group_json(group, member_count):
+    return {
+        'id': group.id,
+        'name': group.name,
+        'creator_id': group.creator_id,
+        'member_count': member_count
+    }
+
+def get_membership(group_id, user_id):
+    """按主键 (group_id, user_id) 查询成员关系，不是成员时返回 None。"""
+    return GroupMembership.query.get((group_id, user_id))
+
+@bp.route('/groups', methods=['GET'])
+@token_required
+def get_groups():
+    """
+    获取当前用户加入的所有群，按群ID排序。
+    一次查询：通过 (user_id, group_id) 索引找到用户的群，再按群统计成员数。
+    """
+    user = g.current_user
+    mine = db.session.query(GroupMembership.group_id).filter(GroupMembership.user_id == user.id).subquery()
+    rows = db.session.query(ChatGroup, func.count(GroupMembership.user_id)).join(
+        GroupMembership, GroupMembership.group_id == ChatGroup.id
+    ).filter(ChatGroup.id.in_(db.session.query(mine.c.group_id))).group_by(ChatGroup.id).order_by(ChatGroup.id)
+    return jsonify([group_json(group, count) for group, count in rows])
+
+@bp.route('/groups', methods=['POST'])
+@token_required
+def create_group():
+    """
+    创建一个群，当前用户为群主。
+    请求体:
+        - name (string): 群名称，1~64 个字符。
+        - members (list, 可选): 初始成员的用户名（字符串），必须都是当前用户的好友。
+    name 或 members 的类型不对时返回 400。
+    """
+    user = g.current_user
+    data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    name = data.get('name')
+    if not isinstance(name, str) or not name.strip() or len(name.strip()) > 64:
+        return jsonify({'error': 'Group name must be 1-64 characters'}), 400
+    name = name.strip()
+    members = data.get('members')
+    if members is None:
+        members = []
+    if not isinstance(members, list) or not all(isinstance(member, str) for member in members):
+        return jsonify({'error': 'members must be a list of strings'}), 400
+    usernames = set(members) - {user.username}
+    if len(usernames) + 1 > current_app.config['GROUP_MAX_MEMBERS']:
+        return jsonify({'error': 'Too many members'}), 400
+
+    members = db.session.query(User.id, User.username).filter(User.username.in_(usernames)).all() \
+        if usernames else []
+    if len(members) != len(usernames) or not all(friend_graph.is_friend(user.id, m.id) for m in members):
+        return jsonify({'error': 'Members must be your friends'}), 400
+
+    group = ChatGroup(name=name, creator_id=user.id)
+    db.session.add(group)
+    db.session.flush()
+    db.session.add_all([GroupMembership(group_id=group.id, user_id=member_id)
+                        for member_id in [user.id] + [m.id for m in members]])
+    db.session.commit()
+
+    for username in [user.username] + [m.username for m in members]:
+        member_joined(group, username)
+    return jsonify(group_json(group, len(members) + 1)), 201
+
+@bp.route('/groups/<int:group_id>', methods=['DELETE'])
+@token_required
+def delete_group(group_id):
+    """[群主] 解散群。所有成员都会收到 'group_deleted' 事件。"""
+    group = ChatGroup.query.get(group_id)
+    if not group or not get_membership(group_id, g.current_user.id):
+        return jsonify({'error': 'Group not found'}), 404
+    if group.creator_id != g.current_user.id:
+        return jsonify({'error': 'Only the group owner can delete the group'}), 403
+    db.session.delete(group)
+    db.session.commit()
+    group_deleted(group_id)
+    return jsonify({'message': 'Group deleted'}), 200
+
+@bp.route('/groups/<int:group_id>/members', methods=['GET'])
+@token_required
+def get_group_members(group_id):
+    """获取群成员列表（只有群成员可以查看），在线状态通过在线状态注册表一次性批量判断。"""
+    if not get_membership(group_id, g.current_user.id):
+        return jsonify({'error': 'Group not found'}), 404
+    rows = db.session.query(User.id, User.username).join(
+        GroupMembership, GroupMembership.user_id == User.id
+    ).filter(GroupMembership.group_id == group_id).order_by(User.id).all()
+    online = presence.online_among(row.username for row in rows)
+    return jsonify([{
+        'id': row.id,
+        'username': row.username,
+        'is_online': row.username in online
+    } for row in rows])
+
+@bp.route('/groups/<int:group_id>/members', methods=['POST'])
+@token_required
+def add_group_member(group_id):
+    """
+    邀请一个好友加入群（任何成员都可以邀请）。
+    请求体:
+        - username (string): 被邀请的用户名，必须是当前用户的好友。
+    """
+    user = g.current_user
+    group = ChatGroup.query.get(group_id)
+    if not group or not get_membership(group_id, user.id):
+        return jsonify({'error': 'Group not found'}), 404
+    username = (request.get_json() or {}).get('username')
+    target = User.query.filter_by(username=username).first() if username else None
+    if not target or not friend_graph.is_friend(user.id, target.id):
+        return jsonify({'error': 'You can only add your friends'}), 400
+    if get_membership(group_id, target.id):
+        return jsonify({'error': 'User is already a member'}), 400
+    if group.memberships.count() >= current_app.config['GROUP_MAX_MEMBERS']:
+        return jsonify({'error': 'Group is full'}), 400
+
+    db.session.add(GroupMembership(group_id=group_id, user_id=target.id))
+    db.session.commit()
+    member_joined(group, target.username)
+    return jsonify({'message': f'{target.username} joined the group'}), 201
+
+@bp.route('/groups/<int:group_id>/members/<string:username>', methods=['DELETE'])
+@token_required
+def remove_group_member(group_id, username):
+    """
+    退出群（username 为自己），或由群主移除其他成员。
+    群主不能退出，只能解散群。
+    """
+    user = g.current_user
+    group = ChatGroup.query.get(group_id)
+    if not group or not get_membership(group_id, user.id):
+        return jsonify({'error': 'Group not found'}), 404
+    if username != user.username and group.creator_id != user.id:
+        return jsonify({'error': 'Only the group owner can remove members'}), 403
+    if username == user.username and group.creator_id == user.id:
+        return jsonify({'error': 'The group owner cannot leave; delete the group instead'}), 400
+    target = User.query.filter_by(username=username).first()
+    membership = get_membership(group_id, target.id) if target else None
+    if not membership:
+        return jsonify({'error': 'User is not a member'}), 404
+
+    db.session.delete(membership)
+    db.session.commit()
+    member_left(group_id, username)
+    return jsonify({'message': f'{username} left the group'}), 200
@@ -1,10 +1,12 @@
-from flask import jsonify, g
+from flask import jsonify, g, request
 from app.api import bp
 from app.api.auth import token_required
-from app.models import User
+from app.api.pagination import parse_usernames
+from app import presence, presence_writer, identity_cache, friend_graph, replicas
 
 @bp.route('/users/<string:username>/info', methods=['GET'])
 @token_required
+@replicas.read_only
 def get_user_info(username):
     """
     获取指定用户的在线状态和P2P连接信息（IP地址和端口）。
@@ -28,7 +30,7 @@ def get_user_info(username):
     # g.current_user 由 @token_required 装饰器提供
     current_user = g.current_user
     # 根据路径参数中的用户名查找目标用户
-    target_user = User.query.filter_by(username=username).first()
+    target_user = identity_cache.get_user_by_username(username)
 
     # 如果在数据库中找不到该用户，返回404错误
     if not target_user:
@@ -40,18 +42,65 @@ def get_user_info(username):
     if target_user.id != current_user.id and not current_user.is_friend(target_user):
         return jsonify({'error': 'Access denied: you can only view info for your friends.'}), 403
 
-    # 如果目标用户当前是离线状态
-    if not target_user.is_online:
+    # 如果目标用户当前是离线状态（以在线状态注册表为准，而不是数据库中可能过期的标记）
+    if not presence.is_online(target_user.username):
         # 只返回安全的、非敏感的基本信息
         return jsonify({
             'username': target_user.username,
             'is_online': False
         }), 200
 
-    # 如果用户在线，并且权限检查通过，则返回完整的P2P连接信息
+    # 如果用户在线，并且权限检查通过，则返回完整的P2P连接信息（以在线状态写入缓冲区中尚未写入数据库的值为准）
+    _, ip_address, port = presence_writer.overlay(
+        target_user.id, True, target_user.ip_address, target_user.port)
     return jsonify({
         'username': target_user.username,
         'is_online': True,
-        'ip_address': target_user.ip_address,
-        'port': target_user.port
-    })
\ No newline at end of file
+        'ip_address': ip_address,
+        'port': port
+    })
+
+@bp.route('/users/info', methods=['POST'])
+@token_required
+@replicas.read_only
+def get_users_info():
+    """
+    批量获取多个用户的在线状态和P2P连接信息，例如打开聊天界面时一次取得所有好友的连接信息。
+
+    请求体JSON参数:
+        - usernames (list): 目标用户名，最多 MAX_BATCH_USERNAMES 个。
+
+    与单个用户的接口相同，只能查询自己和好友。好友关系只与请求者的好友ID集合（好友关系图缓存）比较一次，
+    在线状态和连接信息直接从在线状态注册表中读取，不查询 users 表；
+    只有身份缓存中没有的用户名需要一次批量查询来解析用户ID。
+
+    返回:
+        - users: 有权查询的用户，在线用户带有 ip_address 和 port，格式与单个用户的接口相同。
+        - denied: 不是请求者好友的用户名。
+        - missing: 不存在的用户名。
+    """
+    try:
+        usernames = parse_usernames(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    current_user_id = g.current_user.id
+    user_ids = identity_cache.resolve_usernames(usernames)
+    friend_ids = friend_graph.friend_ids(current_user_id)
+    allowed = [name for name in usernames
+               if name in user_ids and (user_ids[name] == current_user_id or user_ids[name] in friend_ids)]
+    connection_info = presence.connection_info(allowed)
+
+    users = []
+    for username in allowed:
+        if username in connection_info:
+            ip_address, port = connection_info[username]
+            users.append({'username': username, 'is_online': True, 'ip_address': ip_address, 'port': port})
+        else:
+            users.append({'username': username, 'is_online': False})
+    allowed = set(allowed)
+    return jsonify({
+        'users': users,
+        'denied': [name for name in usernames if name in user_ids and name not in allowed],
+        'missing': [name for name in usernames if name not in user_ids]
+    })
@@ -0,0 +1,90 @@
+import hashlib
+from flask import current_app, jsonify, request, url_for
+
+"""
+列表接口的键集分页 (Keyset Pagination) 与条件请求 (ETag / 304) 工具。
+
+分页参数:
+    - limit: 每页条数，范围 1 ~ MAX_PAGE_SIZE。不提供时返回完整列表，与旧版本的客户端保持兼容。
+    - after: 上一页最后一条记录的ID。结果总是按ID升序排列，翻页期间插入或删除数据不会导致重复或遗漏。
+
+响应体仍然是JSON数组。还有下一页时，响应头中带有:
+    - X-Next-Cursor: 下一页应使用的 after 值；
+    - Link: <下一页的完整URL>; rel="next"
+
+每个列表接口根据一个廉价的版本信息（见各接口）计算弱ETag。客户端在 If-None-Match 中带上
+之前收到的ETag时，如果列表没有变化，服务器直接返回 304，不再查询和序列化列表内容。
+
+批量查询接口在请求体中用 usernames 列出要查询的用户，数量不超过 MAX_BATCH_USERNAMES。
+"""
+
+MAX_PAGE_SIZE = 1000
+# 批量查询接口（按用户名列表）一次最多接受的用户名数
+MAX_BATCH_USERNAMES = 1000
+
+
+def parse_page_args():
+    """解析并校验 limit/after 查询参数，返回 (limit, after)。参数非法时抛出 ValueError。"""
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+    try:
+        limit = int(limit) if limit is not None else None
+        after = int(after) if after is not None else None
+    except ValueError:
+        raise ValueError('limit and after must be integers')
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    return limit, after
+
+
+def parse_usernames(data):
+    """从请求体中取出 usernames 列表（去重并保持顺序）。参数非法时抛出 ValueError。"""
+    usernames = data.get('usernames') if isinstance(data, dict) else None
+    if not isinstance(usernames, list) or not all(isinstance(name, str) for name in usernames):
+        raise ValueError('usernames must be a list of strings')
+    usernames = list(dict.fromkeys(usernames))
+    if len(usernames) > MAX_BATCH_USERNAMES:
+        raise ValueError(f'At most {MAX_BATCH_USERNAMES} usernames per request')
+    return usernames
+
+
+def make_etag(*parts):
+    """由版本信息和分页参数生成ETag的值。"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:24]
+
+
+def not_modified(etag):
+    """客户端缓存的ETag仍然有效时返回 304 响应，否则返回 None。"""
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    return None
+
+
+def paginate(query, id_column, limit, after):
+    """
+    对查询应用键集分页，返回 (本页的行, 下一页的 after 值)。
+    多取一行来判断是否还有下一页；没有下一页时后者为 None。
+    """
+    if after is not None:
+        query = query.filter(id_column > after)
+    query = query.order_by(id_column)
+    if limit is None:
+        return query.all(), None
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
+
+
+def list_response(items, etag, limit, next_after):
+    """构建列表响应：JSON数组、弱ETag，以及还有下一页时的分页响应头。"""
+    response = jsonify(items)
+    response.set_etag(etag, weak=True)
+    if next_after is not None:
+        args = dict(request.view_args or {}, limit=limit, after=next_after)
+        response.headers['X-Next-Cursor'] = str(next_after)
+        response.headers['Link'] = f'<{url_for(request.endpoint, _external=True, **args)}>; rel="next"'
+    return response
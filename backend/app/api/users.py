@@ -1,12 +1,14 @@
-from flask import request, jsonify, current_app, g, url_for
+from flask import request, jsonify, current_app, g, abort
 from app.api import bp
 from app.models import User
-from app import db
+from app import db, presence, identity_cache, avatar_pipeline, replicas
+from app.avatars import AvatarLinks, InvalidAvatar, requested_size
+from app.password_hasher import PasswordHasherBusy
 import jwt
 from datetime import datetime, timedelta, timezone
 from app.api.auth import token_required
-import os
-from werkzeug.utils import secure_filename
+from app.api.pagination import parse_usernames
+from sqlalchemy import case, null
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
@@ -15,6 +17,13 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@bp.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    """密码哈希进程池已满时（注册、登录、修改密码），让客户端稍后重试，而不是继续排队。"""
+    response = jsonify({'error': 'Server is busy, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 # 检查服务器是否运行
 @bp.route('/ping')
 def ping():
@@ -49,6 +58,9 @@ def register():
     # 验证用户名长度
     if len(username) > 15:
         return jsonify({'error': 'Username cannot exceed 15 characters'}), 400
+    # 冒号保留给群聊房间名（group:<id>），避免与以用户名命名的个人房间冲突
+    if ':' in username:
+        return jsonify({'error': 'Username cannot contain ":"'}), 400
 
     # 检查用户名是否已存在，保证唯一性
     if User.query.filter_by(username=username).first():
@@ -79,10 +91,11 @@ def login():
     业务逻辑:
         1. 验证用户名和密码。
         2. 如果验证成功，更新用户在数据库中的IP地址和端口号。
+           如果存储的密码哈希使用的是旧的工作因子，顺便用新的工作因子重新计算。
         3. 生成一个包含用户ID和过期时间的JWT。
     返回:
         - 成功: 返回JWT。
-        - 失败: 返回401 Unauthorized错误。
+        - 失败: 返回401 Unauthorized错误；密码哈希进程池繁忙时返回503。
     """
     data = request.get_json()
     if not data:
@@ -105,12 +118,26 @@ def login():
     port = data.get('port')
     if port:
         user.port = port
+
+    # 存储的哈希使用的是旧的工作因子时，借此机会用当前配置重新计算。
+    # 这一步不是必需的，哈希进程池繁忙时跳过，留到下次登录。
+    rehashed = False
+    if user.password_needs_rehash():
+        try:
+            user.set_password(password)
+            rehashed = True
+        except PasswordHasherBusy:
+            pass
+    # 提交会让实例过期，之后读取 user.id 会多一次查询，因此先取出
+    user_id = user.id
     db.session.commit()
+    if rehashed:
+        identity_cache.invalidate_user(user)
 
     # 生成JWT，有效期设置为24小时
     token = jwt.encode(
         {
-            'user_id': user.id,
+            'user_id': user_id,
             'exp': datetime.now(timezone.utc) + timedelta(hours=24) # 设置过期时间
         },
         current_app.config['SECRET_KEY'],  # 使用在应用配置中设置的密钥进行签名
@@ -133,24 +160,104 @@ def upload_key():
     
     # g.current_user 由 @token_required 装饰器提供
     user = g.current_user
-    user.public_key = data['public_key']
-    db.session.commit()
-    
-    return jsonify({'message': 'Public key updated successfully'}), 200
+    # 同时更新公钥指纹和版本号；重复上传同一把公钥不会产生写入
+    if user.set_public_key(data['public_key']):
+        db.session.commit()
+
+    return jsonify({
+        'message': 'Public key updated successfully',
+        'fingerprint': user.public_key_fingerprint,
+        'key_version': user.public_key_version
+    }), 200
+
+def _public_key_unless(condition):
+    """公钥全文列：满足 condition（客户端已有这把公钥）时取 NULL，不再从数据库读取和传输公钥全文。"""
+    return case((condition, null()), else_=User.public_key).label('public_key')
+
+def _public_key_json(row):
+    return {
+        'user_id': row.id,
+        'username': row.username,
+        'public_key': row.public_key,
+        'fingerprint': row.public_key_fingerprint,
+        'key_version': row.public_key_version
+    }
 
 @bp.route('/users/<string:username>/public_key', methods=['GET'])
 @token_required
+@replicas.read_only
 def get_public_key(username):
-    """获取指定用户的公钥，用于加密通信的发起方。"""
-    # first_or_404: 如果找不到用户，会自动返回404错误
-    user = User.query.filter_by(username=username).first_or_404()
-    if not user.public_key:
+    """
+    获取指定用户的公钥，用于加密通信的发起方。
+    响应带有以公钥指纹为值的强ETag；客户端在 If-None-Match 中带上已有公钥的指纹时，
+    如果公钥没有更换则返回 304，不传输公钥全文。只需一次按用户名索引的查询。
+    """
+    etags = list(request.if_none_match)
+    public_key = _public_key_unless(User.public_key_fingerprint.in_(etags)) if etags else User.public_key
+    row = db.session.query(User.id, User.username, User.public_key_fingerprint, User.public_key_version,
+                           public_key).filter(User.username == username).first()
+    # 找不到用户时返回404错误
+    if row is None:
+        abort(404)
+    if not row.public_key_fingerprint:
         return jsonify({'error': 'User has not uploaded a public key'}), 404
-        
+
+    if request.if_none_match.contains(row.public_key_fingerprint):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(_public_key_json(row))
+    response.set_etag(row.public_key_fingerprint)
+    # 允许客户端缓存，但每次使用前都要用 If-None-Match 重新验证
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@bp.route('/users/public_keys', methods=['POST'])
+@token_required
+@replicas.read_only
+def get_public_keys():
+    """
+    批量获取多个用户的公钥，一次按用户名索引的查询取出所有结果。
+    请求体JSON参数:
+        - usernames (list): 要查询的用户名，最多 MAX_BATCH_USERNAMES 个。
+        - known (object, 可选): 用户名 -> 客户端已缓存的公钥指纹。指纹未变化的用户只出现在 unchanged 中，
+          不返回公钥全文。
+    返回:
+        - keys: 新的或已更换的公钥（含指纹和版本号）。
+        - unchanged: 客户端已有最新公钥的用户名。
+        - missing: 不存在或尚未上传公钥的用户名。
+    """
+    data = request.get_json(silent=True)
+    try:
+        usernames = parse_usernames(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    known = data.get('known') or {}
+    if not isinstance(known, dict):
+        return jsonify({'error': 'known must be an object of username -> fingerprint'}), 400
+    known = {name: known[name] for name in usernames if isinstance(known.get(name), str)}
+
+    rows = []
+    if usernames:
+        public_key = User.public_key
+        if known:
+            # 每个用户与客户端为其提供的指纹比较，指纹相同时不取公钥全文
+            client_fingerprint = case(known, value=User.username, else_=null())
+            public_key = _public_key_unless(User.public_key_fingerprint == client_fingerprint)
+        rows = db.session.query(User.id, User.username, User.public_key_fingerprint, User.public_key_version,
+                                public_key).filter(User.username.in_(usernames),
+                                                   User.public_key_fingerprint.isnot(None)).all()
+    keys, unchanged = [], []
+    for row in rows:
+        if known.get(row.username) == row.public_key_fingerprint:
+            unchanged.append(row.username)
+        else:
+            keys.append(_public_key_json(row))
+    found = {row.username for row in rows}
     return jsonify({
-        'user_id': user.id,
-        'username': user.username,
-        'public_key': user.public_key
+        'keys': keys,
+        'unchanged': unchanged,
+        'missing': [name for name in usernames if name not in found]
     })
 
 @bp.route('/user/email', methods=['PUT'])
@@ -169,6 +276,7 @@ def update_email():
 
     user.email = new_email
     db.session.commit()
+    identity_cache.invalidate_user(user)
     return jsonify({'message': 'Email updated successfully'}), 200
 
 @bp.route('/user/password', methods=['PUT'])
@@ -187,24 +295,30 @@ def update_password():
     # 设置新密码（同样会经过哈希处理）
     user.set_password(data['new_password'])
     db.session.commit()
+    identity_cache.invalidate_user(user)
     return jsonify({'message': 'Password updated successfully'}), 200
 
 @bp.route('/users/<string:username>/profile', methods=['GET'])
 @token_required
+@replicas.read_only
 def get_user_profile(username):
     """获取指定用户的公开个人资料。"""
-    user = User.query.filter_by(username=username).first_or_404()
+    user = identity_cache.get_user_by_username(username)
+    if user is None:
+        abort(404)
+    links = AvatarLinks()
     # 返回用户的公开信息
     return jsonify({
         'id': user.id,
         'username': user.username,
         'email': user.email, # 注意：此处返回email，前端可以根据需要决定是否对非好友隐藏
-        'is_online': user.is_online,
+        'is_online': presence.is_online(user.username),
         'gender': user.gender,
         'age': user.age,
         'bio': user.bio,
-        # 生成完整的头像URL
-        'avatar_url': url_for('static', filename=user.avatar_url, _external=True) if user.avatar_url else None
+        # 生成完整的头像URL，默认使用最大的尺寸，可用 avatar_size 参数选择其他尺寸
+        'avatar_url': links.url(user.avatar_url, requested_size(512)),
+        'avatar_url_template': links.template(user.avatar_url)
     })
 
 @bp.route('/user/profile', methods=['PUT'])
@@ -223,6 +337,7 @@ def update_profile():
     user.bio = data.get('bio', user.bio)
 
     db.session.commit()
+    identity_cache.invalidate_user(user)
     return jsonify({'message': 'Profile updated successfully'}), 200
 
 @bp.route('/user/avatar', methods=['POST'])
@@ -233,6 +348,10 @@ def upload_avatar():
     请求为 multipart/form-data 类型。
     表单字段名:
         - avatar: 包含图片文件的字段。
+    处理方式:
+        请求中只检查文件类型和图片头信息，随后立即返回 202。
+        缩略图（多个尺寸的 WebP 和 JPEG）由后台任务生成，完成后才替换数据库中的头像，
+        并向该用户推送 'avatar_updated' 事件（见 app/avatars.py）。
     """
     # 检查请求中是否包含文件部分
     if 'avatar' not in request.files:
@@ -245,37 +364,18 @@ def upload_avatar():
     # 检查文件类型是否合法
     if file and allowed_file(file.filename):
         user = g.current_user
-        # 使用 secure_filename 清理文件名，防止不安全字符。
-        # 然后结合用户ID和原始扩展名构造一个唯一的、安全的新文件名，避免冲突和覆盖。
-        original_ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = secure_filename(f"user_{user.id}.{original_ext}")
-        
-        # 获取static文件夹的绝对路径
-        static_folder = current_app.static_folder
-        if not static_folder:
-            # 这是一个服务器配置问题
-            return jsonify({'error': 'Static folder not configured'}), 500
-
-        # 构造头像存储的完整目录路径
-        avatar_dir = os.path.join(static_folder, 'avatars')
-        # 确保目录存在，如果不存在则创建它
-        os.makedirs(avatar_dir, exist_ok=True)
-        
-        # 构造文件的完整保存路径
-        full_path = os.path.join(avatar_dir, filename)
-        # 保存文件到服务器
-        file.save(full_path)
-
-        # 在数据库中只保存相对于avatars目录的相对路径，便于管理
-        db_avatar_path = f"avatars/{filename}"
-        user.avatar_url = db_avatar_path
-        db.session.commit()
+        try:
+            key = avatar_pipeline.submit(user.id, file.read())
+        except InvalidAvatar as e:
+            return jsonify({'error': str(e)}), 400
 
+        links = AvatarLinks()
         return jsonify({
-            'message': '头像上传成功',
-            # 返回新的头像URL，方便前端立即更新显示
-            'avatar_url': url_for('static', filename=db_avatar_path, _external=True)
-        }), 200
+            'message': '头像上传成功，正在处理',
+            # 返回处理完成后的头像URL，方便前端在收到 'avatar_updated' 事件后更新显示
+            'avatar_url': links.url(key, 512),
+            'avatar_url_template': links.template(key)
+        }), 202
     else:
         # 如果文件类型不被允许
         return jsonify({'error': '文件类型不被允许'}), 400
\ No newline at end of file
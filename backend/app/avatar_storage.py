@@ -0,0 +1,175 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+"""
+头像存储后端 (Avatar Storage)
+
+头像文件按内容寻址：版本目录名由原图的 SHA-256 决定（见 app/avatars.py 中的 avatar_key），
+同一张图片无论由谁上传、上传多少次都只存一份，同一个文件名对应的内容永远不会改变，
+因此头像接口可以让浏览器和代理永久缓存（Cache-Control: immutable）。
+
+存储后端只需实现 AvatarStorage 中的几个方法，文件名是相对路径，例如 `avatars/<hash>/128.webp`：
+    - 'local': 本地文件系统（默认保存在 static 目录下，与旧版本的头像路径一致）。
+以后接入对象存储时，新增一个实现并注册到 STORAGE_BACKENDS 即可，头像流水线和下载接口无需修改。
+
+同一个版本目录可能同时被一个用户复用、被另一个用户的旧头像清理删除，两者都在 lock(name) 中执行，
+并在持有锁时重新检查文件和引用，见 AvatarPipeline._process。
+
+AvatarCache 是一个按字节数限制大小的 LRU 缓存，保存最常被请求的头像文件内容，命中时不访问存储。
+"""
+
+
+class AvatarStorage:
+    """存储后端接口。读写方法可能在没有应用上下文的原生线程中调用，所需配置应在 from_app 中读取。"""
+
+    _process_lock = threading.Lock()
+
+    @classmethod
+    def from_app(cls, app):
+        """根据应用配置创建实例。"""
+        raise NotImplementedError
+
+    def save(self, name, data):
+        """保存文件。同名文件已存在时覆盖，读取方不会看到写了一半的内容。"""
+        raise NotImplementedError
+
+    def read(self, name):
+        """返回文件内容；文件不存在时返回 None。"""
+        raise NotImplementedError
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def delete(self, name):
+        """删除一个文件，或一个版本目录及其中的所有文件。不存在时忽略。"""
+        raise NotImplementedError
+
+    def local_path(self, name):
+        """文件在本机上的绝对路径，供 X-Sendfile 使用；不在本机文件系统上的后端返回 None。"""
+        return None
+
+    @contextmanager
+    def lock(self, name):
+        """
+        串行化对同一个文件或版本目录的 "检查后写入/删除"。默认只在本进程内互斥，
+        被多个进程或多台机器共享的后端需要提供跨进程的实现。
+        """
+        with self._process_lock:
+            yield
+
+
+class LocalAvatarStorage(AvatarStorage):
+    """保存在本地目录 root 中。"""
+
+    def __init__(self, root):
+        self.root = root
+
+    @contextmanager
+    def lock(self, name):
+        """用 root 下的锁文件 (flock) 互斥，同一台机器上共享该目录的所有 worker 进程之间也有效。"""
+        if fcntl is None:
+            with super().lock(name):
+                yield
+            return
+        from app.concurrency import run_blocking
+        path = self.local_path('avatars/.lock')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as f:
+            # 等待锁时不阻塞协程服务器的事件循环；flock 属于打开的文件，可以在另一个线程中释放
+            run_blocking(fcntl.flock, f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @classmethod
+    def from_app(cls, app):
+        # 默认使用 static 目录，与旧版本的头像路径一致
+        return cls(app.config.get('AVATAR_STORAGE_PATH') or app.static_folder)
+
+    def local_path(self, name):
+        return os.path.join(self.root, name)
+
+    def save(self, name, data):
+        path = self.local_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read(self, name):
+        try:
+            with open(self.local_path(name), 'rb') as f:
+                return f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+
+    def exists(self, name):
+        return os.path.isfile(self.local_path(name))
+
+    def delete(self, name):
+        path = self.local_path(name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.isfile(path):
+            os.remove(path)
+
+
+# AVATAR_STORAGE 配置项的可选值
+STORAGE_BACKENDS = {
+    'local': LocalAvatarStorage,
+}
+
+
+class AvatarCache:
+    """线程安全的 LRU 缓存，按缓存内容的总字节数（而不是条目数）限制大小。"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            data = self._data.get(name)
+            if data is not None:
+                self._data.move_to_end(name)
+            return data
+
+    def set(self, name, data):
+        # 单个文件超过容量的四分之一时不缓存，避免一个大文件挤掉大量热点头像
+        if len(data) * 4 > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(name, None)
+            if old is not None:
+                self.size -= len(old)
+            self._data[name] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, prefix):
+        """删除某个文件或版本目录下的所有缓存条目。"""
+        with self._lock:
+            for name in [n for n in self._data if n == prefix or n.startswith(prefix + '/')]:
+                self.size -= len(self._data.pop(name))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,195 @@
+import hashlib
+import io
+from flask import current_app, url_for
+from app.avatar_storage import STORAGE_BACKENDS, AvatarCache
+from app.concurrency import run_blocking
+
+"""
+头像处理流水线 (Avatar Pipeline)
+
+上传的原图只在请求中做一次廉价的格式检查（只读取文件头），随后交给后台任务：
+    1. 完整解码一次，按 EXIF 方向旋转，居中裁剪为正方形；
+    2. 生成 AVATAR_SIZES 中每个尺寸的 WebP 版本和 JPEG 兜底版本，不保留任何元数据（EXIF、GPS 等）；
+    3. 所有文件写入存储后端（见 app/avatar_storage.py）后才更新数据库中的头像路径，客户端不会读到不完整的版本；
+    4. 删除该用户不再被引用的旧头像文件，并通过 Socket.IO 向该用户推送 'avatar_updated' 事件。
+       步骤 3 和 4 都在存储后端的锁中执行并在持锁时重新检查，不会删除刚被其他用户复用的版本目录。
+
+数据库中保存的是按内容寻址的版本目录，例如 `avatars/3f2a1b0c9d8e7f6a3f2a1b0c9d8e7f6a`，
+对应的文件为 `<目录>/<尺寸>.<webp|jpg>`，由 `GET /api/avatars/...` 接口提供并允许永久缓存。
+相同的图片只处理和保存一次。旧版本直接保存原图路径（带扩展名），仍然通过 static 目录访问。
+
+接口返回的 `avatar_url` 指向适合该场景的尺寸，`avatar_url_template` 中的 `{size}` 和 `{format}`
+可由客户端替换为需要的尺寸和格式。
+"""
+
+# 生成的正方形边长（像素），以及每种输出格式对应的 Pillow 编码参数
+AVATAR_SIZES = (48, 128, 512)
+AVATAR_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+# 解码前允许的最大像素数，防止"解压缩炸弹"耗尽内存
+MAX_AVATAR_PIXELS = 40 * 1000 * 1000
+
+
+class InvalidAvatar(ValueError):
+    """上传的文件不是可以处理的图片。"""
+
+
+def inspect_upload(data):
+    """只读取文件头，检查上传内容是否为尺寸合理的图片。不合格时抛出 InvalidAvatar。"""
+    from PIL import Image
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+    except Exception:
+        raise InvalidAvatar('Uploaded file is not a valid image')
+    if width * height > MAX_AVATAR_PIXELS:
+        raise InvalidAvatar('Image is too large')
+
+
+def render_variants(data):
+    """把原图解码一次，返回 {(尺寸, 扩展名): 编码后的字节}。"""
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    # 居中裁剪为正方形，再从大到小依次缩放，每次都以上一级结果为源，减少计算量
+    side = min(image.size)
+    left, top = (image.width - side) // 2, (image.height - side) // 2
+    source = image.crop((left, top, left + side, top + side))
+
+    variants = {}
+    for size in sorted(AVATAR_SIZES, reverse=True):
+        if source.width != size:
+            source = source.resize((size, size), Image.LANCZOS)
+        for ext, (fmt, options) in AVATAR_FORMATS.items():
+            frame = source
+            if fmt == 'JPEG' and frame.mode == 'RGBA':
+                # JPEG 不支持透明通道，铺在白色背景上
+                frame = Image.new('RGB', source.size, (255, 255, 255))
+                frame.paste(source, mask=source.split()[3])
+            buffer = io.BytesIO()
+            frame.save(buffer, fmt, **options)
+            variants[(size, ext)] = buffer.getvalue()
+    return variants
+
+
+def avatar_key(data):
+    """头像版本目录，由原图内容决定，相同的图片（无论由谁上传）得到同一目录。"""
+    return f'avatars/{hashlib.sha256(data).hexdigest()[:32]}'
+
+
+def variant_name(avatar_path, size, ext):
+    """版本目录中某个尺寸和格式的文件名。"""
+    return f'{avatar_path}/{size}.{ext}'
+
+
+def is_pipeline_path(avatar_path):
+    """流水线生成的是不带扩展名的版本目录；旧版本保存的是原图文件路径。"""
+    return bool(avatar_path) and '.' not in avatar_path.rsplit('/', 1)[-1]
+
+
+class AvatarLinks:
+    """为一批记录生成头像URL。URL前缀只用 url_for 计算一次。"""
+
+    def __init__(self):
+        self.static_url = url_for('static', filename='', _external=True)
+        # 头像接口的前缀 (.../api/avatars/)，路径参数不能为空，用一个占位字符生成后去掉
+        self.avatar_url = url_for('api.get_avatar', name='_', _external=True)[:-1]
+
+    def url(self, avatar_path, size=128, fmt='webp'):
+        if not avatar_path:
+            return None
+        if is_pipeline_path(avatar_path):
+            return self.avatar_url + variant_name(avatar_path.split('/', 1)[1], size, fmt)
+        return self.static_url + avatar_path
+
+    def template(self, avatar_path):
+        if not avatar_path:
+            return None
+        if is_pipeline_path(avatar_path):
+            return self.avatar_url + avatar_path.split('/', 1)[1] + '/{size}.{format}'
+        return self.static_url + avatar_path
+
+
+def requested_size(default):
+    """读取可选的 avatar_size 查询参数，只接受 AVATAR_SIZES 中的值。"""
+    from flask import request
+    size = request.args.get('avatar_size', type=int)
+    return size if size in AVATAR_SIZES else default
+
+
+class AvatarPipeline:
+    """在后台处理上传的头像，采用与 Flask 扩展相同的 init_app 模式。同时持有存储后端和热点缓存。"""
+
+    def __init__(self, app=None):
+        self.storage = None
+        self.cache = AvatarCache(32 * 1024 * 1024)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('AVATAR_STORAGE', 'local')
+        if backend not in STORAGE_BACKENDS:
+            raise ValueError(f'Unknown AVATAR_STORAGE: {backend}')
+        self.storage = STORAGE_BACKENDS[backend].from_app(app)
+        self.cache = AvatarCache(app.config.get('AVATAR_CACHE_BYTES', 32 * 1024 * 1024))
+        app.extensions['avatar_pipeline'] = self
+
+    def submit(self, user_id, data):
+        """检查上传内容并启动后台处理，返回新头像的版本目录。不合格时抛出 InvalidAvatar。"""
+        from app import socketio
+        inspect_upload(data)
+        key = avatar_key(data)
+        app = current_app._get_current_object()
+        # 后台任务中没有请求上下文，无法生成外部URL，完成通知的内容在这里预先生成
+        links = AvatarLinks()
+        event = {'avatar_url': links.url(key, 512), 'avatar_url_template': links.template(key)}
+        socketio.start_background_task(self._process, app, user_id, data, key, event)
+        return key
+
+    def _process(self, app, user_id, data, key, event):
+        from app import db, socketio, identity_cache
+        from app.models import User
+        with app.app_context():
+            try:
+                # 相同的图片已经处理过（例如另一个用户上传过）时直接复用；
+                # 图片解码和编码是CPU密集型操作，在原生线程中执行，不阻塞协程服务器的事件循环，也不占用锁
+                variants = None
+                if not run_blocking(self._is_complete, key):
+                    variants = run_blocking(render_variants, data)
+
+                user = User.query.get(user_id)
+                if user is None:
+                    return
+                with self.storage.lock(key):
+                    # 持锁时重新检查：版本目录可能刚被另一个用户的旧头像清理删除
+                    if not run_blocking(self._is_complete, key):
+                        run_blocking(self._save_variants, key, variants or run_blocking(render_variants, data))
+                    old_path = user.avatar_url
+                    user.avatar_url = key
+                    db.session.commit()
+                identity_cache.invalidate_user(user)
+                # 内容寻址的文件可能被其他用户共用，持锁确认没有用户引用后才删除
+                if old_path and old_path != key:
+                    with self.storage.lock(old_path):
+                        if User.query.filter_by(avatar_url=old_path).count() == 0:
+                            self.cache.discard(old_path)
+                            run_blocking(self.storage.delete, old_path)
+
+                socketio.emit('avatar_updated', event, to=user.username)
+            except Exception:
+                app.logger.exception('Avatar processing failed for user %s', user_id)
+            finally:
+                db.session.remove()
+
+    def _is_complete(self, key):
+        return all(self.storage.exists(variant_name(key, size, ext))
+                   for size in AVATAR_SIZES for ext in AVATAR_FORMATS)
+
+    def _save_variants(self, key, variants):
+        for (size, ext), content in variants.items():
+            self.storage.save(variant_name(key, size, ext), content)
@@ -0,0 +1,102 @@
+import os
+import time
+from engineio import json
+import socketio
+from app.sqlite_pool import SQLiteConnectionPool
+
+"""
+集群模式 (Cluster Mode) 支持
+
+多个 worker 进程同时运行时，每个 Socket.IO 客户端只连接到其中一个进程。
+为了让 `emit(..., to=username)`、管理员强制下线、好友请求通知等操作能够到达
+连接在任意 worker 上的客户端，所有 worker 需要通过一个消息队列互相转发这些操作。
+
+Flask-SocketIO 原生支持 Redis / Kafka / ZeroMQ / Kombu(AMQP) 作为消息队列，
+直接把相应的 URL 配置到 SOCKETIO_MESSAGE_QUEUE 即可。
+此外，本模块提供一个基于共享 SQLite 文件的队列实现（URL 形如 `sqlite:////path/to/queue.db`），
+适用于同一台机器上的多进程部署以及本地测试，不需要额外安装任何消息中间件。
+"""
+
+
+class SQLiteQueueManager(socketio.PubSubManager):
+    """
+    基于共享 SQLite 文件的 Socket.IO 客户端管理器。
+
+    发布消息时向 messages 表追加一行；每个 worker 的后台任务按自增ID轮询新消息，
+    并交给 PubSubManager 在本进程内完成实际的投递。
+    过期的消息会在发布时被周期性地清理，文件大小保持有界。
+    """
+    name = 'sqlite'
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None,
+                 poll_interval=0.01, retention=30.0):
+        if not url.startswith('sqlite:///'):
+            raise ValueError(f'Invalid SQLite message queue URL: {url}')
+        self.path = url[len('sqlite:///'):]
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._last_prune = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._pool = SQLiteConnectionPool(self.path, timeout=5.0,
+                                          setup=lambda conn: conn.execute('PRAGMA synchronous=NORMAL'))
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' channel TEXT NOT NULL,'
+                ' created_at REAL NOT NULL,'
+                ' payload TEXT NOT NULL)'
+            )
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _connect(self):
+        """从进程共享的连接池借出一个连接（with 块结束时归还）。"""
+        return self._pool.connection()
+
+    def _publish(self, data):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO messages (channel, created_at, payload) VALUES (?, ?, ?)',
+                (self.channel, now, json.dumps(data))
+            )
+            # 每秒最多清理一次过期消息，避免每次发布都执行删除
+            if now - self._last_prune > 1.0:
+                self._last_prune = now
+                conn.execute('DELETE FROM messages WHERE created_at < ?', (now - self.retention,))
+
+    def _listen(self):
+        # 只消费本 worker 启动之后发布的消息
+        with self._connect() as conn:
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM messages').fetchone()[0]
+        while True:
+            # 每次轮询单独借出连接，等待期间不占用连接池
+            with self._connect() as conn:
+                rows = conn.execute(
+                    'SELECT id, payload FROM messages WHERE channel = ? AND id > ? ORDER BY id',
+                    (self.channel, last_id)
+                ).fetchall()
+            for row_id, payload in rows:
+                last_id = row_id
+                yield payload
+            if not rows:
+                # 使用服务器提供的 sleep，以兼容 threading / eventlet / gevent 等异步模式
+                self.server.sleep(self.poll_interval)
+
+
+def socketio_queue_options(app):
+    """
+    根据应用配置生成传给 `socketio.init_app` 的消息队列相关参数。
+
+    - 未配置 SOCKETIO_MESSAGE_QUEUE 时返回空字典（单进程模式）。
+    - `sqlite://` 开头的 URL 使用本模块的 SQLiteQueueManager。
+    - 其他 URL（redis://、amqp://、kafka://、zmq+tcp:// 等）交给 Flask-SocketIO 自行处理。
+    """
+    url = app.config.get('SOCKETIO_MESSAGE_QUEUE')
+    channel = app.config.get('SOCKETIO_CHANNEL', 'flask-socketio')
+    if not url:
+        return {}
+    if url.startswith('sqlite://'):
+        return {'client_manager': SQLiteQueueManager(url, channel=channel)}
+    return {'message_queue': url, 'channel': channel}
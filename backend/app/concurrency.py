@@ -0,0 +1,28 @@
+"""
+阻塞调用的调度工具。
+
+在生产模式下服务器运行在 eventlet 或 gevent 的协程之上，所有连接共享同一个事件循环。
+bcrypt 哈希、磁盘文件写入这类长时间占用CPU或阻塞在系统调用上的操作，
+如果直接在协程中执行，会让整个进程内的其他连接都停顿下来。
+
+`run_blocking` 会根据当前的异步模式，把这类调用放到原生线程池中执行，
+当前协程在等待结果期间会让出控制权；在线程模式（开发服务器）下则直接调用。
+"""
+
+
+def current_async_mode():
+    """返回 Socket.IO 当前使用的异步模式：'threading'、'eventlet' 或 'gevent'。"""
+    from app import socketio
+    return getattr(socketio, 'async_mode', None) or 'threading'
+
+
+def run_blocking(func, *args, **kwargs):
+    """在不阻塞事件循环的前提下执行一个阻塞函数，并返回其结果。"""
+    mode = current_async_mode()
+    if mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    if mode == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
@@ -0,0 +1,95 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+"""
+数据库引擎配置 (Database Profile)
+
+根据 SQLALCHEMY_DATABASE_URI 的数据库类型，为 SQLAlchemy 引擎选择连接池参数，
+并在 SQLite 的每个新连接上设置 PRAGMA:
+
+    - SQLite 文件数据库:
+        * 使用 QueuePool 复用连接（Flask-SQLAlchemy 对 SQLite 文件默认使用 NullPool，每个请求都新建连接，
+          连接级的页缓存和 mmap 随之丢失），连接可以在线程/协程之间传递；
+        * journal_mode=WAL: 写事务不再阻塞读，上线/下线时的提交不会让好友列表等读请求排队；
+        * synchronous=NORMAL: WAL 模式下只在检查点时 fsync，断电最多丢失最近的几个事务，不会损坏数据库；
+        * mmap_size / cache_size: 用内存映射读取数据库文件，并扩大每个连接的页缓存；
+        * 锁等待超时 (busy timeout): 多个 worker 同时写入时等待而不是立即报 "database is locked"。
+    - PostgreSQL 等服务器数据库: 显式设置连接池大小、溢出连接数、取连接超时、连接回收时间，
+      并在取出连接时先 ping（pre-ping），数据库重启或连接被防火墙断开后自动重连。
+    - 内存数据库（测试）保持 Flask-SQLAlchemy 的默认设置。
+
+SQLALCHEMY_ENGINE_OPTIONS 中显式配置的选项优先于这里的默认值。
+"""
+
+
+def is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def engine_options(config):
+    """返回给定配置下的引擎参数（即 SQLALCHEMY_ENGINE_OPTIONS）。"""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        if not is_sqlite_file(uri) or not config['DB_POOL_SIZE']:
+            # 内存数据库，或 DB_POOL_SIZE 为 0 时不使用连接池（Flask-SQLAlchemy 的默认行为）
+            options = {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT']}} if is_sqlite_file(uri) else {}
+        else:
+            options = {
+                'poolclass': QueuePool,
+                'pool_size': config['DB_POOL_SIZE'],
+                'max_overflow': config['DB_MAX_OVERFLOW'],
+                'pool_timeout': config['DB_POOL_TIMEOUT'],
+                'connect_args': {'check_same_thread': False, 'timeout': config['SQLITE_BUSY_TIMEOUT']},
+            }
+    else:
+        options = {
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'pool_recycle': config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        }
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+def sqlite_pragmas(config):
+    """在 SQLite 的每个新连接上执行的 PRAGMA 语句。"""
+    pragmas = []
+    if config['SQLITE_WAL']:
+        pragmas.append('PRAGMA journal_mode=WAL')
+    pragmas.append(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+    pragmas.append(f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}")
+    # 负数表示以 KiB 为单位
+    pragmas.append(f"PRAGMA cache_size={-int(config['SQLITE_CACHE_SIZE_KB'])}")
+    return pragmas
+
+
+def register_pragmas(app, engine, uri):
+    """为 SQLite 文件数据库的引擎注册 PRAGMA 钩子，之后新建的每个连接都会执行；其他数据库什么也不做。"""
+    if not is_sqlite_file(uri):
+        return
+    pragmas = sqlite_pragmas(app.config)
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    event.listen(engine, 'connect', set_pragmas)
+
+
+def init_database(app, db):
+    """在 create_app 中 db.init_app 之后调用：写入引擎参数，并为 SQLite 文件数据库注册 PRAGMA 钩子。"""
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    if not is_sqlite_file(app.config['SQLALCHEMY_DATABASE_URI']):
+        return
+    # 引擎在第一次使用时才由 Flask-SQLAlchemy 创建，这里提前创建引擎并注册钩子，保证每个连接都会执行
+    with app.app_context():
+        register_pragmas(app, db.engine, app.config['SQLALCHEMY_DATABASE_URI'])
@@ -0,0 +1,259 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, or_
+from sqlalchemy.orm import Session
+
+"""
+好友关系图缓存 (Friend-Graph Cache)
+
+好友关系是对称的，friendships 表中每对好友存有两行。本模块在每个 worker 进程内
+维护一份邻接表: user_id -> 好友ID组成的 frozenset，使 `is_friend` 和"列出好友ID"
+分别只需 O(1) 和 O(好友数)，不产生任何 SQL 查询。
+
+    - 加载: 默认按用户懒加载（一次走主键索引的查询）；
+      配置 FRIEND_GRAPH_PRELOAD 后，worker 启动时用一次流式查询加载整张图。
+    - 本进程内的增量维护: `User.add_friend` / `remove_friend` 把变更登记在当前数据库会话上，
+      事务提交后才应用到邻接表，回滚时直接丢弃，缓存不会出现未提交的好友关系。
+    - 跨进程失效: 同一事务中向 friend_graph_changes 表追加受影响的用户ID。
+      各 worker 每隔 FRIEND_GRAPH_SYNC_INTERVAL 秒读取一次新的变更记录，重新加载这些用户的邻接表。
+      自增主键在分配时就已确定，较早开始、较晚提交的事务会在游标之后才出现较小的ID，
+      因此每次同步除了读取游标之后的记录，还会重新扫描最近 FRIEND_GRAPH_SYNC_OVERLAP 秒内写入的记录，
+      跳过已经处理过的ID。查询量只与这段时间内的变更数有关，与请求量无关。
+    - 兜底: 每隔 FRIEND_GRAPH_REFRESH_INTERVAL 秒整体清空一次，限制任何异常情况下的最长不一致时间。
+
+内存占用见 benchmarks/bench_friend_graph.py。
+"""
+
+# 记录在数据库会话 info 中、等待事务提交后应用的变更
+_PENDING_KEY = 'friend_graph_pending'
+
+
+class FriendGraph:
+    """进程内的好友邻接表缓存，采用与 Flask 扩展相同的 init_app 模式。"""
+
+    def __init__(self, app=None):
+        self.sync_interval = 1.0
+        self.refresh_interval = 600.0
+        self.change_retention = 3600.0
+        self.sync_overlap = 30.0
+        self._lock = threading.Lock()
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.sync_interval = app.config.get('FRIEND_GRAPH_SYNC_INTERVAL', 1.0)
+        self.refresh_interval = app.config.get('FRIEND_GRAPH_REFRESH_INTERVAL', 600.0)
+        self.change_retention = app.config.get('FRIEND_GRAPH_CHANGE_RETENTION', 3600.0)
+        self.sync_overlap = app.config.get('FRIEND_GRAPH_SYNC_OVERLAP', 30.0)
+        # 每次创建应用都使用全新的缓存，避免测试中不同数据库之间的用户ID互相污染
+        self.clear()
+        app.extensions['friend_graph'] = self
+
+    def _reset(self):
+        self._adjacency = {}
+        # 同一个用户ID在所有邻接集合中共享同一个 int 对象，每条边只占用集合槽位的内存
+        self._interned = {}
+        # 是否已加载整张图：为 True 时，表中没有的用户即为没有好友
+        self._complete = False
+        self._last_change_id = None
+        # 重叠窗口内已处理过的变更记录: id -> 写入时间
+        self._seen_changes = {}
+        self._last_sync = 0.0
+        self._loaded_at = time.monotonic()
+        self._last_prune = 0.0
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    # --- 查询 ---
+
+    def friend_ids(self, user_id):
+        """返回该用户所有好友ID组成的 frozenset。"""
+        from app import replicas
+        # 邻接表和变更日志的位置必须来自同一个数据库，因此即使在只读接口中也从主库加载
+        with replicas.primary():
+            self._maybe_sync()
+            friends = self._adjacency.get(user_id)
+            if friends is None:
+                if self._complete:
+                    return frozenset()
+                friends = self._load([user_id])[user_id]
+        return friends
+
+    def is_friend(self, user_id, other_id):
+        """检查两个用户是否互为好友。"""
+        return other_id in self.friend_ids(user_id)
+
+    def edge_count(self):
+        """当前缓存中的有向边数量（每对好友计为两条）。"""
+        return sum(len(friends) for friends in self._adjacency.values())
+
+    def warm(self):
+        """用一次流式查询加载整张好友关系图，适合在 worker 启动时调用。"""
+        from app import db, replicas
+        from app.models import friendships
+        adjacency, interned = {}, {}
+        with replicas.primary():
+            # 先记录变更日志的位置，加载期间发生的变更会在下次同步时重新加载
+            last_change_id, seen = self._current_position()
+            rows = db.session.query(friendships.c.user_id, friendships.c.friend_id).yield_per(10000)
+            for user_id, friend_id in rows:
+                friend_id = interned.setdefault(friend_id, friend_id)
+                adjacency.setdefault(interned.setdefault(user_id, user_id), set()).add(friend_id)
+        # 由 set 复制得到的 frozenset 哈希表大小恰好合适，比直接由列表构造节省约一半内存
+        adjacency = {user_id: frozenset(friends) for user_id, friends in adjacency.items()}
+        with self._lock:
+            self._adjacency = adjacency
+            self._interned = interned
+            self._complete = True
+            self._last_change_id = last_change_id
+            self._seen_changes = seen
+            self._last_sync = self._loaded_at = time.monotonic()
+
+    # --- 变更（在数据库事务中调用） ---
+
+    def record_change(self, user_id, other_id, added):
+        """
+        登记一对好友关系的建立(added=True)或解除。
+        变更日志与好友关系写入同一个事务；本进程的邻接表在事务提交后才更新。
+        """
+        from app import db
+        self._log_changes(db.session, [user_id, other_id])
+        self._defer(db.session, self._apply_edge, user_id, other_id, added)
+
+    def record_user_removed(self, user_id):
+        """在删除用户的事务中调用，让该用户及其所有好友的邻接表在各个进程中失效。"""
+        from app import db
+        friends = self.friend_ids(user_id)
+        self._log_changes(db.session, [user_id, *friends])
+        self._defer(db.session, self._apply_removal, user_id, friends)
+
+    # --- 内部实现 ---
+
+    def _intern(self, user_id):
+        return self._interned.setdefault(user_id, user_id)
+
+    def _load(self, user_ids):
+        """从数据库重新加载一批用户的邻接表（包括没有好友的用户），返回 {user_id: frozenset}。"""
+        from app import db
+        from app.models import friendships
+        adjacency = {user_id: set() for user_id in user_ids}
+        user_ids = list(user_ids)
+        # 分批查询，避免超出 SQLite 的参数个数限制
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            rows = db.session.query(friendships.c.user_id, friendships.c.friend_id).filter(
+                friendships.c.user_id.in_(chunk)).all()
+            for user_id, friend_id in rows:
+                adjacency[user_id].add(friend_id)
+        with self._lock:
+            intern = self._intern
+            loaded = {}
+            for user_id, friends in adjacency.items():
+                loaded[user_id] = frozenset({intern(friend_id) for friend_id in friends})
+                self._adjacency[intern(user_id)] = loaded[user_id]
+        return loaded
+
+    def _overlap_cutoff(self):
+        return datetime.utcnow() - timedelta(seconds=self.sync_overlap)
+
+    def _current_position(self):
+        """返回变更日志的当前位置：最大ID，以及重叠窗口内已经可见的记录 {id: 写入时间}。"""
+        from app import db
+        from app.models import FriendGraphChange
+        # 一次查询同时取得最大ID那一行和窗口内的记录
+        latest = db.session.query(func.max(FriendGraphChange.id)).scalar_subquery()
+        rows = db.session.query(FriendGraphChange.id, FriendGraphChange.timestamp).filter(
+            or_(FriendGraphChange.id == latest, FriendGraphChange.timestamp >= self._overlap_cutoff())).all()
+        return max((row.id for row in rows), default=0), {row.id: row.timestamp for row in rows}
+
+    def _maybe_sync(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._loaded_at > self.refresh_interval:
+                self._reset()
+                now = time.monotonic()
+            if now - self._last_sync < self.sync_interval and self._last_change_id is not None:
+                return
+            self._last_sync = now
+            last_change_id = self._last_change_id
+
+        if last_change_id is None:
+            # 首次使用：此前尚未缓存任何数据，只需记录变更日志的当前位置
+            last_change_id, seen = self._current_position()
+            with self._lock:
+                self._last_change_id, self._seen_changes = last_change_id, seen
+            return
+
+        from app import db
+        from app.models import FriendGraphChange
+        cutoff = self._overlap_cutoff()
+        # 游标之后的记录，以及重叠窗口内可能晚于游标才提交的记录
+        rows = db.session.query(FriendGraphChange.id, FriendGraphChange.user_id, FriendGraphChange.timestamp).filter(
+            or_(FriendGraphChange.id > last_change_id, FriendGraphChange.timestamp >= cutoff)).all()
+        with self._lock:
+            seen = self._seen_changes
+            rows = [row for row in rows if row.id not in seen]
+            for row in rows:
+                seen[row.id] = row.timestamp
+            # 写入时间已移出重叠窗口的记录不会再被扫描到
+            for change_id in [change_id for change_id, timestamp in seen.items() if timestamp < cutoff]:
+                del seen[change_id]
+            if rows:
+                self._last_change_id = max(last_change_id, max(row.id for row in rows))
+            changed = {row.user_id for row in rows}
+            # 只需重新加载已缓存的用户；加载过整张图时，新出现的用户也要加载
+            stale = changed if self._complete else changed & self._adjacency.keys()
+        if stale:
+            self._load(stale)
+
+    def _log_changes(self, session, user_ids):
+        from app.models import FriendGraphChange
+        session.add_all([FriendGraphChange(user_id=user_id) for user_id in set(user_ids)])
+        # 每分钟最多清理一次过期的变更记录，表的大小保持有界
+        now = time.time()
+        if now - self._last_prune > 60:
+            self._last_prune = now
+            cutoff = datetime.utcnow() - timedelta(seconds=self.change_retention)
+            session.query(FriendGraphChange).filter(
+                FriendGraphChange.timestamp < cutoff).delete(synchronize_session=False)
+
+    @staticmethod
+    def _defer(session, func_, *args):
+        session.info.setdefault(_PENDING_KEY, []).append((func_, args))
+
+    def _apply_edge(self, user_id, other_id, added):
+        with self._lock:
+            for a, b in ((user_id, other_id), (other_id, user_id)):
+                friends = self._adjacency.get(a)
+                if friends is None and not self._complete:
+                    continue  # 未缓存的用户下次访问时会从数据库加载
+                friends = friends or frozenset()
+                if added:
+                    self._adjacency[self._intern(a)] = friends | {self._intern(b)}
+                else:
+                    self._adjacency[self._intern(a)] = friends - {b}
+
+    def _apply_removal(self, user_id, friends):
+        with self._lock:
+            self._adjacency.pop(user_id, None)
+            for friend_id in friends:
+                current = self._adjacency.get(friend_id)
+                if current is not None:
+                    self._adjacency[friend_id] = current - {user_id}
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_pending(session):
+    """事务提交后，把本事务中登记的好友关系变更应用到进程内的邻接表。"""
+    for func_, args in session.info.pop(_PENDING_KEY, ()):
+        func_(*args)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    """事务回滚时丢弃登记的变更。"""
+    session.info.pop(_PENDING_KEY, None)
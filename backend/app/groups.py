@@ -0,0 +1,80 @@
+from flask_socketio import disconnect
+from app import db, socketio, presence
+from app.models import GroupMembership
+
+"""
+群聊房间管理 (Group Rooms)
+
+每个群对应一个 Socket.IO 房间 `group:<id>`。用户上线 (authenticate) 时，用一次走
+(user_id, group_id) 索引的查询取出其加入的所有群并加入对应房间；之后一条群消息只需一次 emit，
+由 Socket.IO 按房间分发给所有在线成员，而不是对每个成员分别 emit。
+
+成员变化按增量处理，不会重建所有房间:
+    - 成员的连接在当前 worker 上时，直接把该连接加入或移出房间；
+    - 连接在其他 worker 上时：加入群的成员会收到 'group_joined' 事件，客户端发送 'sync_groups'
+      后由持有连接的 worker 加入房间；被移出的成员的连接会被断开，重连上线时按数据库重新加入房间
+      （Socket.IO 只在 worker 之间同步 emit、断开连接和关闭房间，不同步单个连接的房间变化）。
+    - 解散群时关闭整个房间，所有 worker 上的成员连接都会离开。
+"""
+
+
+def group_room(group_id):
+    """群对应的 Socket.IO 房间名。注册时禁止用户名中出现冒号，不会与以用户名命名的个人房间冲突。"""
+    return f'group:{group_id}'
+
+
+def group_ids_of(user_id):
+    """用户加入的所有群的ID。"""
+    return [row.group_id for row in
+            db.session.query(GroupMembership.group_id).filter(GroupMembership.user_id == user_id)]
+
+
+def sync_group_rooms(sid, user_id):
+    """让连接 sid 所在的群房间与数据库中的成员关系一致，返回用户加入的群ID列表。"""
+    wanted = {group_room(group_id) for group_id in group_ids_of(user_id)}
+    current = {room for room in socketio.server.rooms(sid, namespace='/') if room.startswith('group:')}
+    for room in wanted - current:
+        socketio.server.enter_room(sid, room, namespace='/')
+    for room in current - wanted:
+        socketio.server.leave_room(sid, room, namespace='/')
+    return sorted(int(room.split(':', 1)[1]) for room in wanted)
+
+
+def _local_sid(username):
+    """返回用户在当前 worker 上的连接 sid；用户离线时返回 None，连接在其他 worker 上时返回 False。"""
+    sid = presence.get_sid(username)
+    if sid is None:
+        return None
+    return sid if socketio.server.manager.is_connected(sid, '/') else False
+
+
+def member_joined(group, username):
+    """成员加入群之后调用：更新房间，并通知该成员和群内其他成员。"""
+    room = group_room(group.id)
+    sid = _local_sid(username)
+    if sid:
+        socketio.server.enter_room(sid, room, namespace='/')
+    socketio.emit('group_member_update', {'group_id': group.id, 'username': username, 'joined': True},
+                  to=room, skip_sid=sid or None)
+    socketio.emit('group_joined', {'group_id': group.id, 'name': group.name}, to=username)
+
+
+def member_left(group_id, username):
+    """成员离开或被移出群之后调用：更新房间，并通知该成员和群内其他成员。"""
+    room = group_room(group_id)
+    sid = _local_sid(username)
+    if sid:
+        socketio.server.leave_room(sid, room, namespace='/')
+    socketio.emit('group_left', {'group_id': group_id}, to=username)
+    if sid is False:
+        # 连接在其他 worker 上，无法单独移出房间，断开后客户端重连时会按数据库重新加入房间
+        disconnect(presence.get_sid(username), namespace='/')
+    socketio.emit('group_member_update', {'group_id': group_id, 'username': username, 'joined': False},
+                  to=room)
+
+
+def group_deleted(group_id):
+    """群被解散之后调用：通知所有成员并关闭房间。"""
+    room = group_room(group_id)
+    socketio.emit('group_deleted', {'group_id': group_id}, to=room)
+    socketio.close_room(room, namespace='/')
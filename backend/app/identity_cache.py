@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+import jwt
+
+"""
+已验证身份缓存 (Verified-Identity Cache)
+
+几乎每个需要认证的请求都要先 `jwt.decode` 再 `User.query.get(user_id)`，
+很多接口随后还会按用户名再查询一次同一批热点用户。本模块用两层有界的 LRU/TTL 缓存消除这些重复工作：
+
+    - 令牌缓存: token -> (user_id, exp)。命中时只需比较一次过期时间，无需重新校验签名。
+    - 用户缓存: user_id -> 用户列快照，以及 username -> user_id 的索引。
+      命中时在当前数据库会话中重建一个"已持久化"的 User 实例，不产生任何 SQL 查询。
+
+快照只包含身份和资料相关的列。is_online、ip_address、port、public_key 等频繁变化或较大的列
+不进入快照，访问它们时由 SQLAlchemy 按需从数据库加载，因此在线状态的批量更新不会读到过期数据。
+
+修改用户资料、密码、邮箱、头像或删除用户的接口必须调用 `invalidate_user`。
+多 worker 部署时其他进程中的缓存依靠 TTL 过期，TTL 即跨进程的最大不一致窗口。
+"""
+
+
+class TTLCache:
+    """线程安全的有界 LRU 缓存，每个条目在写入 ttl 秒后过期。"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[0] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class IdentityCache:
+    """令牌与用户身份的缓存，采用与 Flask 扩展相同的 init_app 模式。"""
+
+    # 进入快照的列。其余列在访问时按需从数据库加载。
+    SNAPSHOT_COLUMNS = ('id', 'username', 'email', 'password_hash', 'is_admin',
+                        'gender', 'age', 'bio', 'avatar_url')
+
+    def __init__(self, app=None):
+        self.tokens = TTLCache(0, 0)
+        self.users = TTLCache(0, 0)
+        self.user_ids = TTLCache(0, 0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        size = app.config.get('IDENTITY_CACHE_SIZE', 10000)
+        ttl = app.config.get('IDENTITY_CACHE_TTL', 60)
+        # 每次创建应用都使用全新的缓存，避免测试中不同数据库之间的用户ID互相污染
+        self.tokens = TTLCache(size, ttl)
+        self.users = TTLCache(size, ttl)
+        self.user_ids = TTLCache(size, ttl)
+        app.extensions['identity_cache'] = self
+
+    def verify_token(self, token):
+        """
+        校验JWT并返回 (用户ID, 过期时间戳)，令牌不含过期时间时后者为None。
+        令牌无效或过期时抛出与 `jwt.decode` 相同的异常，调用方的错误处理无需改变。
+        """
+        cached = self.tokens.get(token)
+        if cached is not None:
+            user_id, exp = cached
+            if exp is not None and exp <= time.time():
+                self.tokens.pop(token)
+                raise jwt.ExpiredSignatureError('Signature has expired')
+            return cached
+
+        data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+        verified = (data['user_id'], data.get('exp'))
+        self.tokens.set(token, verified)
+        return verified
+
+    def decode_token(self, token):
+        """校验JWT并返回其中的用户ID。"""
+        return self.verify_token(token)[0]
+
+    def get_user(self, user_id):
+        """按ID获取用户，缓存命中时不访问数据库；用户不存在时返回None。"""
+        snapshot = self.users.get(user_id)
+        if snapshot is not None:
+            return self._attach(snapshot)
+        from app.models import User
+        user = User.query.get(user_id)
+        self._remember(user)
+        return user
+
+    def get_user_by_username(self, username):
+        """按用户名获取用户，缓存命中时不访问数据库；用户不存在时返回None。"""
+        user_id = self.user_ids.get(username)
+        if user_id is not None:
+            snapshot = self.users.get(user_id)
+            if snapshot is not None:
+                return self._attach(snapshot)
+        from app.models import User
+        user = User.query.filter_by(username=username).first()
+        self._remember(user)
+        return user
+
+    def resolve_usernames(self, usernames):
+        """
+        批量把用户名解析为用户ID，返回 {用户名: 用户ID}，不存在的用户名不在结果中。
+        缓存命中的用户名不访问数据库，其余用户名合并为一次查询。
+        """
+        ids = {}
+        misses = []
+        for username in usernames:
+            user_id = self.user_ids.get(username)
+            if user_id is not None:
+                ids[username] = user_id
+            else:
+                misses.append(username)
+        if misses:
+            from app import db
+            from app.models import User
+            for user_id, username in db.session.query(User.id, User.username).filter(User.username.in_(misses)):
+                self.user_ids.set(username, user_id)
+                ids[username] = user_id
+        return ids
+
+    def invalidate_user(self, user):
+        """
+        在用户的资料、密码、邮箱、头像发生变化或用户被删除时调用。
+        可以在提交之后调用：这里只读取实例的身份标识，不会为已过期的属性触发额外的查询。
+        """
+        state = inspect(user)
+        if state.identity is not None:
+            self.users.pop(state.identity[0])
+        username = state.dict.get('username')
+        if username is not None:
+            self.user_ids.pop(username)
+
+    def clear(self):
+        self.tokens.clear()
+        self.users.clear()
+        self.user_ids.clear()
+
+    def _remember(self, user):
+        from app import db
+        # 会话中带有未提交修改的实例不能作为快照，否则其他请求会读到未提交的数据
+        if user is None or db.session.is_modified(user):
+            return
+        self.users.set(user.id, {c: getattr(user, c) for c in self.SNAPSHOT_COLUMNS})
+        self.user_ids.set(user.username, user.id)
+
+    @staticmethod
+    def _attach(snapshot):
+        """用快照在当前会话中重建一个已持久化的 User 实例，不发出 SQL。"""
+        from app import db
+        from app.models import User
+        user = User(**snapshot)
+        # 把实例标记为"已从数据库加载"，未包含在快照中的列会被视为过期，访问时再加载
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
@@ -0,0 +1,155 @@
+import threading
+import time
+from functools import wraps
+from sqlalchemy import select, true
+
+"""
+进程启动与关闭时的在线状态处理 (Server Lifecycle)
+
+在线与否以在线状态注册表为准，但 users 表中的 is_online、ip_address、port 也会被好友列表、管理员接口等读取。
+进程崩溃或被直接杀掉时，这些行会一直停留在 "在线"，原先只能由管理员的强制下线接口逐个纠正。本模块负责两端:
+
+    - 启动对账（reconcile）：进程启动时把数据库中标记为在线、但不在注册表中的用户全部改为离线。
+      单进程部署时注册表在启动时为空，用一条 UPDATE 重置所有在线标记；集群中单个 worker 重启时，
+      其他 worker 上仍在线的用户（共享注册表中的记录）保持不变，其余用户按ID分批更新。
+    - 优雅关闭（shutdown）：收到 SIGTERM 后不再接受新的 Socket.IO 连接，等待正在处理的事件完成
+      （最多 SHUTDOWN_DRAIN_TIMEOUT 秒），然后一次性注销本进程的所有连接，
+      在一个事务内把这些用户写为离线，并给每个在线好友只发送一条 'friends_offline' 事件，列出其所有下线的好友。
+      最后把中转消息缓冲区中已经回复 'queued' 的消息写入存储。
+
+这样滚动重启时数据库中不会残留过期的在线状态，好友也不会收到成千上万条逐个下线的通知。
+"""
+
+# 批量查询时每条语句中用户ID/用户名的数量上限，避免超出数据库绑定参数的限制
+_CHUNK_SIZE = 500
+
+
+def _chunks(items, size=None):
+    size = size or _CHUNK_SIZE
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class ServerLifecycle:
+    """启动对账与优雅关闭，采用与 Flask 扩展相同的 init_app 模式。"""
+
+    def __init__(self, app=None):
+        self.drain_timeout = 10
+        self.draining = False
+        self._app = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.drain_timeout = app.config.get('SHUTDOWN_DRAIN_TIMEOUT', self.drain_timeout)
+        self.draining = False
+        self._app = app
+        self._in_flight = 0
+        self._track_events()
+        app.extensions['lifecycle'] = self
+
+    @property
+    def in_flight(self):
+        """正在处理的 Socket.IO 事件数。"""
+        return self._in_flight
+
+    def reconcile(self):
+        """
+        启动对账：把在线状态注册表之外的所有 "在线" 用户改为离线，返回修正的行数。需要在应用上下文中调用。
+
+        注册表为空时用一条 UPDATE 完成；否则先取出数据库中标记为在线的用户，排除注册表中的用户后
+        按ID分批更新，语句中的参数个数不随在线用户数增长。所有批次在同一个事务中提交。
+        """
+        from app import db, presence
+        from app.models import User, next_row_version
+        users = User.__table__
+        offline = dict(is_online=False, ip_address=None, port=None)
+        # 集群中其他 worker 仍持有的连接
+        keep = set(presence.usernames())
+        if not keep:
+            offline['row_version'] = next_row_version(db.session.connection())
+            result = db.session.execute(users.update().where(users.c.is_online == true()).values(**offline))
+            db.session.commit()
+            return result.rowcount
+        rows = db.session.execute(select(users.c.id, users.c.username).where(users.c.is_online == true()))
+        stale = [row.id for row in rows if row.username not in keep]
+        if not stale:
+            db.session.commit()
+            return 0
+        offline['row_version'] = next_row_version(db.session.connection())
+        for chunk in _chunks(stale):
+            db.session.execute(users.update().where(users.c.id.in_(chunk)).values(**offline))
+        db.session.commit()
+        return len(stale)
+
+    def shutdown(self):
+        """
+        优雅关闭：拒绝新连接，排空正在处理的事件，然后批量下线本进程的所有用户并通知其好友，
+        并写入缓冲区中的中转消息。返回下线的用户数。
+        """
+        from app import db, socketio, relay
+        self.draining = True
+        deadline = time.monotonic() + self.drain_timeout
+        while self._in_flight and time.monotonic() < deadline:
+            socketio.sleep(0.05)
+        with self._app.app_context():
+            try:
+                return self._release_local_users()
+            finally:
+                db.session.remove()
+                relay.shutdown()
+
+    def _release_local_users(self):
+        from app import db, socketio, presence, presence_writer
+        from app.models import User, friendships
+        # manager 中的房间只包含本进程的连接，即使注册表由多个 worker 共享
+        sids = [sid for sid, _ in socketio.server.manager.get_participants('/', None)]
+        usernames = presence.unregister_many(sids)
+        # 已经在其他 worker 上重新连接的用户仍然在线
+        offline = set(usernames) - presence.online_among(usernames)
+        if not offline:
+            return 0
+
+        username_by_id = {}
+        for chunk in _chunks(offline):
+            username_by_id.update(db.session.query(User.id, User.username).filter(User.username.in_(chunk)).all())
+        # 一个事务写入所有下线的用户
+        presence_writer.set_offline_many(username_by_id)
+        presence_writer.flush()
+
+        # 按好友分组：每个在线好友只收到一条列出其所有下线好友的事件
+        offline_by_friend = {}
+        for chunk in _chunks(username_by_id):
+            rows = db.session.query(friendships.c.user_id, User.username).join(
+                User, User.id == friendships.c.friend_id
+            ).filter(friendships.c.user_id.in_(chunk)).all()
+            for user_id, friend in rows:
+                offline_by_friend.setdefault(friend, []).append(username_by_id[user_id])
+        online_friends = presence.online_among(offline_by_friend)
+        for friend in online_friends:
+            socketio.emit('friends_offline', {'usernames': sorted(offline_by_friend[friend])}, to=friend)
+        print(f'[关闭] 已下线 {len(username_by_id)} 个用户，通知 {len(online_friends)} 个在线好友。')
+        return len(username_by_id)
+
+    def _track_events(self):
+        """
+        统计正在处理的事件数。所有事件处理函数都经由服务器的 _trigger_event 调用，
+        这里在每个新创建的服务器实例上包装一层计数。
+        """
+        from app import socketio
+        server = socketio.server
+        trigger_event = server._trigger_event
+
+        @wraps(trigger_event)
+        def tracked_trigger_event(*args, **kwargs):
+            with self._lock:
+                self._in_flight += 1
+            try:
+                return trigger_event(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+        server._trigger_event = tracked_trigger_event
@@ -0,0 +1,292 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from flask import Response, jsonify, request
+
+"""
+运行指标 (Metrics)
+
+以 Prometheus 文本格式 (text/plain; version=0.0.4) 在 /metrics 上导出本进程的运行指标:
+    - easychat_http_request_duration_seconds{endpoint}: api 蓝图中每个路由的请求耗时直方图；
+    - easychat_socketio_event_duration_seconds{event}: 每个 Socket.IO 事件处理函数的耗时直方图
+      （直方图的 _count 即调用次数）；
+    - easychat_socketio_emits_total{event}: 服务器发出的 emit 次数（一次房间 emit 计一次）；
+    - 抓取时现算的仪表: 在线用户数、本进程打开的 Socket.IO 连接数、数据库连接池使用情况、
+      bcrypt 进程池中排队和计算中的任务数。
+
+热路径上的开销尽量小: 直方图的桶在创建时一次分配好，每次记录只做一次二分查找和一次
+不含任何分配的短临界区；带标签的子指标按标签值缓存，只在第一次出现某个标签值时加锁创建。
+指标只统计当前进程，多 worker 部署时需要分别抓取每个 worker。
+
+指标中包含在线人数等运营数据，因此默认关闭（METRICS_ENABLED）。设置 METRICS_TOKEN 后，
+抓取时必须带上 'Authorization: Bearer <METRICS_TOKEN>' 请求头，否则返回 401。
+"""
+
+# 默认的耗时桶（秒），覆盖从 0.5 毫秒的内存操作到数秒的 bcrypt 登录
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """单调递增的计数器。"""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Histogram:
+    """固定桶的直方图，桶按上界 (le) 计数，导出时再累加为 Prometheus 的累计桶。"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.upper_bounds = tuple(buckets)
+        self._counts = [0] * (len(self.upper_bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self):
+        """装饰器：记录被装饰函数的耗时（包括抛出异常的调用）。"""
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start)
+            return decorated
+        return decorator
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative = 0
+        for bound, count in zip(self.upper_bounds + (float('inf'),), counts):
+            cumulative += count
+            yield f'{name}_bucket', labels + (('le', _format_value(bound)),), cumulative
+        yield f'{name}_sum', labels, total
+        yield f'{name}_count', labels, cumulative
+
+
+class Gauge:
+    """抓取时调用 fn 得到当前值的仪表；fn 返回 None 时不导出。"""
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def samples(self, name, labels):
+        value = self.fn()
+        if value is not None:
+            yield name, labels, value
+
+
+class MetricFamily:
+    """同名指标的集合，按一个标签的取值区分子指标；label 为 None 时只有一个不带标签的子指标。"""
+
+    def __init__(self, name, help_text, kind, factory, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label = label
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value):
+        """返回标签取值为 value 的子指标，第一次出现时创建。"""
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(value, self._factory())
+        return child
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        for value, child in sorted(self._children.items(), key=lambda item: str(item[0])):
+            labels = ((self.label, value),) if self.label else ()
+            for name, sample_labels, sample in child.samples(self.name, labels):
+                lines.append(f'{name}{_format_labels(sample_labels)} {_format_value(sample)}')
+        return lines
+
+
+class MetricsRegistry:
+    """本进程所有指标的注册表。"""
+
+    def __init__(self):
+        self.families = []
+
+    def _add(self, family):
+        self.families.append(family)
+        return family
+
+    def counter(self, name, help_text, label):
+        return self._add(MetricFamily(name, help_text, 'counter', Counter, label))
+
+    def histogram(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        return self._add(MetricFamily(name, help_text, 'histogram', lambda: Histogram(buckets), label))
+
+    def gauge(self, name, help_text, fn):
+        family = self._add(MetricFamily(name, help_text, 'gauge', None))
+        family._children[None] = Gauge(fn)
+        return family
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _db_pool_stat(method):
+    """数据库连接池的某项统计；SQLite 等不排队的连接池没有这些统计时返回 None。"""
+    def read():
+        from app import db
+        fn = getattr(db.engine.pool, method, None)
+        return fn() if callable(fn) else None
+    return read
+
+
+def _open_sids():
+    # 所有连接都在默认命名空间的 None 房间中
+    from app import socketio
+    server = getattr(socketio, 'server', None)
+    return len(server.manager.rooms.get('/', {}).get(None, ())) if server is not None else 0
+
+
+def _online_users():
+    from app import presence
+    return presence.count() if presence.backend is not None else 0
+
+
+def _hash_queue_depth():
+    from app import password_hasher
+    return password_hasher.pending
+
+
+def _presence_writes_pending():
+    from app import presence_writer
+    return presence_writer.pending
+
+
+class Metrics:
+    """
+    运行指标的统一入口，采用与 Flask 扩展相同的 init_app 模式。
+
+    指标在构造时就创建好，Socket.IO 事件处理函数可以在模块导入时用 timed_event 装饰；
+    init_app 负责注册请求计时钩子、统计 emit 次数，并在 METRICS_ENABLED 时添加 /metrics 路由。
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.token = None
+        self.registry = MetricsRegistry()
+        self.request_duration = self.registry.histogram(
+            'easychat_http_request_duration_seconds', 'Latency of API requests by route.', 'endpoint')
+        self.event_duration = self.registry.histogram(
+            'easychat_socketio_event_duration_seconds', 'Latency of Socket.IO event handlers by event.', 'event')
+        self.emits = self.registry.counter(
+            'easychat_socketio_emits_total', 'Socket.IO emits sent by this process by event.', 'event')
+        self.registry.gauge('easychat_online_users', 'Users currently online.', _online_users)
+        self.registry.gauge('easychat_socketio_open_sids', 'Socket.IO connections open in this process.',
+                            _open_sids)
+        self.registry.gauge('easychat_db_pool_checked_out', 'Database connections in use.',
+                            _db_pool_stat('checkedout'))
+        self.registry.gauge('easychat_db_pool_size', 'Database connection pool size.', _db_pool_stat('size'))
+        self.registry.gauge('easychat_db_pool_overflow', 'Database connections open beyond the pool size.',
+                            _db_pool_stat('overflow'))
+        self.registry.gauge('easychat_password_hash_pending', 'Password hash jobs queued or running.',
+                            _hash_queue_depth)
+        self.registry.gauge('easychat_presence_writes_pending', 'Users with presence changes not yet written.',
+                            _presence_writes_pending)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', False)
+        self.token = app.config.get('METRICS_TOKEN') or None
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self._export)
+        self._count_emits()
+
+    def timed_event(self, event):
+        """装饰器：记录 Socket.IO 事件处理函数的耗时和调用次数，放在 @socketio.on 的下面。"""
+        child = self.event_duration.labels(event)
+
+        def decorator(f):
+            timed = child.time()(f)
+
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if not self.enabled:
+                    return f(*args, **kwargs)
+                return timed(*args, **kwargs)
+            return decorated
+        return decorator
+
+    def _start_request(self):
+        if request.blueprint == 'api':
+            request.environ['easychat.request_start'] = time.perf_counter()
+
+    def _finish_request(self, exc=None):
+        start = request.environ.get('easychat.request_start')
+        if start is not None:
+            self.request_duration.labels(request.endpoint).observe(time.perf_counter() - start)
+
+    def _export(self):
+        if self.token is not None:
+            auth_header = request.headers.get('Authorization', '')
+            token = auth_header[len('Bearer '):] if auth_header.startswith('Bearer ') else ''
+            if not hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8')):
+                return jsonify({'message': 'Token is invalid!'}), 401
+        return Response(self.registry.render(), mimetype='text/plain; version=0.0.4')
+
+    def _count_emits(self):
+        """
+        统计 emit 次数。flask_socketio 的 emit 和 socketio.emit 最终都经过服务器的
+        client manager，这里在每个新创建的服务器实例的 manager 上包装一层 emit。
+        """
+        from app import socketio
+        manager = socketio.server.manager
+        emit = manager.emit
+        emits = self.emits
+
+        @wraps(emit)
+        def counted_emit(event, *args, **kwargs):
+            emits.labels(event).inc()
+            return emit(event, *args, **kwargs)
+        manager.emit = counted_emit
@@ -1,7 +1,8 @@
-from app import db
-import bcrypt
+import hashlib
+from app import db, friend_graph, password_hasher
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from sqlalchemy import DDL, event, func, select, text
 
 """
 该文件定义了应用中所有的数据库模型。
@@ -26,12 +27,78 @@ class FriendRequest(db.Model):
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)  # 请求发送的时间戳
 
     # 定义一个联合唯一约束，确保同一个用户不能向另一个用户发送重复的未处理请求。
-    __table_args__ = (db.UniqueConstraint('requester_id', 'receiver_id', name='_requester_receiver_uc'),)
+    # 唯一约束本身就是 (requester_id, receiver_id) 索引，双向重复请求检查的两个分支都能用它直接定位；
+    # 另一个联合索引服务于收件箱查询（按接收者和状态过滤、按时间排序）。
+    __table_args__ = (
+        db.UniqueConstraint('requester_id', 'receiver_id', name='_requester_receiver_uc'),
+        db.Index('ix_friend_requests_receiver_status_timestamp', 'receiver_id', 'status', 'timestamp'),
+    )
 
     def __repr__(self):
         # 定义对象的字符串表示形式，方便调试。
         return f'<FriendRequest from {self.requester_id} to {self.receiver_id}: {self.status}>'
 
+class FriendGraphChange(db.Model):
+    """
+    好友关系变更日志。每当好友关系建立、解除或用户被删除时，在同一事务中为受影响的用户追加一行，
+    其他 worker 据此让进程内好友关系图缓存中的对应条目失效（见 app/friend_graph.py）。
+    """
+    __tablename__ = 'friend_graph_changes'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)  # 邻接表发生变化的用户ID（用户可能已被删除，因此不设外键）
+    timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)  # 用于清理过期的记录
+
+    def __repr__(self):
+        return f'<FriendGraphChange {self.id} for {self.user_id}>'
+
+class RowVersionCounter(db.Model):
+    """
+    users.row_version 的全局计数器，只有一行 (id=1)。
+
+    每次分配版本号都先 UPDATE 这一行再读取新值：UPDATE 持有行锁（SQLite 为整个数据库的写锁）直到事务提交，
+    并发的写事务依次取得互不相同、且按提交顺序递增的版本号。
+    因此 "行数 + 最大版本号" 组成的ETag不会在之后的修改中被重复使用。
+    """
+    __tablename__ = 'row_version_counter'
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+# create_all 建表时写入唯一的一行；已有数据库由迁移脚本写入
+event.listen(RowVersionCounter.__table__, 'after_create',
+             DDL('INSERT INTO row_version_counter (id, value) VALUES (1, 0)'))
+
+class ChatGroup(db.Model):
+    """群聊模型。群消息不在服务器保存，只通过以群为单位的 Socket.IO 房间实时转发（见 app/groups.py）。"""
+    __tablename__ = 'chat_groups'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)  # 群名称
+    creator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)  # 群主，只有群主可以移除他人或解散群
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # 解散群时一并删除所有成员关系
+    memberships = db.relationship('GroupMembership', backref='group', lazy='dynamic',
+                                  cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<ChatGroup {self.id} {self.name}>'
+
+class GroupMembership(db.Model):
+    """
+    群成员关系。主键 (group_id, user_id) 用于按群列出成员和判断成员身份；
+    另一个 (user_id, group_id) 索引用于用户上线时一次查出其加入的所有群。
+    """
+    __tablename__ = 'group_members'
+    group_id = db.Column(db.Integer, db.ForeignKey('chat_groups.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_group_members_user_group', 'user_id', 'group_id'),
+    )
+
+    def __repr__(self):
+        return f'<GroupMembership {self.user_id} in {self.group_id}>'
+
 class User(db.Model):
     """用户模型，代表应用中的一个用户。"""
     __tablename__ = 'users'
@@ -43,6 +110,9 @@ class User(db.Model):
     ip_address = db.Column(db.String(45), nullable=True)  # 用户登录时的IP地址，用于P2P连接
     port = db.Column(db.Integer, nullable=True)  # 用户客户端监听的端口，用于P2P连接
     public_key = db.Column(db.Text, nullable=True)  # 存储用户的RSA公钥
+    # 公钥的 SHA-256 指纹和版本号（每次更换公钥加一），客户端据此判断缓存的公钥是否仍然有效，无需重新下载公钥全文
+    public_key_fingerprint = db.Column(db.String(64), nullable=True)
+    public_key_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     is_admin = db.Column(db.Boolean, default=False, nullable=False)  # 标记用户是否为管理员
 
     # --- 个人资料字段 ---
@@ -51,6 +121,10 @@ class User(db.Model):
     bio = db.Column(db.String(200), nullable=True) # 个人简介
     avatar_url = db.Column(db.String(255), nullable=True) # 头像文件的相对路径
 
+    # 行版本号：每次插入或修改（包括好友关系变化）时从 RowVersionCounter 分配一个新的版本号，见文件末尾的事件监听。
+    # 列表接口据此计算弱ETag：任何插入或修改都会增大最大版本号，删除则会减少行数。
+    row_version = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+
     # --- 关系定义 ---
     # 定义用户与好友的多对多关系
     friends = db.relationship('User',
@@ -77,32 +151,73 @@ class User(db.Model):
                                                cascade='all, delete-orphan')
 
     def set_password(self, password):
-        """使用bcrypt对明文密码进行哈希处理并存储。"""
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        """使用bcrypt对明文密码进行哈希处理并存储。哈希计算在密码哈希进程池中执行，不占用请求线程。"""
+        self.password_hash = password_hasher.hash_password(password)
 
     def check_password(self, password):
         """验证输入的密码是否与存储的哈希密码匹配。"""
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        return password_hasher.check_password(password, self.password_hash)
+
+    def password_needs_rehash(self):
+        """存储的哈希使用的工作因子与当前配置 (BCRYPT_ROUNDS) 不同时返回 True。"""
+        return password_hasher.needs_rehash(self.password_hash)
+
+    def set_public_key(self, public_key):
+        """设置公钥并更新指纹和版本号。公钥没有变化时不做任何修改，返回是否发生了变化。"""
+        fingerprint = public_key_fingerprint(public_key)
+        if fingerprint == self.public_key_fingerprint:
+            return False
+        self.public_key = public_key
+        self.public_key_fingerprint = fingerprint
+        self.public_key_version = (self.public_key_version or 0) + 1
+        return True
 
     def add_friend(self, user):
         """添加一个好友。这是一个双向操作。"""
         if not self.is_friend(user):
             self.friends.append(user)
             user.friends.append(self)
+            friend_graph.record_change(self.id, user.id, added=True)
 
     def remove_friend(self, user):
         """移除一个好友。这也是一个双向操作。"""
         if self.is_friend(user):
             self.friends.remove(user)
             user.friends.remove(self)
+            friend_graph.record_change(self.id, user.id, added=False)
 
     def is_friend(self, user):
-        """检查目标用户是否已经是当前用户的好友。"""
-        return db.session.query(friendships).filter(
-            ((friendships.c.user_id == self.id) & (friendships.c.friend_id == user.id)) |
-            ((friendships.c.user_id == user.id) & (friendships.c.friend_id == self.id))
-        ).count() > 0
+        """检查目标用户是否已经是当前用户的好友。好友关系是双向存储的，直接查询进程内的好友关系图缓存。"""
+        return friend_graph.is_friend(self.id, user.id)
 
     def __repr__(self):
         # 定义对象的字符串表示形式，方便调试。
-        return f'<User {self.username}>'
\ No newline at end of file
+        return f'<User {self.username}>'
+
+def public_key_fingerprint(public_key):
+    """公钥指纹：公钥文本 (PEM) 的 SHA-256 十六进制摘要。"""
+    return hashlib.sha256(public_key.encode('utf-8')).hexdigest()
+
+def next_row_version(connection):
+    """
+    在给定连接的事务中分配下一个行版本号。计数器行的锁一直持有到事务提交，
+    所以应在写事务中、尽量靠近提交的位置调用。
+    """
+    dialect = connection.dialect
+    # PostgreSQL 和 SQLite 3.35+ 用 UPDATE ... RETURNING 一条语句完成（SQLAlchemy 1.4 的 SQLite 方言不支持 returning()）
+    if dialect.name == 'postgresql' or (dialect.name == 'sqlite' and dialect.dbapi.sqlite_version_info >= (3, 35)):
+        return connection.execute(text(
+            'UPDATE row_version_counter SET value = value + 1 WHERE id = 1 RETURNING value')).scalar_one()
+    counter = RowVersionCounter.__table__
+    connection.execute(counter.update().where(counter.c.id == 1).values(value=counter.c.value + 1))
+    return connection.execute(select(counter.c.value).where(counter.c.id == 1)).scalar_one()
+
+@event.listens_for(User, 'before_insert')
+def _bump_row_version_on_insert(mapper, connection, target):
+    target.row_version = next_row_version(connection)
+
+@event.listens_for(User, 'before_update')
+def _bump_row_version_on_update(mapper, connection, target):
+    # 只有真正发生变化的实例才更新版本号
+    if db.session.is_modified(target):
+        target.row_version = next_row_version(connection)
@@ -0,0 +1,143 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+import bcrypt
+from app.concurrency import run_blocking
+
+"""
+密码哈希进程池 (Password Hasher)
+
+bcrypt 的计算量由工作因子 (cost / rounds) 决定，默认的 12 轮在一个核心上需要数百毫秒。
+如果在请求线程中直接计算，登录高峰期会占满服务器的CPU和请求线程，协程服务器更会因此整体停顿。
+
+本模块把哈希计算交给一个有界的进程池：
+    - 进程数由 PASSWORD_HASH_WORKERS 决定（默认等于CPU核心数；为 0 时在当前进程的线程池中计算）。
+      子进程使用 spawn 方式启动，不会继承协程库的猴子补丁和服务器的网络连接。
+    - 正在排队和计算中的任务数超过 PASSWORD_HASH_MAX_PENDING 时，新的请求立即失败
+      （抛出 PasswordHasherBusy，接口返回 503），而不是无限堆积、让所有请求一起超时。
+    - 工作因子来自 BCRYPT_ROUNDS。登录成功时如果存储的哈希使用的是旧的工作因子，
+      会用新的工作因子重新计算并保存，调整配置后无需用户重置密码。
+
+`submit_hash` / `submit_check` 返回 concurrent.futures.Future，便于调用方并发等待；
+`hash_password` / `check_password` 是等待结果的便捷写法，在协程服务器中等待期间会让出控制权。
+"""
+
+
+class PasswordHasherBusy(Exception):
+    """待处理的哈希任务已达上限。调用方应返回 503，让客户端稍后重试。"""
+
+
+def _hash(password, rounds):
+    # 在子进程中执行，必须是模块级函数才能被序列化
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password, password_hash)
+
+
+class PasswordHasher:
+    """有界的 bcrypt 进程池，采用与 Flask 扩展相同的 init_app 模式。"""
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.workers = 0
+        self.max_pending = 64
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.shutdown()
+        self.rounds = app.config.get('BCRYPT_ROUNDS', 12)
+        workers = app.config.get('PASSWORD_HASH_WORKERS')
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', 64)
+        app.extensions['password_hasher'] = self
+
+    def shutdown(self):
+        """关闭进程池。下次提交任务时会重新创建。"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def pending(self):
+        """正在排队和计算中的任务数。"""
+        return self._pending
+
+    # --- 异步接口 ---
+
+    def submit_hash(self, password):
+        """提交一个哈希任务，返回结果为哈希字符串的 Future。"""
+        future = self._submit(_hash, password.encode('utf-8'), self.rounds)
+        return _map_future(future, lambda hashed: hashed.decode('utf-8'))
+
+    def submit_check(self, password, password_hash):
+        """提交一个校验任务，返回结果为布尔值的 Future。"""
+        return self._submit(_check, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+    # --- 同步接口 ---
+
+    def hash_password(self, password):
+        return self.submit_hash(password).result()
+
+    def check_password(self, password, password_hash):
+        return self.submit_check(password, password_hash).result()
+
+    def needs_rehash(self, password_hash):
+        """存储的哈希使用的工作因子与当前配置不同时返回 True。哈希格式为 $2b$<rounds>$<salt+hash>。"""
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (AttributeError, IndexError, ValueError):
+            return True
+
+    # --- 内部实现 ---
+
+    def _submit(self, func, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PasswordHasherBusy('Too many password hashing requests in flight')
+            self._pending += 1
+            if self.workers and self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            executor = self._executor
+
+        try:
+            if executor is not None:
+                future = executor.submit(func, *args)
+            else:
+                # 未启用进程池时，在线程池中计算（协程服务器下不阻塞事件循环）
+                future = Future()
+                try:
+                    future.set_result(run_blocking(func, *args))
+                except Exception as e:
+                    future.set_exception(e)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+
+def _map_future(future, func):
+    """返回一个新的 Future，其结果为 func(原 Future 的结果)。"""
+    mapped = Future()
+
+    def done(source):
+        try:
+            mapped.set_result(func(source.result()))
+        except Exception as e:
+            mapped.set_exception(e)
+
+    future.add_done_callback(done)
+    return mapped
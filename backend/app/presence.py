@@ -0,0 +1,400 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from app.sqlite_pool import SQLiteConnectionPool
+
+"""
+在线状态注册表 (Presence Registry)
+
+本模块负责维护 "用户名 <-> Socket.IO会话ID(sid)" 的在线映射关系。
+原先这份映射保存在 socket_events.py 的模块级字典中，只在单个进程内可见，
+一旦以多个 worker 运行，各进程看到的在线用户就会互相不一致。
+
+这里提供两种可插拔的后端，通过配置项 PRESENCE_BACKEND 选择：
+    - 'memory': 进程内字典实现，适合单进程开发和测试。
+    - 'sqlite': 基于共享 SQLite 文件（WAL 模式）的实现，同一台机器上的多个 worker
+      进程共享同一份在线状态，注册/注销都在单个事务内原子完成。
+      每条记录标明登记它的 worker，worker 定期刷新心跳；崩溃或被强制结束的 worker 留下的记录
+      在心跳超时后不再被视为在线，并由其他 worker 清除。
+
+所有后端都提供相同的接口：注册、注销、按用户名/按sid查询，以及批量查询"这些用户中谁在线"。
+每次在线集合发生变化时后端的版本号（version）都会改变，列表接口把它并入ETag。
+登记时还会保存用户上报的P2P连接信息（IP地址和端口），批量获取好友连接信息时直接从注册表读取，无需查询 users 表。
+"""
+
+
+class InMemoryPresenceBackend:
+    """进程内的在线状态后端，使用一把锁保护两个方向的字典映射。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sid_by_username = {}
+        self._username_by_sid = {}
+        self._endpoint_by_username = {}
+        self._version = 0
+
+    def register(self, username, sid, ip_address=None, port=None):
+        """登记用户在线及其P2P连接信息。同一用户重复登记时，新的sid会覆盖旧的sid。"""
+        with self._lock:
+            self._version += 1
+            old_sid = self._sid_by_username.get(username)
+            if old_sid is not None:
+                self._username_by_sid.pop(old_sid, None)
+            old_username = self._username_by_sid.get(sid)
+            if old_username is not None:
+                self._sid_by_username.pop(old_username, None)
+                self._endpoint_by_username.pop(old_username, None)
+            self._sid_by_username[username] = sid
+            self._username_by_sid[sid] = username
+            self._endpoint_by_username[username] = (ip_address, port)
+
+    def unregister(self, sid):
+        """
+        根据sid注销在线记录，返回对应的用户名；sid未登记时返回None。
+        只有当用户名当前仍指向这个sid时才移除用户名映射，
+        避免旧连接的断开事件误删同一用户刚建立的新连接。
+        """
+        with self._lock:
+            username = self._username_by_sid.pop(sid, None)
+            if username is not None and self._sid_by_username.get(username) == sid:
+                del self._sid_by_username[username]
+                self._endpoint_by_username.pop(username, None)
+                self._version += 1
+            return username
+
+    def unregister_many(self, sids):
+        """批量注销，返回被注销的用户名列表。"""
+        usernames = []
+        for sid in sids:
+            username = self.unregister(sid)
+            if username is not None:
+                usernames.append(username)
+        return usernames
+
+    def get_sid(self, username):
+        return self._sid_by_username.get(username)
+
+    def get_username(self, sid):
+        return self._username_by_sid.get(sid)
+
+    def online_among(self, usernames):
+        """返回给定用户名集合中当前在线的那部分（set）。"""
+        sid_by_username = self._sid_by_username
+        return {name for name in usernames if name in sid_by_username}
+
+    def connection_info(self, usernames):
+        endpoint_by_username = self._endpoint_by_username
+        return {name: endpoint_by_username[name] for name in usernames if name in endpoint_by_username}
+
+    def usernames(self):
+        return list(self._sid_by_username)
+
+    def count(self):
+        return len(self._sid_by_username)
+
+    def version(self):
+        return self._version
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._sid_by_username.clear()
+            self._username_by_sid.clear()
+            self._endpoint_by_username.clear()
+
+
+class SQLitePresenceBackend:
+    """
+    基于共享 SQLite 文件的在线状态后端。
+
+    同一主机上的所有 worker 进程打开同一个数据库文件，由 SQLite 的文件锁保证写入的原子性。
+    数据库以 WAL 模式运行，读操作不会被写操作阻塞。
+    连接来自进程内共享的连接池（见 app/sqlite_pool.py），每个操作借出一个连接，完成后归还。
+
+    每个后端实例代表一个 worker，登记的记录带有该 worker 的标识。presence_workers 表保存每个 worker 最近一次
+    心跳的时间，心跳超过 worker_ttl 秒的 worker 被视为已经退出：查询时忽略它的记录，
+    下一次任意 worker 调用 heartbeat 时删除这些记录。
+
+    presence_version 表只有一行，修改 presence 表的事务同时把它加一；version() 还带上心跳未超时的 worker 数，
+    worker 超时（其记录不再可见）时版本同样改变。
+    """
+
+    # SQLite 单条语句中绑定参数数量的保守上限，批量查询时按此分块
+    _CHUNK_SIZE = 500
+    # 只统计心跳未超时的 worker 登记的记录，参数为心跳的截止时间
+    _LIVE = 'worker IN (SELECT worker FROM presence_workers WHERE heartbeat_at > ?)'
+    _BUMP_VERSION = 'UPDATE presence_version SET value = value + 1 WHERE id = 1'
+
+    def __init__(self, path, timeout=5.0, worker_ttl=30.0, worker_id=None):
+        self.path = path
+        self.timeout = timeout
+        self.worker_ttl = worker_ttl
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._pool = SQLiteConnectionPool(path, timeout=timeout,
+                                          setup=lambda conn: conn.execute('PRAGMA synchronous=NORMAL'))
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS presence ('
+                ' username TEXT PRIMARY KEY,'
+                ' sid TEXT NOT NULL UNIQUE,'
+                ' updated_at REAL NOT NULL,'
+                ' ip_address TEXT,'
+                ' port INTEGER)'
+            )
+            # 旧版本创建的注册表文件没有连接信息列和 worker 列
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(presence)')}
+            for column, column_type in (('ip_address', 'TEXT'), ('port', 'INTEGER'), ('worker', 'TEXT')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE presence ADD COLUMN {column} {column_type}')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_presence_worker ON presence (worker)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS presence_workers ('
+                ' worker TEXT PRIMARY KEY,'
+                ' heartbeat_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE TABLE IF NOT EXISTS presence_version (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute('INSERT OR IGNORE INTO presence_version (id, value) VALUES (1, 0)')
+        self.heartbeat()
+
+    def _connect(self):
+        """从进程共享的连接池借出一个连接（with 块结束时归还）。"""
+        return self._pool.connection()
+
+    def _cutoff(self):
+        return time.time() - self.worker_ttl
+
+    def heartbeat(self):
+        """刷新本 worker 的心跳，并删除心跳超时的 worker 及其登记的记录。"""
+        with self._connect() as conn:
+            now = time.time()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('INSERT OR REPLACE INTO presence_workers (worker, heartbeat_at) VALUES (?, ?)',
+                             (self.worker_id, now))
+                conn.execute('DELETE FROM presence_workers WHERE heartbeat_at <= ?', (now - self.worker_ttl,))
+                # 没有 worker 标识的记录来自旧版本，同样无法确认是否仍然在线
+                if conn.execute('DELETE FROM presence WHERE worker IS NULL'
+                                ' OR worker NOT IN (SELECT worker FROM presence_workers)').rowcount:
+                    conn.execute(self._BUMP_VERSION)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def register(self, username, sid, ip_address=None, port=None):
+        with self._connect() as conn:
+            # INSERT OR REPLACE 会删除与 username(主键) 或 sid(唯一约束) 冲突的旧行，
+            # 因此一条语句即可原子地完成 "覆盖旧连接" 的语义。
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'INSERT OR REPLACE INTO presence (username, sid, updated_at, ip_address, port, worker)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)',
+                    (username, sid, time.time(), ip_address, port, self.worker_id)
+                )
+                conn.execute(self._BUMP_VERSION)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def unregister(self, sid):
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE 立即获取写锁，保证 "查出用户名" 与 "删除" 之间不会被其他进程插入
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT username FROM presence WHERE sid = ?', (sid,)).fetchone()
+                if row:
+                    conn.execute('DELETE FROM presence WHERE sid = ?', (sid,))
+                    conn.execute(self._BUMP_VERSION)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return row[0] if row else None
+
+    def unregister_many(self, sids):
+        """在一个事务内批量注销，返回被注销的用户名列表。"""
+        sids = list(sids)
+        with self._connect() as conn:
+            usernames = []
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for start in range(0, len(sids), self._CHUNK_SIZE):
+                    chunk = sids[start:start + self._CHUNK_SIZE]
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = conn.execute(f'SELECT username FROM presence WHERE sid IN ({placeholders})', chunk)
+                    usernames.extend(row[0] for row in rows)
+                    conn.execute(f'DELETE FROM presence WHERE sid IN ({placeholders})', chunk)
+                if usernames:
+                    conn.execute(self._BUMP_VERSION)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return usernames
+
+    def get_sid(self, username):
+        with self._connect() as conn:
+            row = conn.execute(
+                f'SELECT sid FROM presence WHERE username = ? AND {self._LIVE}', (username, self._cutoff())
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_username(self, sid):
+        with self._connect() as conn:
+            row = conn.execute(
+                f'SELECT username FROM presence WHERE sid = ? AND {self._LIVE}', (sid, self._cutoff())
+            ).fetchone()
+        return row[0] if row else None
+
+    def online_among(self, usernames):
+        usernames = list(usernames)
+        with self._connect() as conn:
+            cutoff = self._cutoff()
+            online = set()
+            for start in range(0, len(usernames), self._CHUNK_SIZE):
+                chunk = usernames[start:start + self._CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f'SELECT username FROM presence WHERE username IN ({placeholders}) AND {self._LIVE}',
+                    chunk + [cutoff]
+                )
+                online.update(row[0] for row in rows)
+            return online
+
+    def connection_info(self, usernames):
+        usernames = list(usernames)
+        with self._connect() as conn:
+            cutoff = self._cutoff()
+            info = {}
+            for start in range(0, len(usernames), self._CHUNK_SIZE):
+                chunk = usernames[start:start + self._CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f'SELECT username, ip_address, port FROM presence WHERE username IN ({placeholders})'
+                    f' AND {self._LIVE}', chunk + [cutoff]
+                )
+                info.update((row[0], (row[1], row[2])) for row in rows)
+            return info
+
+    def usernames(self):
+        with self._connect() as conn:
+            rows = conn.execute(f'SELECT username FROM presence WHERE {self._LIVE}', (self._cutoff(),)).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute(
+                f'SELECT COUNT(*) FROM presence WHERE {self._LIVE}', (self._cutoff(),)
+            ).fetchone()[0]
+
+    def version(self):
+        with self._connect() as conn:
+            value, live_workers = conn.execute(
+                'SELECT value, (SELECT COUNT(*) FROM presence_workers WHERE heartbeat_at > ?)'
+                ' FROM presence_version WHERE id = 1', (self._cutoff(),)
+            ).fetchone()
+        return f'{value}.{live_workers}'
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM presence')
+                conn.execute(self._BUMP_VERSION)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+
+class PresenceRegistry:
+    """
+    在线状态注册表的统一入口，采用与 Flask 扩展相同的 init_app 模式。
+
+    在 app/__init__.py 中创建全局实例，并在 create_app 中根据配置绑定具体后端。
+    业务代码只依赖这里暴露的方法，而不关心底层是进程内字典还是共享存储。
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend_name = app.config.get('PRESENCE_BACKEND', 'memory')
+        if backend_name == 'memory':
+            self.backend = InMemoryPresenceBackend()
+        elif backend_name == 'sqlite':
+            self.backend = SQLitePresenceBackend(app.config['PRESENCE_DB_PATH'],
+                                                 worker_ttl=app.config.get('PRESENCE_WORKER_TTL', 30))
+            # 共享注册表需要定期刷新本 worker 的心跳
+            from app import socketio
+            socketio.start_background_task(self._heartbeat, self.backend,
+                                           app.config.get('PRESENCE_HEARTBEAT_INTERVAL', 5))
+        else:
+            raise ValueError(f'Unknown PRESENCE_BACKEND: {backend_name}')
+        app.extensions['presence'] = self
+
+    def _heartbeat(self, backend, interval):
+        """后台任务：定期刷新心跳，后端被替换（重新 init_app）后退出。"""
+        from app import socketio
+        while self.backend is backend:
+            socketio.sleep(interval)
+            try:
+                backend.heartbeat()
+            except sqlite3.Error as e:
+                print(f'[在线状态] 心跳失败: {e}')
+
+    def register(self, username, sid, ip_address=None, port=None):
+        """将用户标记为在线，并记录其当前的Socket.IO会话ID和P2P连接信息。"""
+        self.backend.register(username, sid, ip_address, port)
+
+    def unregister(self, sid):
+        """根据sid将用户标记为离线，返回被注销的用户名（未登记则返回None）。"""
+        return self.backend.unregister(sid)
+
+    def unregister_many(self, sids):
+        """批量注销一组sid（例如进程关闭时本进程的全部连接），返回被注销的用户名列表。"""
+        return self.backend.unregister_many(sids)
+
+    def get_sid(self, username):
+        """根据用户名获取其Socket.IO会话ID，用户不在线时返回None。"""
+        return self.backend.get_sid(username)
+
+    def get_username(self, sid):
+        """根据Socket.IO会话ID获取对应的用户名。"""
+        return self.backend.get_username(sid)
+
+    def is_online(self, username):
+        return self.backend.get_sid(username) is not None
+
+    def online_among(self, usernames):
+        """批量查询：返回给定用户名中当前在线的用户名集合。"""
+        return self.backend.online_among(usernames)
+
+    def connection_info(self, usernames):
+        """批量查询：返回给定用户名中在线用户的 {用户名: (IP地址, 端口)}。"""
+        return self.backend.connection_info(usernames)
+
+    def usernames(self):
+        """当前在线的全部用户名。"""
+        return self.backend.usernames()
+
+    def count(self):
+        """当前在线的用户数。"""
+        return self.backend.count()
+
+    def version(self):
+        """在线集合的版本，任何登记、注销或 worker 超时之后都会改变。用于计算依赖在线状态的ETag。"""
+        return self.backend.version()
+
+    def clear(self):
+        self.backend.clear()
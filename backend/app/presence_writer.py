@@ -0,0 +1,174 @@
+import atexit
+import threading
+import uuid
+from sqlalchemy import bindparam
+
+"""
+在线状态的延迟写入 (Write-Behind Presence Buffer)
+
+原先每次 authenticate 和 disconnect 都要加载一个 User 实例并提交一次事务，只为修改 is_online、ip_address 和 port。
+重连高峰时就成了成千上万个串行的小事务。本模块把这些写入先保存在进程内:
+
+    - 缓冲区: user_id -> (is_online, ip_address, port)，同一用户的多次上线/下线只保留最后一次，
+      在一个刷新周期内反复断开重连的用户最终只写一行;
+    - 后台任务每隔 PRESENCE_FLUSH_INTERVAL 秒把缓冲区中的所有用户用一条批量 UPDATE（executemany）
+      在一个事务内写入 users 表；PRESENCE_FLUSH_INTERVAL 为 0 时每次都同步写入;
+    - 缓冲区是这些列的权威来源：读取在线用户 IP/端口的接口通过 `overlay` 用缓冲区中的值覆盖数据库中的值，
+      尚未写入的状态不会被读成旧值;
+    - 关闭进程时（或调用 `shutdown`）按 PRESENCE_FLUSH_ON_SHUTDOWN 决定把缓冲区写入数据库还是直接丢弃。
+      丢弃时数据库中的在线标记可能过期，在线与否始终以在线状态注册表为准。
+
+进程崩溃时最多丢失一个刷新周期内的写入。
+"""
+
+
+class PresenceWriter:
+    """在线状态写入缓冲区，采用与 Flask 扩展相同的 init_app 模式。"""
+
+    def __init__(self, app=None):
+        self.flush_interval = 0.2
+        self.flush_on_shutdown = True
+        self.stats = {'updates': 0, 'rows_written': 0, 'flushes': 0}
+        self._app = None
+        self._pending = {}
+        # 正在写入的批次，写入完成前 overlay 仍需读取其中的状态
+        self._writing = {}
+        self._lock = threading.Lock()
+        # 同一时刻只有一个批次在写入，保证同一用户的新状态不会被旧批次覆盖
+        self._write_lock = threading.Lock()
+        self._flusher_started = False
+        self._atexit_registered = False
+        # 缓冲区的版本号，每次记录新状态时加一；带上进程标识，不同 worker 的版本号不会相同
+        self._version = 0
+        self._process_token = uuid.uuid4().hex[:8]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.flush_interval = app.config.get('PRESENCE_FLUSH_INTERVAL', self.flush_interval)
+        self.flush_on_shutdown = app.config.get('PRESENCE_FLUSH_ON_SHUTDOWN', self.flush_on_shutdown)
+        self._app = app
+        with self._lock:
+            self._pending.clear()
+            self._writing = {}
+            self.stats = {'updates': 0, 'rows_written': 0, 'flushes': 0}
+        if not self._atexit_registered:
+            atexit.register(self.shutdown)
+            self._atexit_registered = True
+        app.extensions['presence_writer'] = self
+
+    @property
+    def pending(self):
+        """缓冲区中尚未写入数据库的用户数。"""
+        return len(self._pending)
+
+    def set_online(self, user_id, ip_address, port):
+        self._record({user_id: (True, ip_address, port)})
+
+    def set_offline(self, user_id):
+        self._record({user_id: (False, None, None)})
+
+    def set_offline_many(self, user_ids):
+        """把一组用户同时标记为离线，同步写入时也只执行一次批量 UPDATE。"""
+        self._record({user_id: (False, None, None) for user_id in user_ids})
+
+    def state(self, user_id):
+        """返回该用户尚未写入数据库的 (is_online, ip_address, port)，没有时返回None。"""
+        with self._lock:
+            return self._pending.get(user_id) or self._writing.get(user_id)
+
+    def overlay(self, user_id, is_online, ip_address, port):
+        """用缓冲区中的状态覆盖从数据库读出的 (is_online, ip_address, port)。"""
+        return self.state(user_id) or (is_online, ip_address, port)
+
+    def version(self):
+        """
+        overlay 结果的版本，供依赖在线状态的ETag使用。缓冲区为空时返回 None：此时 overlay 与数据库一致，
+        由 users.row_version 覆盖（写入时会增大行版本号），各 worker 得到相同的ETag。
+        """
+        with self._lock:
+            if not self._pending and not self._writing:
+                return None
+            return f'{self._process_token}.{self._version}'
+
+    def flush(self):
+        """把缓冲区中的状态用一条批量 UPDATE 写入数据库，返回写入的行数。需要在应用上下文中调用。"""
+        from app import db
+        from app.models import User, next_row_version
+        with self._write_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._writing = batch
+            if not batch:
+                return 0
+            users = User.__table__
+            try:
+                statement = users.update().where(users.c.id == bindparam('user_id')).values(
+                    is_online=bindparam('online'), ip_address=bindparam('ip'), port=bindparam('p'),
+                    row_version=next_row_version(db.session.connection()))
+                db.session.execute(statement, [
+                    {'user_id': user_id, 'online': online, 'ip': ip_address, 'p': port}
+                    for user_id, (online, ip_address, port) in batch.items()
+                ])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # 写入失败时放回缓冲区，期间到达的新状态优先
+                with self._lock:
+                    self._pending = {**batch, **self._pending}
+                    self._writing = {}
+                raise
+            with self._lock:
+                self._writing = {}
+                self.stats['rows_written'] += len(batch)
+                self.stats['flushes'] += 1
+            return len(batch)
+
+    def shutdown(self):
+        """进程退出时调用：按配置写入或丢弃缓冲区中的状态。"""
+        if self._app is None or not self._pending:
+            return
+        if not self.flush_on_shutdown:
+            with self._lock:
+                self._pending.clear()
+            return
+        from app import db
+        with self._app.app_context():
+            try:
+                self.flush()
+            finally:
+                db.session.remove()
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+
+    def _record(self, states):
+        if not states:
+            return
+        with self._lock:
+            self._pending.update(states)
+            self._version += 1
+            self.stats['updates'] += len(states)
+            start_flusher = self.flush_interval > 0 and not self._flusher_started
+            self._flusher_started = self._flusher_started or start_flusher
+        if self.flush_interval <= 0:
+            self.flush()
+        elif start_flusher:
+            from app import socketio
+            socketio.start_background_task(self._run)
+
+    def _run(self):
+        """后台任务：定期批量写入缓冲区。"""
+        from app import db, socketio
+        while True:
+            socketio.sleep(self.flush_interval)
+            if not self._pending:
+                continue
+            with self._app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f'[在线状态] 批量写入失败: {e}')
+                finally:
+                    db.session.remove()
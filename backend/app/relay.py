@@ -0,0 +1,335 @@
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from app.concurrency import run_blocking
+from app.sqlite_pool import SQLiteConnectionPool
+
+"""
+离线消息中转 (Store-and-Forward Relay)
+
+消息原本只通过 WebRTC P2P 通道传输，好友离线或双方之间无法打通 NAT 时消息会直接丢失。
+本模块为这种情况提供服务器中转：客户端发送已经端到端加密的密文，服务器从不解密，
+只按接收者排队保存，在接收者上线时批量投递，直到接收者确认收到或消息过期。
+
+存储使用单独的 SQLite 文件（WAL 模式），与 'sqlite' 在线状态后端一样由同一台机器上的所有 worker 共享：
+    - relay_messages: 只追加的消息表，按 (recipient, id) 建索引，id 全局递增；
+    - relay_cursors:  每个接收者已确认的最大消息 id，以及已清理到的 id。确认只推进游标，不修改消息行。
+    已确认或已过期的消息由单独的后台任务每隔 RELAY_SWEEP_INTERVAL 秒分批删除（与批量提交的设置无关）：已确认的消息按游标逐个接收者走 (recipient, id) 索引范围删除，
+    只处理上次清理后又有新确认的接收者。
+
+写入路径:
+    发送的消息先进入进程内的有界缓冲区（按字节数限制，满时发送方收到 busy 错误），
+    后台任务每隔 RELAY_FLUSH_INTERVAL 秒把缓冲区中的消息在一个事务内批量提交，
+    提交后立即把新消息推送给在线的接收者。RELAY_FLUSH_INTERVAL 为 0 时每条消息同步提交。
+    发送方收到 'queued' 时消息可能还在缓冲区中，因此优雅关闭（ServerLifecycle.shutdown）和进程退出（atexit）时
+    都会把缓冲区写入存储，接收者下次上线时投递。
+
+投递与确认:
+    接收者上线 (authenticate) 时，服务器分批推送所有未确认的消息 ('relay_messages' 事件)。
+    客户端处理完后发送 'relay_ack' 确认收到的最大 id，之前的消息都不会再次投递。
+    同一条消息可能被推送多次（例如上线投递和实时推送同时发生），客户端应按 id 去重。
+"""
+
+
+class RelayBusy(Exception):
+    """缓冲区已满。调用方应让发送方稍后重试。"""
+
+
+class SQLiteRelayStore:
+    """中转消息的 SQLite 存储。连接来自进程内共享的连接池（见 app/sqlite_pool.py）。"""
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._pool = SQLiteConnectionPool(path, timeout=timeout,
+                                          setup=lambda conn: conn.execute('PRAGMA synchronous=NORMAL'))
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS relay_messages ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' recipient TEXT NOT NULL,'
+                ' sender TEXT NOT NULL,'
+                ' payload TEXT NOT NULL,'
+                ' client_id TEXT,'
+                ' created_at REAL NOT NULL,'
+                ' expires_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_relay_messages_recipient_id '
+                         'ON relay_messages (recipient, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_relay_messages_expires_at '
+                         'ON relay_messages (expires_at)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS relay_cursors ('
+                ' recipient TEXT PRIMARY KEY,'
+                ' acked_id INTEGER NOT NULL,'
+                ' swept_id INTEGER NOT NULL DEFAULT 0)'
+            )
+            # 旧版本创建的文件没有 swept_id 列
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(relay_cursors)')}
+            if 'swept_id' not in columns:
+                conn.execute('ALTER TABLE relay_cursors ADD COLUMN swept_id INTEGER NOT NULL DEFAULT 0')
+
+    def _connect(self):
+        """从连接池借出一个连接（with 块结束时归还）。"""
+        return self._pool.connection()
+
+    def append_many(self, rows):
+        """
+        在一个事务内追加多条消息，返回按顺序分配的 id 列表。
+        rows 中每一项为 (recipient, sender, payload, client_id, created_at, expires_at)。
+        """
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE 持有写锁直到提交，期间分配的 id 是连续的
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(
+                    'INSERT INTO relay_messages (recipient, sender, payload, client_id, created_at, expires_at)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)', rows
+                )
+                last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return list(range(last_id - len(rows) + 1, last_id + 1))
+
+    def pending(self, recipient, after_id, now, limit):
+        """返回接收者 id 大于 after_id 且尚未确认、尚未过期的消息，按 id 排序，最多 limit 条。"""
+        with self._connect() as conn:
+            return conn.execute(
+                'SELECT id, sender, payload, client_id, created_at FROM relay_messages'
+                ' WHERE recipient = ? AND id > max(?, coalesce('
+                '   (SELECT acked_id FROM relay_cursors WHERE recipient = ?), 0))'
+                ' AND expires_at > ? ORDER BY id LIMIT ?',
+                (recipient, after_id, recipient, now, limit)
+            ).fetchall()
+
+    def ack(self, recipient, up_to):
+        """把接收者的确认游标推进到 up_to（不会后退）。"""
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO relay_cursors (recipient, acked_id) VALUES (?, ?)'
+                ' ON CONFLICT (recipient) DO UPDATE SET acked_id = max(acked_id, excluded.acked_id)',
+                (recipient, up_to)
+            )
+
+    def sweep(self, now, limit=1000):
+        """
+        分批删除已过期或已确认的消息，返回删除的行数。每批单独提交，不会长时间持有写锁。
+        已确认的消息每个接收者一条 DELETE（recipient = ? AND id <= 游标），每批最多处理 limit 个接收者。
+        """
+        with self._connect() as conn:
+            deleted = 0
+            while True:
+                count = conn.execute(
+                    'DELETE FROM relay_messages WHERE id IN '
+                    '(SELECT id FROM relay_messages WHERE expires_at <= ? LIMIT ?)', (now, limit)
+                ).rowcount
+                deleted += count
+                if count < limit:
+                    break
+            while True:
+                cursors = conn.execute(
+                    'SELECT recipient, acked_id FROM relay_cursors WHERE acked_id > swept_id LIMIT ?', (limit,)
+                ).fetchall()
+                if not cursors:
+                    break
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    for recipient, acked_id in cursors:
+                        deleted += conn.execute('DELETE FROM relay_messages WHERE recipient = ? AND id <= ?',
+                                                (recipient, acked_id)).rowcount
+                    # 记录清理时读到的游标；清理期间又推进的游标在下次清理时处理
+                    conn.executemany('UPDATE relay_cursors SET swept_id = ? WHERE recipient = ?',
+                                     [(acked_id, recipient) for recipient, acked_id in cursors])
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+                if len(cursors) < limit:
+                    break
+            return deleted
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM relay_messages').fetchone()[0]
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM relay_messages')
+            conn.execute('DELETE FROM relay_cursors')
+
+
+class MessageRelay:
+    """离线消息中转的统一入口，采用与 Flask 扩展相同的 init_app 模式。"""
+
+    def __init__(self, app=None):
+        self.store = None
+        self.ttl = 7 * 24 * 3600
+        self.flush_interval = 0.05
+        self.flush_batch = 1000
+        self.max_buffer_bytes = 16 * 1024 * 1024
+        self.max_payload = 64 * 1024
+        self.delivery_batch = 500
+        self.sweep_interval = 60.0
+        self._buffer = deque()
+        self._buffer_bytes = 0
+        self._lock = threading.Lock()
+        self._flusher_started = False
+        self._sweeper_started = False
+        self._atexit_registered = False
+        self._app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.store = SQLiteRelayStore(app.config['RELAY_DB_PATH'])
+        self.ttl = app.config.get('RELAY_MESSAGE_TTL', self.ttl)
+        self.flush_interval = app.config.get('RELAY_FLUSH_INTERVAL', self.flush_interval)
+        self.flush_batch = app.config.get('RELAY_FLUSH_BATCH', self.flush_batch)
+        self.max_buffer_bytes = app.config.get('RELAY_MAX_BUFFER_BYTES', self.max_buffer_bytes)
+        self.max_payload = app.config.get('RELAY_MAX_PAYLOAD', self.max_payload)
+        self.delivery_batch = app.config.get('RELAY_DELIVERY_BATCH', self.delivery_batch)
+        self.sweep_interval = app.config.get('RELAY_SWEEP_INTERVAL', self.sweep_interval)
+        self._app = app
+        with self._lock:
+            self._buffer.clear()
+            self._buffer_bytes = 0
+        if not self._atexit_registered:
+            atexit.register(self.shutdown)
+            self._atexit_registered = True
+        app.extensions['relay'] = self
+
+    @property
+    def buffered(self):
+        """缓冲区中尚未提交的消息数。"""
+        return len(self._buffer)
+
+    def enqueue(self, sender, recipient, payload, client_id=None):
+        """接收一条待中转的消息。缓冲区已满时抛出 RelayBusy。"""
+        now = time.time()
+        row = (recipient, sender, payload, client_id, now, now + self.ttl)
+        with self._lock:
+            if self._buffer_bytes + len(payload) > self.max_buffer_bytes:
+                raise RelayBusy('Relay buffer is full')
+            self._buffer.append(row)
+            self._buffer_bytes += len(payload)
+            start_flusher = self.flush_interval > 0 and not self._flusher_started
+            self._flusher_started = self._flusher_started or start_flusher
+        self._start_sweeper()
+        if self.flush_interval <= 0:
+            self.flush()
+        elif start_flusher:
+            from app import socketio
+            socketio.start_background_task(self._run)
+
+    def flush(self):
+        """把缓冲区中的消息批量提交，并推送给在线的接收者。返回提交的消息数。"""
+        total = 0
+        while True:
+            with self._lock:
+                rows = [self._buffer.popleft() for _ in range(min(self.flush_batch, len(self._buffer)))]
+            if not rows:
+                return total
+            try:
+                ids = run_blocking(self.store.append_many, rows)
+            except Exception:
+                # 提交失败时放回缓冲区，下次再试
+                with self._lock:
+                    self._buffer.extendleft(reversed(rows))
+                raise
+            with self._lock:
+                self._buffer_bytes -= sum(len(row[2]) for row in rows)
+            self._push(ids, rows)
+            total += len(rows)
+
+    def deliver_pending(self, username, sid):
+        """把接收者所有未确认的消息分批推送到指定连接，返回推送的消息数。"""
+        from app import socketio
+        self._start_sweeper()
+        after_id, total = 0, 0
+        while True:
+            rows = run_blocking(self.store.pending, username, after_id, time.time(), self.delivery_batch)
+            if not rows:
+                return total
+            socketio.emit('relay_messages', {'messages': [_message(*row) for row in rows]}, to=sid)
+            after_id = rows[-1][0]
+            total += len(rows)
+            if len(rows) < self.delivery_batch:
+                return total
+
+    def ack(self, username, up_to):
+        """接收者确认已收到 id 不大于 up_to 的所有消息。"""
+        self._start_sweeper()
+        run_blocking(self.store.ack, username, up_to)
+
+    def sweep(self):
+        return run_blocking(self.store.sweep, time.time())
+
+    def shutdown(self):
+        """
+        进程退出时调用：把缓冲区中的消息一次写入存储，返回写入的消息数。
+        不再推送给接收者（连接即将关闭），接收者下次上线时投递。可以重复调用。
+        """
+        with self._lock:
+            rows = list(self._buffer)
+            self._buffer.clear()
+            self._buffer_bytes = 0
+        if rows:
+            self.store.append_many(rows)
+        return len(rows)
+
+    def clear(self):
+        with self._lock:
+            self._buffer.clear()
+            self._buffer_bytes = 0
+        self.store.clear()
+
+    def _push(self, ids, rows):
+        """把刚提交的消息按接收者分组，一次推送给每个在线的接收者。"""
+        from app import socketio, presence
+        by_recipient = {}
+        for message_id, (recipient, sender, payload, client_id, created_at, _) in zip(ids, rows):
+            by_recipient.setdefault(recipient, []).append(
+                _message(message_id, sender, payload, client_id, created_at))
+        for recipient in presence.online_among(by_recipient):
+            socketio.emit('relay_messages', {'messages': by_recipient[recipient]}, to=recipient)
+
+    def _start_sweeper(self):
+        """第一次使用中转时启动清理任务（每个进程一个）。RELAY_SWEEP_INTERVAL 为 0 时不在后台清理。"""
+        with self._lock:
+            start = self.sweep_interval > 0 and not self._sweeper_started
+            self._sweeper_started = self._sweeper_started or start
+        if start:
+            from app import socketio
+            socketio.start_background_task(self._sweep_loop)
+
+    def _run(self):
+        """后台任务：定期批量提交缓冲区。"""
+        from app import socketio
+        while True:
+            socketio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                self._app.logger.exception('Relay flush failed')
+
+    def _sweep_loop(self):
+        """后台任务：定期清理已确认和已过期的消息。"""
+        from app import socketio
+        while True:
+            socketio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                self._app.logger.exception('Relay sweep failed')
+
+
+def _message(message_id, sender, payload, client_id, created_at):
+    return {'id': message_id, 'from': sender, 'payload': payload,
+            'client_id': client_id, 'timestamp': created_at}
@@ -0,0 +1,143 @@
+import random
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, inspect, orm
+from app.database import register_pragmas
+from app.identity_cache import TTLCache
+
+"""
+读写分离 (Read/Write Routing)
+
+好友列表、好友请求、用户资料/公钥/连接信息和管理员用户列表等接口只读取数据，却与上线/下线的写入共用同一个引擎。
+配置 DATABASE_REPLICA_URLS 后:
+
+    - 标记为只读的接口（`@replicas.read_only`）在整个请求中随机使用一个副本执行查询；
+    - 其余接口、Socket.IO 事件和后台任务始终使用主库；只读接口中的 flush 和 INSERT/UPDATE/DELETE 语句也发往主库；
+    - 读己之写 (read-your-writes): 用户提交写入后的 DB_READ_YOUR_WRITES_WINDOW 秒内，
+      其只读请求仍使用主库，避免副本复制延迟导致用户看不到自己刚做的修改。
+      修改了其他用户可见数据的接口（如发送好友请求）应调用 `replicas.record_write` 让对方也暂时使用主库；
+    - 进程级缓存的加载（如好友关系图）应在 `replicas.primary()` 中进行，避免把副本上过期的数据长期缓存下来。
+
+副本以 Flask-SQLAlchemy 的 bind（键为 replica_0、replica_1 ...）创建，与主库使用相同的引擎参数，
+因此副本应与主库是同一类数据库。写入记录保存在进程内，多 worker 部署时依靠反向代理的粘性会话
+让同一用户的请求落在同一个 worker 上。
+"""
+
+
+class RoutingSession(SignallingSession):
+    """按当前请求的路由决定使用副本还是主库的会话。"""
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_app_context() and not self._flushing and not getattr(clause, 'is_dml', False):
+            replica = g.get('db_replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """使用 RoutingSession 作为会话类的 Flask-SQLAlchemy 扩展。"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def current_user_id():
+    """当前请求（HTTP 或 Socket.IO 事件）的用户ID，未认证时返回None；不会为过期的属性触发查询。"""
+    if not has_app_context():
+        return None
+    user_id = g.get('current_user_id')
+    if user_id is None and g.get('current_user') is not None:
+        identity = inspect(g.current_user).identity
+        user_id = identity[0] if identity else None
+    return user_id
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _remember_writer(session, flush_context):
+    user_id = current_user_id()
+    if user_id is not None:
+        session.info.setdefault('writers', set()).add(user_id)
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _remember_bulk_writer(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _remember_writer(orm_execute_state.session, None)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _record_writers(session):
+    writers = session.info.pop('writers', None)
+    router = current_app.extensions.get('replica_router')
+    if writers and router is not None:
+        for user_id in writers:
+            router.record_write(user_id)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_writers(session):
+    session.info.pop('writers', None)
+
+
+class ReplicaRouter:
+    """只读副本的路由，采用与 Flask 扩展相同的 init_app 模式。"""
+
+    # 最多记录多少个用户的最近写入时间
+    MAX_TRACKED_WRITERS = 100000
+
+    def __init__(self, app=None):
+        self.engines = []
+        self.recent_writes = TTLCache(0, 0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from app import db
+        urls = app.config.get('DATABASE_REPLICA_URLS') or []
+        window = app.config.get('DB_READ_YOUR_WRITES_WINDOW', 5)
+        self.recent_writes = TTLCache(self.MAX_TRACKED_WRITERS, window)
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        keys = []
+        for index, url in enumerate(urls):
+            keys.append(f'replica_{index}')
+            binds[keys[-1]] = url
+        app.config['SQLALCHEMY_BINDS'] = binds
+        with app.app_context():
+            self.engines = [db.get_engine(app, bind=key) for key in keys]
+        for engine, url in zip(self.engines, urls):
+            register_pragmas(app, engine, url)
+        app.extensions['replica_router'] = self
+
+    def choose(self, user_id=None):
+        """为一个只读请求选择副本引擎；未配置副本或该用户刚写入过时返回None（使用主库）。"""
+        if not self.engines:
+            return None
+        if user_id is not None and self.recent_writes.get(user_id) is not None:
+            return None
+        return random.choice(self.engines)
+
+    def record_write(self, user_id):
+        """记录该用户的数据刚刚发生变化，窗口期内其只读请求使用主库。"""
+        self.recent_writes.set(user_id, True)
+
+    def read_only(self, f):
+        """只读接口的装饰器，放在 @token_required / @admin_required 之下，以便按当前用户判断读己之写。"""
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            g.db_replica = self.choose(current_user_id())
+            return f(*args, **kwargs)
+        return decorated
+
+    @contextmanager
+    def primary(self):
+        """在此上下文中的查询始终使用主库。"""
+        replica = g.pop('db_replica', None) if has_app_context() else None
+        try:
+            yield
+        finally:
+            if replica is not None:
+                g.db_replica = replica
+
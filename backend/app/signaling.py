@@ -0,0 +1,100 @@
+import json
+import threading
+
+"""
+WebRTC 信令合并 (Signal Coalescing)
+
+建立一次通话时，每一方通常会在几百毫秒内陆续发出 10~40 个 ICE 候选地址 (trickle ICE)。
+逐条转发意味着同样多次的 emit、序列化和网络帧。本模块在一个很短的时间窗口
+(SIGNAL_COALESCE_WINDOW 秒) 内按 (发送者, 接收者) 合并候选地址，窗口结束时用一个
+'webrtc_signal_batch' 事件一次性发给接收者:
+    - 只合并候选地址（带 'candidate' 字段且不带 'sdp' 字段的信令）；
+    - SDP offer/answer 等其他信令立即转发，转发前先发出同一对用户之间尚未发出的候选地址，保证顺序；
+    - 一批达到 SIGNAL_MAX_BATCH 条时立即发出；
+    - 序列化后超过 SIGNAL_MAX_PAYLOAD 字节、或无法序列化为 JSON（如二进制附件）的信令直接丢弃。
+只支持 'webrtc_signal' 的旧客户端收不到 'webrtc_signal_batch'，因此合并默认关闭（SIGNAL_COALESCE_WINDOW 为 0），
+每条信令以单独的 'webrtc_signal' 事件转发；所有客户端都能处理批量事件后再设置窗口开启合并。
+"""
+
+
+class SignalTooLarge(ValueError):
+    """信令序列化后超过 SIGNAL_MAX_PAYLOAD，或无法序列化为 JSON。"""
+
+
+def is_candidate(signal):
+    return isinstance(signal, dict) and 'candidate' in signal and 'sdp' not in signal
+
+
+class SignalCoalescer:
+    """按 (发送者, 接收者) 合并 ICE 候选地址，采用与 Flask 扩展相同的 init_app 模式。"""
+
+    def __init__(self, app=None):
+        self.window = 0
+        self.max_batch = 50
+        self.max_payload = 16 * 1024
+        self._pending = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.window = app.config.get('SIGNAL_COALESCE_WINDOW', self.window)
+        self.max_batch = app.config.get('SIGNAL_MAX_BATCH', self.max_batch)
+        self.max_payload = app.config.get('SIGNAL_MAX_PAYLOAD', self.max_payload)
+        with self._lock:
+            self._pending.clear()
+        app.extensions['signal_coalescer'] = self
+
+    def send(self, sender, recipient, signal):
+        """转发一条信令。超过大小限制或无法序列化为 JSON 时抛出 SignalTooLarge。"""
+        try:
+            size = len(json.dumps(signal, separators=(',', ':')))
+        except (TypeError, ValueError) as e:
+            raise SignalTooLarge('Signal is not JSON serializable') from e
+        if size > self.max_payload:
+            raise SignalTooLarge('Signal exceeds SIGNAL_MAX_PAYLOAD')
+
+        from app import socketio
+        key = (sender, recipient)
+        if self.window <= 0 or not is_candidate(signal):
+            self.flush(key)
+            socketio.emit('webrtc_signal', {'from': sender, 'signal': signal}, to=recipient)
+            return
+
+        with self._lock:
+            batch = self._pending.get(key)
+            first = batch is None
+            if first:
+                batch = self._pending[key] = []
+            batch.append(signal)
+            full = len(batch) >= self.max_batch
+        if full:
+            self.flush(key)
+        elif first:
+            socketio.start_background_task(self._flush_later, key)
+
+    def flush(self, key):
+        """立即发出 (发送者, 接收者) 之间尚未发出的候选地址。"""
+        with self._lock:
+            batch = self._pending.pop(key, None)
+        if batch:
+            from app import socketio
+            sender, recipient = key
+            socketio.emit('webrtc_signal_batch', {'from': sender, 'signals': batch}, to=recipient)
+
+    def flush_all(self):
+        with self._lock:
+            keys = list(self._pending)
+        for key in keys:
+            self.flush(key)
+
+    @property
+    def pending(self):
+        """尚未发出的候选地址数。"""
+        with self._lock:
+            return sum(len(batch) for batch in self._pending.values())
+
+    def _flush_later(self, key):
+        from app import socketio
+        socketio.sleep(self.window)
+        self.flush(key)
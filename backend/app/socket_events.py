@@ -1,8 +1,13 @@
+import time
 from flask import g, request
-from flask_socketio import emit, join_room, leave_room
-from app import socketio, db
-from app.models import User
-from app.api.auth_socket import token_required_socket
+from flask_socketio import emit, join_room, leave_room, rooms, ConnectionRefusedError
+from app import (socketio, db, presence, presence_writer, lifecycle, identity_cache, friend_graph, relay,
+                 signal_coalescer, metrics)
+from app.models import User, friendships
+from app.api.auth_socket import token_required_socket, authenticate_connection
+from app.relay import RelayBusy
+from app.signaling import SignalTooLarge
+from app.groups import group_room, group_ids_of, sync_group_rooms
 
 """
 WebSocket 事件处理模块
@@ -11,122 +16,220 @@ WebSocket 事件处理模块
 它负责管理用户的连接、认证、在线状态同步，以及为WebRTC P2P连接提供信令服务。
 """
 
-# 在线用户名字典，用于快速查找用户的会话ID(sid)和用户名。
-# 这是一个双向映射，方便通过sid找到用户名，或通过用户名找到sid。
-# 结构: { 'username1': 'sid123', 'sid123': 'username1', ... }
-online_users = {}
-
-def get_sid_by_username(username):
-    """一个辅助函数，根据用户名从在线用户字典中获取其对应的Socket.IO会话ID。"""
-    return online_users.get(username)
+def get_friends_presence(user_id):
+    """
+    用一次查询取出用户的所有好友（走 friendships 表的主键索引），
+    再通过在线状态注册表一次性批量判断在线状态。
+    P2P连接信息以在线状态写入缓冲区中尚未写入数据库的值为准。
+    返回的列表可直接作为 'friends_presence_snapshot' 事件的内容，只有在线好友才带有P2P连接信息。
+    """
+    rows = db.session.query(User.id, User.username, User.is_online, User.ip_address, User.port).join(
+        friendships, friendships.c.friend_id == User.id
+    ).filter(friendships.c.user_id == user_id).all()
+    online = presence.online_among(row.username for row in rows)
+    friends = []
+    for row in rows:
+        is_online = row.username in online
+        _, ip_address, port = presence_writer.overlay(row.id, row.is_online, row.ip_address, row.port)
+        friends.append({
+            'username': row.username,
+            'is_online': is_online,
+            'ip_address': ip_address if is_online else None,
+            'port': port if is_online else None
+        })
+    return friends
 
 @socketio.on('connect')
-def handle_connect():
+@metrics.timed_event('connect')
+def handle_connect(auth=None):
     """
-    处理客户端成功建立WebSocket连接的事件。
-    这是一个初始握手，此时服务器只知道有一个新的匿名连接建立。
-    客户端需要在连接成功后，立即发送 'authenticate' 事件并附上JWT来进行身份验证。
+    处理客户端建立WebSocket连接的握手事件。
+    客户端必须在握手的 auth 数据中携带JWT（`io(URL, { auth: { token } })`）。
+    令牌无效的连接在这里就会被拒绝；验证通过后，身份被绑定到该连接的会话中，
+    之后的事件无需再次携带或验证令牌。
+    客户端仍需在连接成功后发送 'authenticate' 事件，上报P2P连接信息并完成上线。
+    进程正在优雅关闭时拒绝新连接，客户端会重连到其他 worker。
     """
-    print(f'客户端已连接，会话ID: {request.sid}')
+    if lifecycle.draining:
+        raise ConnectionRefusedError('Server is shutting down')
+    user = authenticate_connection(auth)
+    print(f'客户端已连接，会话ID: {request.sid}，用户: {user.username}')
 
 @socketio.on('authenticate')
+@metrics.timed_event('authenticate')
 @token_required_socket
 def handle_authenticate(data):
     """
-    处理客户端的身份验证事件。这是连接后最关键的一步。
-    此事件受 `token_required_socket` 装饰器保护，确保只有携带有效JWT的客户端才能认证成功。
+    处理客户端的上线事件。这是连接后最关键的一步。
+    此事件受 `token_required_socket` 装饰器保护，只有在握手阶段通过认证的连接才能上线。
     
     功能:
-    1. 将数据库中用户的在线状态(is_online)标记为True。
+    1. 将用户的在线状态(is_online)标记为True。
     2. 存储客户端上报的用于P2P通信的IP地址和端口号。
+       这两项写入在线状态写入缓冲区，由后台任务批量写入数据库（见 app/presence_writer.py）。
     3. 将当前连接加入一个以该用户命名的"房间"(Room)，方便服务器后续向该用户定向发送消息。
-    4. 维护 online_users 字典，建立用户名和sid的双向映射。
+    4. 在在线状态注册表(presence)中登记用户名和sid的映射，以及P2P连接信息。
     5. 向该用户的所有好友广播其上线的消息（包括P2P连接信息）。
     6. 向该用户发送其所有在线好友的列表和状态。
+    7. 批量投递该用户离线期间通过服务器中转的消息。
+    8. 加入该用户所在的每个群的房间。
     """
-    # g.current_user 由 @token_required_socket 装饰器提供
-    user = g.current_user
-    user.is_online = True
+    # 即将关闭的进程不再登记新的在线用户，连接断开后客户端会重连到其他 worker
+    if lifecycle.draining:
+        return
+    # g.current_user_id 由 @token_required_socket 装饰器提供
+    user = identity_cache.get_user(g.current_user_id)
+    if not user:
+        return
     # 从客户端发送的数据中获取用于P2P的IP和端口，如果未提供，IP地址默认为请求来源IP
-    user.ip_address = data.get('ip_address', request.remote_addr)
-    user.port = data.get('port')
-    db.session.commit()
+    ip_address = data.get('ip_address', request.remote_addr)
+    port = data.get('port')
+    presence_writer.set_online(user.id, ip_address, port)
 
-    # 4. 在内存中建立双向映射，用于快速查找
-    online_users[user.username] = request.sid
-    online_users[request.sid] = user.username
+    # 4. 在在线状态注册表中登记，供其他 worker 和管理员接口查询
+    presence.register(user.username, request.sid, ip_address, port)
 
     # 3. 加入以用户名为名的专属房间
     join_room(user.username)
+    # 8. 一次查询取出用户加入的所有群，加入对应的群房间
+    for group_id in group_ids_of(user.id):
+        join_room(group_room(group_id))
     print(f'用户 {user.username} (SID: {request.sid}) 已通过认证，加入房间并标记为在线。')
 
-    # 5 & 6. 遍历用户的好友列表，进行双向状态通知
-    for friend in user.friends:
-        # 只通知在线的好友
-        if friend.is_online:
-            # 通知好友"我"上线了，并把"我"的连接信息发给他
-            emit('friend_status_update', {
-                'username': user.username,
-                'is_online': True,
-                'ip_address': user.ip_address,
-                'port': user.port
-            }, to=friend.username) # 'to'参数指定了接收消息的房间名
-
-            # 同时，也通知"我"这个好友是在线的，并把他的连接信息发给"我"
-            emit('friend_status_update', {
-                'username': friend.username,
-                'is_online': True,
-                'ip_address': friend.ip_address,
-                'port': friend.port
-            }, to=user.username)
+    # 5 & 6. 一次查询取出所有好友，通过注册表一次性筛选在线好友，再批量通知
+    friends = get_friends_presence(user.id)
+    online_friends = [friend['username'] for friend in friends if friend['is_online']]
+    if online_friends:
+        # 通知所有在线好友"我"上线了。'to' 可以是房间名列表，每个好友只收到一条消息
+        emit('friend_status_update', {
+            'username': user.username,
+            'is_online': True,
+            'ip_address': ip_address,
+            'port': port
+        }, to=online_friends)
+
+    # 同时，用一条快照消息把所有好友的状态和在线好友的连接信息发给"我"
+    emit('friends_presence_snapshot', {'friends': friends}, to=request.sid)
+
+    # 7. 投递离线期间收到的中转消息，客户端处理后用 'relay_ack' 确认
+    relay.deliver_pending(user.username, request.sid)
 
 @socketio.on('disconnect')
+@metrics.timed_event('disconnect')
 def handle_disconnect():
     """
     处理客户端断开连接的事件。
     功能:
-    1. 从 online_users 字典中移除该用户的映射关系。
-    2. 将数据库中用户的在线状态(is_online)标记为False，并清除IP和端口。
+    1. 从在线状态注册表中注销该sid。
+    2. 将用户的在线状态(is_online)标记为False，并清除IP和端口（经由在线状态写入缓冲区）。
     3. 向该用户的所有在线好友广播其下线的消息。
     """
-    # 检查断开连接的sid是否是已认证的用户
-    if request.sid in online_users:
-        # 1. 通过sid找到用户名，然后移除两个方向的映射
-        username = online_users.pop(request.sid)
-        online_users.pop(username, None)
-
-        # 2. 更新数据库状态
-        user = User.query.filter_by(username=username).first()
+    # 1. 注销该sid；只有已认证的连接才会返回用户名
+    username = presence.unregister(request.sid)
+    # 如果该用户已经通过新的连接重新登记（例如刷新页面），旧连接的断开不应把他标记为离线
+    if username and not presence.is_online(username):
+        # 2. 更新在线状态，由后台任务批量写入数据库
+        user = identity_cache.get_user_by_username(username)
         if user:
-            user.is_online = False
-            user.ip_address = None
-            user.port = None
-            db.session.commit()
+            presence_writer.set_offline(user.id)
             print(f'用户 {user.username} 已断开连接，状态更新为离线。')
 
-            # 3. 通知所有在线好友该用户已下线
-            for friend in user.friends:
-                if friend.is_online:
-                    emit('friend_status_update', {
-                        'username': user.username,
-                        'is_online': False
-                    }, to=friend.username)
+            # 3. 通知所有在线好友该用户已下线，只需一次查询和一次广播
+            online_friends = [friend['username'] for friend in get_friends_presence(user.id)
+                              if friend['is_online']]
+            if online_friends:
+                emit('friend_status_update', {
+                    'username': user.username,
+                    'is_online': False
+                }, to=online_friends)
 
     print(f'客户端已断开，会话ID: {request.sid}')
 
 @socketio.on('private_message')
+@metrics.timed_event('private_message')
 @token_required_socket
 def handle_private_message(data):
     """
-    处理私聊消息事件（已弃用）。
-    在旧的C/S架构中，此事件用于通过服务器转发消息。
-    在当前的P2P架构中，消息直接在客户端之间传输，不再经过服务器。
-    保留此事件仅用于调试或向后兼容目的。
+    通过服务器中转一条端到端加密的私聊消息。
+    消息优先通过 WebRTC P2P 通道传输；好友离线或P2P连接无法建立时，客户端改用此事件。
+    服务器不解密 payload，只把它暂存在接收者的队列中，接收者在线时立即推送，否则在其上线时投递。
+
+    数据: {'to': 接收者用户名, 'payload': 密文字符串, 'client_id': 可选的客户端消息ID}
+    返回值（Socket.IO 确认回调）: {'status': 'queued'}，或 {'status': 'error', 'error': 原因}。
+    只能向好友发送；缓冲区已满时返回 'busy'，客户端应稍后重试。
+    """
+    to_username = data.get('to')
+    payload = data.get('payload')
+    if not isinstance(payload, str) or not payload:
+        return {'status': 'error', 'error': 'invalid_payload'}
+    if len(payload) > relay.max_payload:
+        return {'status': 'error', 'error': 'payload_too_large'}
+    recipient = identity_cache.get_user_by_username(to_username) if to_username else None
+    if recipient is None or not friend_graph.is_friend(g.current_user_id, recipient.id):
+        return {'status': 'error', 'error': 'not_friends'}
+
+    client_id = data.get('client_id')
+    try:
+        relay.enqueue(g.current_username, recipient.username, payload,
+                      str(client_id) if client_id is not None else None)
+    except RelayBusy:
+        return {'status': 'error', 'error': 'busy'}
+    return {'status': 'queued'}
+
+@socketio.on('relay_ack')
+@metrics.timed_event('relay_ack')
+@token_required_socket
+def handle_relay_ack(data):
+    """
+    确认已收到中转消息。
+    数据: {'up_to': 已处理的最大消息ID}，该ID及之前的消息都不会再次投递。
+    """
+    up_to = data.get('up_to')
+    if isinstance(up_to, int) and not isinstance(up_to, bool):
+        relay.ack(g.current_username, up_to)
+
+@socketio.on('group_message')
+@metrics.timed_event('group_message')
+@token_required_socket
+def handle_group_message(data):
+    """
+    发送一条群消息。服务器不保存也不解析 payload，只用一次 emit 转发给群房间中的其他在线成员。
+    成员身份由连接所在的房间判断，不查询数据库。
+
+    数据: {'group_id': 群ID, 'payload': 消息内容（字符串）, 'client_id': 可选的客户端消息ID}
+    返回值（确认回调）: {'status': 'sent'}，或 {'status': 'error', 'error': 原因}。
+    """
+    group_id = data.get('group_id')
+    payload = data.get('payload')
+    if not isinstance(payload, str) or not payload:
+        return {'status': 'error', 'error': 'invalid_payload'}
+    if len(payload) > relay.max_payload:
+        return {'status': 'error', 'error': 'payload_too_large'}
+    room = group_room(group_id)
+    if not isinstance(group_id, int) or room not in rooms():
+        return {'status': 'error', 'error': 'not_member'}
+
+    emit('group_message', {
+        'group_id': group_id,
+        'from': g.current_username,
+        'payload': payload,
+        'client_id': data.get('client_id'),
+        'timestamp': time.time()
+    }, to=room, include_self=False)
+    return {'status': 'sent'}
+
+@socketio.on('sync_groups')
+@metrics.timed_event('sync_groups')
+@token_required_socket
+def handle_sync_groups(data=None):
+    """
+    按数据库中的成员关系重新同步当前连接的群房间，返回用户加入的群ID列表。
+    客户端收到 'group_joined' 事件后应发送此事件（连接可能在另一个 worker 上）。
     """
-    recipient_username = data.get('to')
-    print(f"[警告：已弃用事件] 收到给 {recipient_username} 的私聊消息。消息应通过WebRTC P2P通道传输。")
+    return {'group_ids': sync_group_rooms(request.sid, g.current_user_id)}
 
 @socketio.on('webrtc_signal')
+@metrics.timed_event('webrtc_signal')
 @token_required_socket
 def handle_webrtc_signal(data):
     """
@@ -136,22 +239,19 @@ def handle_webrtc_signal(data):
     - SDP (Session Description Protocol) 的 offer 和 answer：描述了媒体流的配置。
     - ICE (Interactive Connectivity Establishment) 候选地址：描述了可能的网络路径。
     
-    此函数扮演的就是信令服务器的角色。它只是一个透明的中间人，
-    将信令消息从一个客户端原封不动地转发给另一个客户端。
+    此函数扮演的就是信令服务器的角色，将信令消息从一个客户端原封不动地转发给另一个客户端。
+    offer/answer 立即转发；ICE 候选地址在一个很短的窗口内合并后以 'webrtc_signal_batch'
+    事件一次发出（见 app/signaling.py）。
     """
     # 获取信令的目标接收者用户名
     to_username = data.get('to')
     if not to_username:
         print("[WebRTC 信令错误] 转发请求缺少 'to' 字段，无法确定接收者。")
-        return
+        return {'status': 'error', 'error': 'missing_recipient'}
 
     # 'signal' 字段中包含了WebRTC所需交换的任意信令数据 (offer/answer/candidate)
-    signal_data = data.get('signal')
-    
-    print(f"正在转发WebRTC信令: 从 {g.current_user.username} -> 至 {to_username}")
-
-    # 将信令数据包发送到指定用户的房间
-    emit('webrtc_signal', {
-        'from': g.current_user.username, # 附上发送者用户名
-        'signal': signal_data            # 原始信令数据
-    }, to=to_username)
\ No newline at end of file
+    try:
+        signal_coalescer.send(g.current_username, to_username, data.get('signal'))
+    except SignalTooLarge:
+        return {'status': 'error', 'error': 'payload_too_large'}
+    return {'status': 'sent'}
\ No newline at end of file
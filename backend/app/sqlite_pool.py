@@ -0,0 +1,72 @@
+import sqlite3
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+"""
+进程内共享的 SQLite 连接池。
+
+在线状态注册表、离线消息中转和 SQLite 消息队列都直接使用 sqlite3 访问各自的共享文件。
+按线程缓存连接（threading.local）在 eventlet / gevent 打过猴子补丁后会变成按协程缓存：
+每个处理请求的协程都会新建一个连接并重新执行 PRAGMA，协程结束后连接也不会被关闭。
+
+连接池按需创建连接，用完后放回空闲队列，由进程内所有线程和协程共享：
+    - 空闲队列最多保留 size 个连接，超出的连接在归还时关闭，因此长期占用的连接数是有界的；
+    - 取连接和还连接都不等待锁（deque 的 append / pop 是原子操作），
+      在协程和原生线程池（run_blocking）中都可以安全使用；
+    - 空闲连接后进先出，单线程使用时总是复用同一个连接；
+    - 新连接只在创建时执行一次 setup（例如 PRAGMA synchronous）；
+    - 归还时仍处于事务中的连接会先回滚，不会把未完成的事务交给下一个使用者。
+
+':memory:' 数据库在每个连接上都是独立的，连接池改为使用一个按实例命名的共享缓存内存数据库，
+池中的所有连接看到同一份数据（仅用于测试）。
+"""
+
+
+class SQLiteConnectionPool:
+    """SQLite 连接池。连接使用 isolation_level=None，由调用方显式控制事务边界。"""
+
+    def __init__(self, path, timeout=5.0, size=4, setup=None):
+        self.path = path
+        self.timeout = timeout
+        self.size = size
+        self.setup = setup
+        self._idle = deque()
+        if path == ':memory:':
+            self._target, self._uri = f'file:pool-{uuid.uuid4().hex}?mode=memory&cache=shared', True
+        else:
+            self._target, self._uri = path, False
+
+    def _open(self):
+        conn = sqlite3.connect(self._target, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False, uri=self._uri)
+        if self.setup is not None:
+            self.setup(conn)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接，退出 with 块时归还。"""
+        try:
+            conn = self._idle.pop()
+        except IndexError:
+            conn = self._open()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def _release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+        except sqlite3.Error:
+            conn.close()
+            return
+        if len(self._idle) < self.size:
+            self._idle.append(conn)
+        else:
+            conn.close()
+
+    def idle_count(self):
+        return len(self._idle)
@@ -0,0 +1,371 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(__file__))
+from common import (SECRET_KEY as BENCH_SECRET_KEY, free_port, git_commit, make_token, percentiles, seed_users,
+                    start_server, stop_server, write_report)
+import requests
+
+"""
+HTTP API 基准测试（大规模合成数据集）。
+
+    1. 生成数据集（可用 --cache-dir 缓存，相同参数的数据集只生成一次）:
+       --users 个用户（user0 为管理员）、--friendships 条 friendships 记录（每对好友两条）、
+       --pending 条待处理的好友请求，以及 --key-fraction 比例的用户上传了公钥；
+    2. 进程内阶段: 用 Flask 测试客户端对每个接口各请求 --samples 次，统计每个请求执行的 SQL 语句数
+       和不含网络的处理耗时；
+    3. HTTP 阶段: 以 --mode 启动后端，对每个接口用 --clients 个并发客户端持续请求 --duration 秒，
+       统计吞吐量 (请求/秒)、延迟分位数和错误数；
+    4. 检查回归阈值: 每个接口的 SQL 语句数不得超过 QUERY_BUDGETS，两个阶段都不得出现非 2xx 响应；指定 --baseline 时，
+       p95 延迟和吞吐量相对基线的变化不得超过 --tolerance。有检查未通过时以退出码 1 结束。
+
+被测接口: /login、/friends、/friend-requests、/users/<u>/info、/users/<u>/public_key、/admin/users（按页）。
+请求的用户从前 --probe-users 个用户中随机选取；/users/<u>/info 查询的是请求者的好友。
+
+用法（在 backend 目录下，需先安装 benchmarks/requirements.txt）:
+    python benchmarks/bench_api.py --cache-dir /tmp/easychat-bench --output api.json
+    python benchmarks/bench_api.py --cache-dir /tmp/easychat-bench --baseline api.json
+"""
+
+# 每个接口每次请求允许执行的 SQL 语句数上限（进程内阶段的最大值，身份缓存未命中时最多），
+# 超过即视为 N+1 之类的回归。数值与好友数、结果条数无关。
+QUERY_BUDGETS = {
+    'login': 3,
+    'friends': 3,
+    'friend_requests': 2,
+    'user_info': 4,
+    'public_key': 2,
+    'admin_users': 3,
+}
+
+PUBLIC_KEY = '-----BEGIN PUBLIC KEY-----\n' + 'A' * 392 + '\n-----END PUBLIC KEY-----'
+
+# 数据集的生成方式变化时递增，使 --cache-dir 中旧的数据集失效
+DATASET_VERSION = 2
+
+
+def has_key(user_id, key_fraction):
+    """按用户ID确定性地决定用户是否上传了公钥。"""
+    return (user_id * 2654435761) % 1000 < key_fraction * 1000
+
+
+def generate_dataset(db_uri, args):
+    """生成合成数据集，返回 {'ids': {用户名: 用户ID}, 'counts': {各表的实际行数}}。"""
+    from sqlalchemy import func
+    from app import create_app, db
+    from app.models import User, FriendRequest, friendships, public_key_fingerprint
+    from config import TestingConfig
+
+    class SeedConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = db_uri
+
+    ids = seed_users(db_uri, args.users, rounds=args.rounds)
+    rng = random.Random(args.seed)
+    user_ids = sorted(ids.values())
+    app = create_app(SeedConfig)
+    with app.app_context():
+        db.session.query(User).filter(User.username == 'user0').update({'is_admin': True})
+        keyed = [user_id for user_id in user_ids if has_key(user_id, args.key_fraction)]
+        for start in range(0, len(keyed), 50000):
+            db.session.execute(User.__table__.update().where(User.id.in_(keyed[start:start + 50000]))
+                               .values(public_key=PUBLIC_KEY, public_key_version=1,
+                                       public_key_fingerprint=public_key_fingerprint(PUBLIC_KEY)))
+
+        # 好友关系: 随机配对，双向写入，重复的配对由 INSERT OR IGNORE 跳过
+        insert_friendship = friendships.insert().prefix_with('OR IGNORE')
+        remaining = args.friendships // 2
+        while remaining > 0:
+            chunk = min(remaining, 25000)
+            rows = []
+            for _ in range(chunk):
+                a, b = rng.sample(user_ids, 2)
+                rows.append({'user_id': a, 'friend_id': b})
+                rows.append({'user_id': b, 'friend_id': a})
+            db.session.execute(insert_friendship, rows)
+            remaining -= chunk
+
+        # 待处理的好友请求: 每对 (发送者, 接收者) 只能有一条，重复的同样跳过
+        insert_request = FriendRequest.__table__.insert().prefix_with('OR IGNORE')
+        now = datetime.utcnow()
+        remaining = args.pending
+        while remaining > 0:
+            chunk = min(remaining, 50000)
+            rows = []
+            for _ in range(chunk):
+                requester, receiver = rng.sample(user_ids, 2)
+                rows.append({'requester_id': requester, 'receiver_id': receiver, 'status': 'pending',
+                             'timestamp': now - timedelta(seconds=rng.randrange(86400 * 30))})
+            db.session.execute(insert_request, rows)
+            remaining -= chunk
+        db.session.commit()
+
+        counts = {
+            'users': db.session.query(func.count(User.id)).scalar(),
+            'friendships': db.session.query(func.count()).select_from(friendships).scalar(),
+            'pending_requests': db.session.query(func.count(FriendRequest.id)).scalar(),
+            'public_keys': db.session.query(func.count(User.id)).filter(User.public_key.isnot(None)).scalar(),
+        }
+    return {'ids': ids, 'counts': counts}
+
+
+def load_probe_friends(db_uri, probe_ids):
+    """查询探测用户的好友用户名，供 /users/<u>/info 选取目标。"""
+    from app import create_app, db
+    from app.models import User, friendships
+    from config import TestingConfig
+
+    class SeedConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = db_uri
+
+    app = create_app(SeedConfig)
+    friends = {user_id: [] for user_id in probe_ids}
+    with app.app_context():
+        rows = db.session.query(friendships.c.user_id, User.username).join(
+            User, User.id == friendships.c.friend_id).filter(friendships.c.user_id.in_(probe_ids))
+        for user_id, username in rows:
+            friends[user_id].append(username)
+    return friends
+
+
+def prepare_dataset(args):
+    """返回 (数据库URI, 数据集描述, 需要删除的临时目录)。指定 --cache-dir 时复用已生成的数据集。"""
+    name = f'api-v{DATASET_VERSION}-{args.users}-{args.friendships}-{args.pending}-{args.key_fraction}-{args.rounds}-{args.seed}'
+    if args.cache_dir:
+        os.makedirs(args.cache_dir, exist_ok=True)
+        path, tmpdir = os.path.join(args.cache_dir, name + '.db'), None
+    else:
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, name + '.db')
+    db_uri = 'sqlite:///' + path
+    meta_path = path + '.json'
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            return db_uri, json.load(f), tmpdir
+
+    if os.path.exists(path):
+        os.remove(path)
+    started = time.perf_counter()
+    dataset = generate_dataset(db_uri, args)
+    dataset['generate_seconds'] = round(time.perf_counter() - started, 1)
+    with open(meta_path, 'w') as f:
+        json.dump(dataset, f)
+    return db_uri, dataset, tmpdir
+
+
+def build_targets(dataset, probe_friends, args):
+    """每个被测接口对应一个函数: rng -> (方法, 路径, JSON请求体, 令牌)。"""
+    ids = dataset['ids']
+    names = {user_id: name for name, user_id in ids.items()}
+    probes = [user_id for user_id, friends in probe_friends.items() if friends]
+    keyed = [name for name, user_id in ids.items() if has_key(user_id, args.key_fraction)][:10000]
+    tokens = {user_id: make_token(user_id) for user_id in probe_friends}
+    admin_token = make_token(ids['user0'])
+    max_id = max(ids.values())
+
+    def login(rng):
+        return 'POST', '/api/login', {'username': names[rng.choice(probes)], 'password': 'password'}, None
+
+    def friends(rng):
+        return 'GET', '/api/friends', None, tokens[rng.choice(probes)]
+
+    def friend_requests(rng):
+        return 'GET', '/api/friend-requests', None, tokens[rng.choice(probes)]
+
+    def user_info(rng):
+        user_id = rng.choice(probes)
+        return 'GET', f'/api/users/{rng.choice(probe_friends[user_id])}/info', None, tokens[user_id]
+
+    def public_key(rng):
+        return 'GET', f'/api/users/{rng.choice(keyed)}/public_key', None, tokens[rng.choice(probes)]
+
+    def admin_users(rng):
+        return 'GET', f'/api/admin/users?limit=100&after={rng.randrange(max_id)}', None, admin_token
+
+    return {'login': login, 'friends': friends, 'friend_requests': friend_requests,
+            'user_info': user_info, 'public_key': public_key, 'admin_users': admin_users}
+
+
+def in_process(db_uri, targets, args):
+    """用 Flask 测试客户端请求每个接口，统计 SQL 语句数和处理耗时。"""
+    from sqlalchemy import event
+    from app import create_app, db
+    from config import TestingConfig
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = db_uri
+        SECRET_KEY = BENCH_SECRET_KEY
+        BCRYPT_ROUNDS = args.rounds
+
+    app = create_app(BenchConfig)
+    client = app.test_client()
+    rng = random.Random(args.seed)
+    results = {}
+    with app.app_context():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            for name, target in targets.items():
+                counts, latencies, errors = [], [], 0
+                for _ in range(args.samples):
+                    method, path, body, token = target(rng)
+                    headers = {'Authorization': f'Bearer {token}'} if token else {}
+                    del statements[:]
+                    started = time.perf_counter()
+                    response = client.open(path, method=method, json=body, headers=headers)
+                    latencies.append(time.perf_counter() - started)
+                    counts.append(len(statements))
+                    if not 200 <= response.status_code < 300:
+                        errors += 1
+                results[name] = {
+                    'queries_per_request': {'mean': round(sum(counts) / len(counts), 2), 'max': max(counts)},
+                    'latency': percentiles(latencies),
+                    'errors': errors,
+                }
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return results
+
+
+
+def over_http(url, target, args):
+    """用 --clients 个并发客户端持续请求一个接口 --duration 秒。"""
+    latencies, lock = [], threading.Lock()
+    counters = {'errors': 0}
+    deadline = time.perf_counter() + args.duration
+
+    def client(index):
+        session = requests.Session()
+        rng = random.Random(args.seed * 1000 + index)
+        while time.perf_counter() < deadline:
+            method, path, body, token = target(rng)
+            headers = {'Authorization': f'Bearer {token}'} if token else {}
+            started = time.perf_counter()
+            try:
+                status = session.request(method, url + path, json=body, headers=headers, timeout=30).status_code
+            except requests.RequestException:
+                status = None
+            elapsed = time.perf_counter() - started
+            with lock:
+                if status is not None and 200 <= status < 300:
+                    latencies.append(elapsed)
+                else:
+                    counters['errors'] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'requests_per_second': round(len(latencies) / args.duration, 1),
+        'latency': percentiles(latencies),
+        'errors': counters['errors'],
+    }
+
+
+def check_regressions(endpoints, baseline, tolerance):
+    """返回检查结果列表，每项为 {'endpoint', 'check', 'value', 'limit', 'passed'}。"""
+    checks = []
+
+    def add(endpoint, name, value, limit, passed):
+        checks.append({'endpoint': endpoint, 'check': name, 'value': value, 'limit': limit, 'passed': passed})
+
+    for name, result in endpoints.items():
+        queries = result['in_process']['queries_per_request']['max']
+        add(name, 'queries_per_request', queries, QUERY_BUDGETS[name], queries <= QUERY_BUDGETS[name])
+        # 返回错误的接口可能很少查询数据库，语句数达标不代表接口正常
+        for phase in ('in_process', 'http'):
+            if phase in result:
+                add(name, f'{phase}_errors', result[phase]['errors'], 0, result[phase]['errors'] == 0)
+        previous = (baseline or {}).get(name)
+        if not previous or 'http' not in result or 'http' not in previous:
+            continue
+        p95, base_p95 = result['http']['latency'].get('p95_ms'), previous['http']['latency'].get('p95_ms')
+        if p95 is not None and base_p95:
+            limit = round(base_p95 * (1 + tolerance), 3)
+            add(name, 'p95_ms', p95, limit, p95 <= limit)
+        rps, base_rps = result['http']['requests_per_second'], previous['http']['requests_per_second']
+        if base_rps:
+            limit = round(base_rps * (1 - tolerance), 1)
+            add(name, 'requests_per_second', rps, limit, rps >= limit)
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP API benchmark against a synthetic large database.')
+    parser.add_argument('--users', type=int, default=100000, help='number of users')
+    parser.add_argument('--friendships', type=int, default=2000000,
+                        help='number of friendships rows (two per friendship)')
+    parser.add_argument('--pending', type=int, default=200000, help='number of pending friend requests')
+    parser.add_argument('--key-fraction', type=float, default=0.8, help='share of users with a public key')
+    parser.add_argument('--probe-users', type=int, default=1000, help='users that send the requests')
+    parser.add_argument('--rounds', type=int, default=4, help='bcrypt work factor of the seeded passwords')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the dataset and requests')
+    parser.add_argument('--cache-dir', help='keep generated datasets here and reuse them')
+    parser.add_argument('--samples', type=int, default=200, help='in-process requests per endpoint')
+    parser.add_argument('--mode', default='gevent', help='SERVER_MODE of the server under test')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent HTTP clients per endpoint')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of HTTP load per endpoint')
+    parser.add_argument('--skip-http', action='store_true', help='only run the in-process phase')
+    parser.add_argument('--endpoints', help='comma separated subset of endpoints to run')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative p95 latency increase and throughput drop against the baseline')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    db_uri, dataset, tmpdir = prepare_dataset(args)
+    try:
+        ids = dataset['ids']
+        probe_ids = sorted(ids.values())[1:args.probe_users + 1]
+        targets = build_targets(dataset, load_probe_friends(db_uri, probe_ids), args)
+        if args.endpoints:
+            targets = {name: targets[name] for name in args.endpoints.split(',')}
+
+        endpoints = {name: {'in_process': result} for name, result in in_process(db_uri, targets, args).items()}
+        if not args.skip_http:
+            port = free_port()
+            server = start_server(args.mode, port, db_uri, {'BCRYPT_ROUNDS': str(args.rounds)})
+            try:
+                for name, target in targets.items():
+                    endpoints[name]['http'] = over_http(f'http://127.0.0.1:{port}', target, args)
+            finally:
+                stop_server(server)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['result']['endpoints']
+    checks = check_regressions(endpoints, baseline, args.tolerance)
+    report = {
+        'commit': git_commit(),
+        'cpu_count': os.cpu_count(),
+        'mode': args.mode,
+        'clients': args.clients,
+        'dataset': dict(dataset['counts'], generate_seconds=dataset.get('generate_seconds')),
+        'endpoints': endpoints,
+        'checks': checks,
+        'passed': all(check['passed'] for check in checks),
+    }
+    write_report({'benchmark': 'api', 'result': report}, args.output)
+    if not report['passed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
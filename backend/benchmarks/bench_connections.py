@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from common import (free_port, make_token, percentiles, process_rss_mb, seed_users,
+                    start_server, stop_server, write_report)
+import socketio
+
+"""
+连接容量与信令延迟基准测试。
+
+对每一种服务器模式（默认对比 'dev' 与 'gevent'）分别：
+    1. 启动一个使用临时数据库的后端进程；
+    2. 以有限的并发建立 N 个空闲的 WebSocket 连接，统计成功数、失败数和建连耗时；
+    3. 在这些空闲连接保持打开的情况下，让两个已认证的客户端互相发送 webrtc_signal，
+       统计单程信令延迟的分位数；
+    4. 记录服务器进程的常驻内存。
+
+用法（在 backend 目录下，需先安装 benchmarks/requirements.txt）:
+    python benchmarks/bench_connections.py --modes dev,gevent --connections 5000
+
+注意：大量连接需要提高文件描述符上限，例如 `ulimit -n 65535`。
+"""
+
+
+async def open_idle_connections(url, token, count, concurrency):
+    """以最多 concurrency 个并发建立 count 个空闲连接，返回 (客户端列表, 建连耗时列表, 失败数)。"""
+    semaphore = asyncio.Semaphore(concurrency)
+    clients, durations = [], []
+    failures = 0
+
+    async def open_one():
+        nonlocal failures
+        async with semaphore:
+            client = socketio.AsyncClient(reconnection=False)
+            start = time.perf_counter()
+            try:
+                await client.connect(url, transports=['websocket'], auth={'token': token},
+                                     wait_timeout=30)
+            except Exception:
+                failures += 1
+                return
+            durations.append(time.perf_counter() - start)
+            clients.append(client)
+
+    await asyncio.gather(*(open_one() for _ in range(count)))
+    return clients, durations, failures
+
+
+async def measure_signal_latency(url, tokens, rounds):
+    """两个已认证客户端之间的单程 webrtc_signal 延迟。"""
+    sender = socketio.AsyncClient(reconnection=False)
+    receiver = socketio.AsyncClient(reconnection=False)
+    arrivals = asyncio.Queue()
+
+    @receiver.on('webrtc_signal')
+    async def on_signal(data):
+        await arrivals.put(time.perf_counter())
+
+    for client, (username, token) in ((sender, tokens[0]), (receiver, tokens[1])):
+        await client.connect(url, transports=['websocket'], auth={'token': token})
+        await client.emit('authenticate', {'token': token, 'port': 0})
+    await asyncio.sleep(0.5)
+
+    latencies = []
+    for i in range(rounds):
+        sent = time.perf_counter()
+        await sender.emit('webrtc_signal', {
+            'to': tokens[1][0],
+            'signal': {'type': 'offer', 'sdp': f'round-{i}'},
+            'token': tokens[0][1],
+        })
+        try:
+            arrived = await asyncio.wait_for(arrivals.get(), timeout=10)
+        except asyncio.TimeoutError:
+            continue
+        latencies.append(arrived - sent)
+
+    await sender.disconnect()
+    await receiver.disconnect()
+    return latencies
+
+
+async def run_mode(mode, args):
+    tmpdir = tempfile.mkdtemp()
+    db_uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+    ids = seed_users(db_uri, 3)
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    server = start_server(mode, port, db_uri)
+    try:
+        rss_before = process_rss_mb(server.pid)
+        started = time.perf_counter()
+        clients, connect_times, failures = await open_idle_connections(
+            url, make_token(ids['user2']), args.connections, args.concurrency)
+        elapsed = time.perf_counter() - started
+
+        latencies = await measure_signal_latency(
+            url, [('user0', make_token(ids['user0'])), ('user1', make_token(ids['user1']))],
+            args.signals)
+        result = {
+            'mode': mode,
+            'connections_requested': args.connections,
+            'connections_open': len(clients),
+            'connection_failures': failures,
+            'connect_seconds_total': round(elapsed, 3),
+            'connect_latency': percentiles(connect_times),
+            'signal_latency_with_idle_load': percentiles(latencies),
+            'server_rss_mb_idle': rss_before,
+            'server_rss_mb_loaded': process_rss_mb(server.pid),
+        }
+        await asyncio.gather(*(client.disconnect() for client in clients),
+                             return_exceptions=True)
+        return result
+    finally:
+        stop_server(server)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WebSocket capacity and signaling latency benchmark.')
+    parser.add_argument('--modes', default='dev,gevent',
+                        help='comma separated SERVER_MODE values to compare')
+    parser.add_argument('--connections', type=int, default=1000,
+                        help='number of idle WebSocket connections to hold open')
+    parser.add_argument('--concurrency', type=int, default=200,
+                        help='maximum number of connection attempts in flight')
+    parser.add_argument('--signals', type=int, default=200,
+                        help='number of webrtc_signal round trips to time')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    results = [asyncio.run(run_mode(mode.strip(), args)) for mode in args.modes.split(',')]
+    write_report({'benchmark': 'connections', 'results': results}, args.output)
+
+
+if __name__ == '__main__':
+    main()
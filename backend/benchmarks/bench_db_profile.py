@@ -0,0 +1,176 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from common import (free_port, git_commit, make_token, percentiles, seed_ring_friendships, seed_users,
+                    start_server, stop_server, write_report)
+import requests
+import socketio
+
+"""
+数据库配置 (database profile) 的读写并发基准测试。
+
+对比两种配置在同一个 SQLite 文件上的表现:
+    - legacy: 旧的默认行为（回滚日志、synchronous=FULL、不使用连接池、不开启 mmap、默认页缓存）；
+    - production: config.py 当前的默认值（WAL、synchronous=NORMAL、连接池、mmap、64MB 页缓存）。
+
+每种配置下:
+    1. 新建数据库，创建 --users 个用户，每个用户有 --friends 个好友（环形）；
+    2. 启动 --workers 个后端进程（以 --mode 运行），共用同一个数据库文件，模拟多 worker 部署；
+    3. 在 --duration 秒内并发运行混合负载，客户端轮流连接到各个 worker:
+         * login: --login-clients 个线程反复 POST /api/login（只读）；
+         * friends: --friends-clients 个线程反复 GET /api/friends（只读）；
+         * presence: --presence-clients 个线程反复建立 Socket.IO 连接、authenticate 上线、断开下线
+           （每次上线和下线都会提交一次写事务）；
+    4. 分别统计每种操作的吞吐量、延迟分位数和错误数（含 "database is locked" 导致的 500）。
+
+用法（在 backend 目录下，需先安装 benchmarks/requirements.txt）:
+    python benchmarks/bench_db_profile.py --workers 4 --duration 30 --output db_profile.json
+
+PostgreSQL 的连接池参数无法在这里用 SQLite 对比，可用 --database-url 指向一个空的 PostgreSQL 数据库，
+只运行 production 配置: --profiles production --database-url postgresql+psycopg2://...
+"""
+
+# legacy 配置：关闭本次引入的所有 SQLite 优化
+PROFILES = {
+    'legacy': {
+        'SQLITE_WAL': '0',
+        'SQLITE_SYNCHRONOUS': 'FULL',
+        'SQLITE_MMAP_SIZE': '0',
+        'SQLITE_CACHE_SIZE_KB': '2000',
+        'DB_POOL_SIZE': '0',
+    },
+    'production': {},
+}
+
+BCRYPT_ROUNDS = 4
+
+
+def run_profile(name, db_uri, args):
+    ids = seed_users(db_uri, args.users, rounds=BCRYPT_ROUNDS)
+    usernames = [f'user{i}' for i in range(args.users)]
+    seed_ring_friendships(db_uri, [ids[username] for username in usernames], args.friends)
+    tokens = [make_token(ids[username]) for username in usernames]
+
+    env = dict(PROFILES[name], BCRYPT_ROUNDS=str(BCRYPT_ROUNDS))
+    servers, urls = [], []
+    try:
+        for _ in range(args.workers):
+            port = free_port()
+            servers.append(start_server(args.mode, port, db_uri, env))
+            urls.append(f'http://127.0.0.1:{port}')
+
+        results = {op: {'latencies': [], 'errors': 0} for op in ('login', 'friends', 'presence')}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + args.duration
+
+        def record(op, elapsed, ok):
+            with lock:
+                if ok:
+                    results[op]['latencies'].append(elapsed)
+                else:
+                    results[op]['errors'] += 1
+
+        def login_client(index):
+            session, rng = requests.Session(), random.Random(args.seed * 1000 + index)
+            while time.perf_counter() < deadline:
+                body = {'username': rng.choice(usernames), 'password': 'password'}
+                started = time.perf_counter()
+                try:
+                    ok = session.post(urls[index % len(urls)] + '/api/login', json=body, timeout=30).ok
+                except requests.RequestException:
+                    ok = False
+                record('login', time.perf_counter() - started, ok)
+
+        def friends_client(index):
+            session, rng = requests.Session(), random.Random(args.seed * 2000 + index)
+            while time.perf_counter() < deadline:
+                headers = {'Authorization': f'Bearer {rng.choice(tokens)}'}
+                started = time.perf_counter()
+                try:
+                    ok = session.get(urls[index % len(urls)] + '/api/friends', headers=headers, timeout=30).ok
+                except requests.RequestException:
+                    ok = False
+                record('friends', time.perf_counter() - started, ok)
+
+        def presence_client(index):
+            # 每个线程固定使用一个用户，避免同一用户的多个连接互相踢下线
+            token = tokens[index % len(tokens)]
+            while time.perf_counter() < deadline:
+                client = socketio.Client(reconnection=False)
+                online = threading.Event()
+                client.on('friends_presence_snapshot', lambda data: online.set())
+                started = time.perf_counter()
+                try:
+                    client.connect(urls[index % len(urls)], transports=['websocket'], auth={'token': token},
+                                   wait_timeout=30)
+                    client.emit('authenticate', {'port': 0})
+                    ok = online.wait(30)
+                except Exception:
+                    ok = False
+                finally:
+                    try:
+                        client.disconnect()
+                    except Exception:
+                        pass
+                record('presence', time.perf_counter() - started, ok)
+
+        threads = [threading.Thread(target=login_client, args=(i,)) for i in range(args.login_clients)]
+        threads += [threading.Thread(target=friends_client, args=(i,)) for i in range(args.friends_clients)]
+        threads += [threading.Thread(target=presence_client, args=(i,)) for i in range(args.presence_clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for server in servers:
+            stop_server(server)
+
+    return {
+        op: {
+            'operations_per_second': round(len(result['latencies']) / args.duration, 1),
+            'latency': percentiles(result['latencies']),
+            'errors': result['errors'],
+        }
+        for op, result in results.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mixed login + presence + friends-list database benchmark.')
+    parser.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), default=['legacy', 'production'],
+                        help='database profiles to compare')
+    parser.add_argument('--database-url', help='run against this (empty) database instead of a temporary SQLite file')
+    parser.add_argument('--users', type=int, default=2000, help='number of users')
+    parser.add_argument('--friends', type=int, default=20, help='friends per user (neighbours on a ring)')
+    parser.add_argument('--workers', type=int, default=2, help='server processes sharing the database')
+    parser.add_argument('--mode', default='gevent', help='SERVER_MODE of the servers under test')
+    parser.add_argument('--login-clients', type=int, default=4, help='threads logging in')
+    parser.add_argument('--friends-clients', type=int, default=8, help='threads fetching friend lists')
+    parser.add_argument('--presence-clients', type=int, default=8, help='threads going online and offline')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of mixed workload per profile')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+    if args.database_url and len(args.profiles) > 1:
+        parser.error('--database-url runs a single profile, pass --profiles production')
+
+    report = {'commit': git_commit(), 'workers': args.workers, 'mode': args.mode, 'profiles': {}}
+    for name in args.profiles:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            db_uri = args.database_url or 'sqlite:///' + os.path.join(tmpdir, 'profile.db')
+            report['profiles'][name] = run_profile(name, db_uri, args)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    write_report({'benchmark': 'db_profile', 'result': report}, args.output)
+
+
+if __name__ == '__main__':
+    main()
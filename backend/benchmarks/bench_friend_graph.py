@@ -0,0 +1,121 @@
+import argparse
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+from common import process_rss_mb, seed_users, write_report
+
+"""
+好友关系图缓存的内存占用与查询速度基准测试。
+
+    1. 在临时 SQLite 数据库中创建 --users 个用户，并随机生成 --edges 条 friendships 记录
+       （好友关系双向存储，每对好友计为两条边）；
+    2. 用 FriendGraph.warm() 一次性加载整张图，记录加载耗时、tracemalloc 统计的缓存大小、
+       每条边的平均字节数以及进程常驻内存的增量；
+    3. 随机执行 --lookups 次 is_friend，统计单次判断的平均耗时。
+
+用法（在 backend 目录下）:
+    python benchmarks/bench_friend_graph.py --users 10000 --edges 1000000
+"""
+
+
+def seed_friendships(db_uri, user_ids, edges, seed):
+    """随机生成 edges/2 对好友关系并成对写入 friendships 表。"""
+    from app import create_app, db
+    from app.models import friendships
+    from config import TestingConfig
+
+    class SeedConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = db_uri
+
+    rng = random.Random(seed)
+    pairs = set()
+    while len(pairs) * 2 < edges:
+        a, b = rng.sample(user_ids, 2)
+        pairs.add((min(a, b), max(a, b)))
+
+    app = create_app(SeedConfig)
+    with app.app_context():
+        rows = []
+        for a, b in pairs:
+            rows.append({'user_id': a, 'friend_id': b})
+            rows.append({'user_id': b, 'friend_id': a})
+        for start in range(0, len(rows), 50000):
+            db.session.execute(friendships.insert(), rows[start:start + 50000])
+        db.session.commit()
+    return sorted(pairs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Friend-graph cache memory footprint benchmark.')
+    parser.add_argument('--users', type=int, default=10000, help='number of users to create')
+    parser.add_argument('--edges', type=int, default=1000000,
+                        help='number of friendships rows (two per friendship)')
+    parser.add_argument('--lookups', type=int, default=1000000, help='number of is_friend calls to time')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    db_uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+    try:
+        user_ids = list(seed_users(db_uri, args.users).values())
+        pairs = seed_friendships(db_uri, user_ids, args.edges, args.seed)
+
+        from app import create_app, friend_graph
+        from config import TestingConfig
+
+        class BenchConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = db_uri
+
+        app = create_app(BenchConfig)
+        with app.app_context():
+            gc.collect()
+            rss_before = process_rss_mb(os.getpid())
+            started = time.perf_counter()
+            friend_graph.warm()
+            warm_seconds = time.perf_counter() - started
+            rss_after = process_rss_mb(os.getpid())
+
+            # tracemalloc 会显著拖慢加载，因此单独再加载一次来统计缓存本身的大小
+            friend_graph.clear()
+            gc.collect()
+            tracemalloc.start()
+            friend_graph.warm()
+            gc.collect()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            edges = friend_graph.edge_count()
+
+            rng = random.Random(args.seed)
+            probes = [rng.choice(pairs) if i % 2 else tuple(rng.sample(user_ids, 2))
+                      for i in range(min(args.lookups, 100000))]
+            started = time.perf_counter()
+            for i in range(args.lookups):
+                a, b = probes[i % len(probes)]
+                friend_graph.is_friend(a, b)
+            lookup_seconds = time.perf_counter() - started
+
+        write_report({
+            'benchmark': 'friend_graph',
+            'users': args.users,
+            'edges': edges,
+            'warm_seconds': round(warm_seconds, 3),
+            'cache_mb': round(current / 1024 / 1024, 1),
+            'cache_bytes_per_edge': round(current / edges, 1) if edges else None,
+            'warm_peak_mb': round(peak / 1024 / 1024, 1),
+            'rss_delta_mb': round(rss_after - rss_before, 1) if rss_before and rss_after else None,
+            'is_friend_ns': round(lookup_seconds / args.lookups * 1e9, 1),
+        }, args.output)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
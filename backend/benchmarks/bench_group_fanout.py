@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from common import (free_port, make_token, percentiles, process_rss_mb, seed_users,
+                    start_server, stop_server, write_report)
+import socketio
+
+"""
+群消息扇出 (fan-out) 基准测试。
+
+    1. 在临时数据库中创建 --members 个用户，并把他们全部加入同一个群；
+    2. 启动后端（默认 gevent 模式），所有成员建立连接并 authenticate（上线时加入群房间）；
+    3. 房间扇出：发送者发送 --rounds 条 'group_message'，每条只 emit 一次，由服务器按房间分发；
+    4. 逐个扇出（对照）：发送者对每个成员各发一条 'webrtc_signal'，相当于旧的逐个 emit 方式；
+    5. 对两种方式分别统计：单个成员的投递延迟分位数，以及一轮消息全部送达所有成员的耗时。
+
+用法（在 backend 目录下，需先安装 benchmarks/requirements.txt）:
+    python benchmarks/bench_group_fanout.py --members 500 --rounds 20
+"""
+
+
+def seed_group(db_uri, user_ids):
+    """创建一个包含所有用户的群，返回群ID。"""
+    from app import create_app, db
+    from app.models import ChatGroup, GroupMembership
+    from config import TestingConfig
+
+    class SeedConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = db_uri
+
+    app = create_app(SeedConfig)
+    with app.app_context():
+        group = ChatGroup(name='bench', creator_id=user_ids[0])
+        db.session.add(group)
+        db.session.flush()
+        db.session.execute(GroupMembership.__table__.insert(),
+                           [{'group_id': group.id, 'user_id': user_id} for user_id in user_ids])
+        db.session.commit()
+        return group.id
+
+
+async def connect_members(url, tokens, concurrency):
+    """让所有成员连接并上线，返回 (客户端列表, 到达时间队列)。"""
+    semaphore = asyncio.Semaphore(concurrency)
+    arrivals = asyncio.Queue()
+    clients = []
+
+    async def connect_one(token):
+        async with semaphore:
+            client = socketio.AsyncClient(reconnection=False)
+
+            @client.on('group_message')
+            async def on_group_message(data):
+                await arrivals.put((data['payload'], time.perf_counter()))
+
+            @client.on('webrtc_signal')
+            async def on_signal(data):
+                await arrivals.put((data['signal'], time.perf_counter()))
+
+            await client.connect(url, transports=['websocket'], auth={'token': token}, wait_timeout=30)
+            await client.emit('authenticate', {'port': 0})
+            clients.append(client)
+
+    await asyncio.gather(*(connect_one(token) for token in tokens))
+    await asyncio.sleep(1.0)
+    return clients, arrivals
+
+
+async def collect(arrivals, expected, sent_at, timeout=30):
+    """等待一轮消息的 expected 次投递，返回每次投递的延迟列表。"""
+    latencies = []
+    deadline = time.perf_counter() + timeout
+    while len(latencies) < expected and time.perf_counter() < deadline:
+        try:
+            tag, arrived = await asyncio.wait_for(arrivals.get(), timeout=deadline - time.perf_counter())
+        except asyncio.TimeoutError:
+            break
+        latencies.append(arrived - sent_at[tag])
+    return latencies
+
+
+async def run(args):
+    tmpdir = tempfile.mkdtemp()
+    db_uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+    ids = seed_users(db_uri, args.members + 1, rounds=4)
+    usernames = [f'user{i}' for i in range(args.members + 1)]
+    group_id = seed_group(db_uri, [ids[name] for name in usernames])
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    server = start_server(args.mode, port, db_uri)
+    try:
+        sender, *members = [make_token(ids[name]) for name in usernames]
+        clients, arrivals = await connect_members(url, members, args.concurrency)
+        sender_client = socketio.AsyncClient(reconnection=False)
+        await sender_client.connect(url, transports=['websocket'], auth={'token': sender})
+        await sender_client.emit('authenticate', {'port': 0})
+        await asyncio.sleep(0.5)
+
+        room = {'delivery': [], 'round': []}
+        for i in range(args.rounds):
+            tag = f'room-{i}'
+            sent_at = {tag: time.perf_counter()}
+            await sender_client.emit('group_message', {'group_id': group_id, 'payload': tag})
+            latencies = await collect(arrivals, len(clients), sent_at)
+            room['delivery'].extend(latencies)
+            if len(latencies) == len(clients):
+                room['round'].append(max(latencies))
+
+        per_member = {'delivery': [], 'round': []}
+        for i in range(args.rounds):
+            sent_at = {}
+            started = time.perf_counter()
+            for name in usernames[1:len(clients) + 1]:
+                tag = f'signal-{i}-{name}'
+                sent_at[tag] = started
+                await sender_client.emit('webrtc_signal', {'to': name, 'signal': tag})
+            latencies = await collect(arrivals, len(clients), sent_at)
+            per_member['delivery'].extend(latencies)
+            if len(latencies) == len(clients):
+                per_member['round'].append(max(latencies))
+
+        report = {
+            'mode': args.mode,
+            'members_online': len(clients),
+            'room_fanout': {'delivery_latency': percentiles(room['delivery']),
+                            'round_completion': percentiles(room['round'])},
+            'per_member_fanout': {'delivery_latency': percentiles(per_member['delivery']),
+                                  'round_completion': percentiles(per_member['round'])},
+            'server_rss_mb': process_rss_mb(server.pid),
+        }
+        await asyncio.gather(*(client.disconnect() for client in clients + [sender_client]),
+                             return_exceptions=True)
+        return report
+    finally:
+        stop_server(server)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Group message fan-out benchmark.')
+    parser.add_argument('--members', type=int, default=500, help='number of online group members')
+    parser.add_argument('--rounds', type=int, default=20, help='messages to send with each fan-out method')
+    parser.add_argument('--mode', default='gevent', help='SERVER_MODE of the server under test')
+    parser.add_argument('--concurrency', type=int, default=100, help='maximum connection attempts in flight')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+    write_report({'benchmark': 'group_fanout', 'result': asyncio.run(run(args))}, args.output)
+
+
+if __name__ == '__main__':
+    main()
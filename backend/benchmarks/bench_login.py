@@ -0,0 +1,109 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from common import free_port, percentiles, seed_users, start_server, stop_server, write_report
+import requests
+
+"""
+登录吞吐量基准测试（bcrypt 密码哈希进程池）。
+
+对每一个 PASSWORD_HASH_WORKERS 取值分别：
+    1. 启动一个使用临时数据库的后端进程（默认 gevent 模式）；
+    2. 用 --clients 个并发客户端在 --duration 秒内持续调用 /api/login；
+    3. 统计每秒成功登录数、登录延迟的分位数，以及因哈希任务已满而返回 503 的次数。
+
+进程数为 0 表示不使用进程池，在服务器进程内的线程池中计算哈希。
+种子用户的密码使用 --rounds 指定的工作因子，与服务器的 BCRYPT_ROUNDS 一致，测试过程中不会触发重新哈希。
+
+用法（在 backend 目录下，需先安装 benchmarks/requirements.txt）:
+    python benchmarks/bench_login.py --pool-sizes 0,1,2,4 --clients 32 --duration 10
+"""
+
+
+def run_clients(url, usernames, clients, duration):
+    """并发登录 duration 秒，返回 (成功延迟列表, 503次数, 其他错误次数)。"""
+    latencies, lock = [], threading.Lock()
+    counters = {'busy': 0, 'errors': 0}
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        session = requests.Session()
+        username = usernames[index % len(usernames)]
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = session.post(f'{url}/api/login',
+                                        json={'username': username, 'password': 'password'}, timeout=30)
+                status = response.status_code
+            except requests.RequestException:
+                status = None
+            elapsed = time.perf_counter() - started
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                elif status == 503:
+                    counters['busy'] += 1
+                else:
+                    counters['errors'] += 1
+            if status == 503:
+                # 与真实客户端一样遵守 Retry-After，避免空转
+                time.sleep(0.05)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, counters['busy'], counters['errors']
+
+
+def run_pool_size(pool_size, args):
+    tmpdir = tempfile.mkdtemp()
+    db_uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+    usernames = list(seed_users(db_uri, args.clients, rounds=args.rounds))
+    port = free_port()
+    server = start_server(args.mode, port, db_uri, {
+        'PASSWORD_HASH_WORKERS': str(pool_size),
+        'BCRYPT_ROUNDS': str(args.rounds),
+        'PASSWORD_HASH_MAX_PENDING': str(args.max_pending),
+    })
+    try:
+        latencies, busy, errors = run_clients(f'http://127.0.0.1:{port}', usernames,
+                                              args.clients, args.duration)
+        return {
+            'pool_size': pool_size,
+            'logins_per_second': round(len(latencies) / args.duration, 1),
+            'login_latency': percentiles(latencies),
+            'shed_503': busy,
+            'errors': errors,
+        }
+    finally:
+        stop_server(server)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Login throughput benchmark for the bcrypt worker pool.')
+    parser.add_argument('--pool-sizes', default='0,1,2,4',
+                        help='comma separated PASSWORD_HASH_WORKERS values to compare')
+    parser.add_argument('--mode', default='gevent', help='SERVER_MODE of the server under test')
+    parser.add_argument('--clients', type=int, default=32, help='number of concurrent login clients')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run each pool size')
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt work factor (BCRYPT_ROUNDS)')
+    parser.add_argument('--max-pending', type=int, default=64, help='PASSWORD_HASH_MAX_PENDING')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    results = [run_pool_size(int(size), args) for size in args.pool_sizes.split(',')]
+    write_report({'benchmark': 'login', 'cpu_count': os.cpu_count(), 'mode': args.mode,
+                  'rounds': args.rounds, 'clients': args.clients, 'results': results}, args.output)
+
+
+if __name__ == '__main__':
+    main()
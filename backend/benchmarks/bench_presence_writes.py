@@ -0,0 +1,104 @@
+import argparse
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from common import SECRET_KEY as BENCH_SECRET_KEY, make_token, percentiles, seed_ring_friendships, seed_users, \
+    write_report
+
+"""
+在线状态写入方式的基准测试：每次上线/下线同步提交，与延迟批量写入对比。
+
+    1. 在临时 SQLite 文件数据库中创建 --users 个用户，每个用户有 --friends 个好友（环形）；
+    2. 分别以 PRESENCE_FLUSH_INTERVAL=0（同步写入）和 --interval（延迟写入）创建应用；
+    3. 模拟重连风暴：所有用户依次进行 --cycles 轮 "连接 -> authenticate -> 断开"，
+       统计每轮上线+下线的处理耗时、总耗时，以及写 users 表的 UPDATE 语句数和提交次数；
+       延迟写入的耗时包含最后一次刷新。
+
+用法（在 backend 目录下）:
+    python benchmarks/bench_presence_writes.py --users 500 --cycles 5
+"""
+
+
+def run(db_uri, ids, interval, args):
+    from sqlalchemy import event
+    from app import create_app, db, socketio, presence_writer
+    from config import TestingConfig
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = db_uri
+        SECRET_KEY = BENCH_SECRET_KEY
+        PRESENCE_FLUSH_INTERVAL = interval
+
+    app = create_app(BenchConfig)
+    tokens = [make_token(user_id) for user_id in ids.values()]
+    counters = {'updates': 0, 'commits': 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE users'):
+            counters['updates'] += 1
+
+    def commit(conn):
+        counters['commits'] += 1
+
+    latencies = []
+    with app.app_context():
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'commit', commit)
+        # 事件处理器会为每次连接打印日志，这里丢弃，只输出报告
+        devnull = open(os.devnull, 'w')
+        try:
+            with contextlib.redirect_stdout(devnull):
+                started = time.perf_counter()
+                for _ in range(args.cycles):
+                    for token in tokens:
+                        client = socketio.test_client(app, auth={'token': token})
+                        cycle_started = time.perf_counter()
+                        client.emit('authenticate', {'port': 9000})
+                        client.disconnect()
+                        latencies.append(time.perf_counter() - cycle_started)
+                presence_writer.flush()
+                elapsed = time.perf_counter() - started
+        finally:
+            devnull.close()
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+            event.remove(engine, 'commit', commit)
+            db.session.remove()
+    return {
+        'flush_interval': interval,
+        'cycles': len(latencies),
+        'seconds_total': round(elapsed, 3),
+        'cycle_latency': percentiles(latencies),
+        'update_statements': counters['updates'],
+        'commits': counters['commits'],
+        'presence_rows_written': presence_writer.stats['rows_written'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synchronous vs write-behind presence updates.')
+    parser.add_argument('--users', type=int, default=500, help='number of users reconnecting')
+    parser.add_argument('--friends', type=int, default=10, help='friends per user (neighbours on a ring)')
+    parser.add_argument('--cycles', type=int, default=5, help='connect/authenticate/disconnect rounds per user')
+    parser.add_argument('--interval', type=float, default=0.2, help='PRESENCE_FLUSH_INTERVAL of the buffered run')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db_uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+        ids = seed_users(db_uri, args.users, rounds=4)
+        seed_ring_friendships(db_uri, [ids[f'user{i}'] for i in range(args.users)], args.friends)
+        report = {'synchronous': run(db_uri, ids, 0, args), 'write_behind': run(db_uri, ids, args.interval, args)}
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    write_report({'benchmark': 'presence_writes', 'result': report}, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+from common import write_report
+
+"""
+离线消息中转的写入吞吐量基准测试。
+
+在临时 SQLite 文件上分别测量:
+    1. 同步提交：每条消息一个事务（RELAY_FLUSH_INTERVAL=0 的写入方式）；
+    2. 批量提交：消息先进入缓冲区，再按 --batch 条一个事务写入（默认的写入方式）。
+报告每秒写入的消息数，以及批量模式下缓冲区占用的峰值内存（tracemalloc）。
+最后测量接收者上线时读取 --pending 条未确认消息的耗时。
+
+用法（在 backend 目录下）:
+    python benchmarks/bench_relay.py --messages 20000 --payload-bytes 256 --batch 1000
+"""
+
+
+def make_relay(path, batch, flush_interval):
+    from app.relay import MessageRelay, SQLiteRelayStore
+    relay = MessageRelay()
+    relay.store = SQLiteRelayStore(path)
+    relay.flush_batch = batch
+    relay.flush_interval = flush_interval
+    # 只测量存储，不启动后台任务，也不推送给在线用户
+    relay._flusher_started = True
+    relay._sweeper_started = True
+    relay._push = lambda ids, rows: None
+    return relay
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Store-and-forward relay write throughput benchmark.')
+    parser.add_argument('--messages', type=int, default=20000, help='messages to write in each mode')
+    parser.add_argument('--sync-messages', type=int, default=2000,
+                        help='messages to write with one transaction each (slower, so fewer)')
+    parser.add_argument('--payload-bytes', type=int, default=256, help='size of each ciphertext')
+    parser.add_argument('--recipients', type=int, default=100, help='number of distinct recipients')
+    parser.add_argument('--batch', type=int, default=1000, help='RELAY_FLUSH_BATCH')
+    parser.add_argument('--pending', type=int, default=500, help='messages to read back for one recipient')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    payload = 'x' * args.payload_bytes
+    tmpdir = tempfile.mkdtemp()
+    try:
+        relay = make_relay(os.path.join(tmpdir, 'sync.db'), args.batch, 0)
+        started = time.perf_counter()
+        for i in range(args.sync_messages):
+            relay.enqueue('alice', f'user{i % args.recipients}', payload)
+        sync_rate = args.sync_messages / (time.perf_counter() - started)
+
+        relay = make_relay(os.path.join(tmpdir, 'batched.db'), args.batch, 1.0)
+        tracemalloc.start()
+        started = time.perf_counter()
+        for i in range(args.messages):
+            relay.enqueue('alice', f'user{i % args.recipients}', payload)
+            if relay.buffered >= args.batch:
+                relay.flush()
+        relay.flush()
+        batched_rate = args.messages / (time.perf_counter() - started)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        relay.store.append_many([('reader', 'alice', payload, None, time.time(), time.time() + 3600)
+                                 for _ in range(args.pending)])
+        started = time.perf_counter()
+        rows = relay.store.pending('reader', 0, time.time(), args.pending)
+        read_ms = (time.perf_counter() - started) * 1000
+
+        write_report({
+            'benchmark': 'relay',
+            'payload_bytes': args.payload_bytes,
+            'batch': args.batch,
+            'sync_messages_per_second': round(sync_rate),
+            'batched_messages_per_second': round(batched_rate),
+            'batched_peak_memory_mb': round(peak / 1024 / 1024, 2),
+            'pending_read': {'count': len(rows), 'ms': round(read_ms, 2)},
+        }, args.output)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
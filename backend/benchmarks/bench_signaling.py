@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from common import (free_port, make_token, percentiles, process_rss_mb, seed_users,
+                    start_server, stop_server, write_report)
+import socketio
+
+"""
+WebRTC 信令合并基准测试。
+
+    1. 在临时数据库中创建 --pairs * 2 个用户，两两组成通话双方；
+    2. 分别以 SIGNAL_COALESCE_WINDOW=0（逐条转发）和 --window（合并）启动后端（默认 gevent 模式）；
+    3. 每一轮里所有发送者同时模拟一次通话建立：一条 offer，随后每隔 --spacing 秒发出一个 ICE 候选地址，
+       共 --candidates 个；
+    4. 统计接收方收到的事件数（即服务器的 emit 次数）、每个候选地址从发出到送达的延迟，
+       以及一轮信令全部送达的耗时。
+
+用法（在 backend 目录下，需先安装 benchmarks/requirements.txt）:
+    python benchmarks/bench_signaling.py --pairs 50 --candidates 30 --window 0.05
+"""
+
+
+async def run_once(url, pairs, args):
+    """建立连接并跑 --rounds 轮信令，返回本次的统计结果。"""
+    arrivals = asyncio.Queue()
+    counters = {'events': 0}
+    clients = []
+
+    async def connect(token):
+        client = socketio.AsyncClient(reconnection=False)
+
+        @client.on('webrtc_signal')
+        async def on_signal(data):
+            counters['events'] += 1
+            await arrivals.put((data['signal'], time.perf_counter()))
+
+        @client.on('webrtc_signal_batch')
+        async def on_batch(data):
+            counters['events'] += 1
+            arrived = time.perf_counter()
+            for signal in data['signals']:
+                await arrivals.put((signal, arrived))
+
+        await client.connect(url, transports=['websocket'], auth={'token': token}, wait_timeout=30)
+        await client.emit('authenticate', {'port': 0})
+        clients.append(client)
+        return client
+
+    senders = []
+    for sender_token, receiver_name, receiver_token in pairs:
+        await connect(receiver_token)
+        senders.append((await connect(sender_token), receiver_name))
+    await asyncio.sleep(0.5)
+
+    async def call(client, receiver_name, round_no, sent_at):
+        await client.emit('webrtc_signal', {'to': receiver_name, 'signal': {'type': 'offer', 'sdp': 'v=0'}})
+        for i in range(args.candidates):
+            tag = f'{receiver_name}-{round_no}-{i}'
+            sent_at[tag] = time.perf_counter()
+            await client.emit('webrtc_signal', {'to': receiver_name, 'signal': {
+                'type': 'candidate', 'candidate': {'candidate': tag, 'sdpMid': '0', 'sdpMLineIndex': 0}}})
+            await asyncio.sleep(args.spacing)
+
+    latencies, rounds = [], []
+    counters['events'] = 0
+    expected = len(senders) * (args.candidates + 1)
+    for round_no in range(args.rounds):
+        sent_at = {}
+        started = time.perf_counter()
+        await asyncio.gather(*(call(client, name, round_no, sent_at) for client, name in senders))
+        received, last = 0, started
+        deadline = time.perf_counter() + 30
+        while received < expected and time.perf_counter() < deadline:
+            try:
+                signal, arrived = await asyncio.wait_for(arrivals.get(), timeout=deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                break
+            received += 1
+            last = arrived
+            if signal.get('type') == 'candidate':
+                latencies.append(arrived - sent_at[signal['candidate']['candidate']])
+        if received == expected:
+            rounds.append(last - started)
+
+    result = {
+        'events_received': counters['events'],
+        'signals_sent': expected * args.rounds,
+        'candidate_latency': percentiles(latencies),
+        'round_completion': percentiles(rounds),
+    }
+    await asyncio.gather(*(client.disconnect() for client in clients), return_exceptions=True)
+    return result
+
+
+async def run(args):
+    tmpdir = tempfile.mkdtemp()
+    db_uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+    ids = seed_users(db_uri, args.pairs * 2, rounds=4)
+    pairs = [(make_token(ids[f'user{2 * i}']), f'user{2 * i + 1}', make_token(ids[f'user{2 * i + 1}']))
+             for i in range(args.pairs)]
+    report = {'mode': args.mode, 'pairs': args.pairs, 'candidates_per_call': args.candidates}
+    try:
+        for label, window in (('per_signal', 0), ('coalesced', args.window)):
+            port = free_port()
+            server = start_server(args.mode, port, db_uri, {'SIGNAL_COALESCE_WINDOW': str(window)})
+            try:
+                result = await run_once(f'http://127.0.0.1:{port}', pairs, args)
+                result['window'] = window
+                result['server_rss_mb'] = process_rss_mb(server.pid)
+                report[label] = result
+            finally:
+                stop_server(server)
+        return report
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WebRTC signal coalescing benchmark.')
+    parser.add_argument('--pairs', type=int, default=50, help='number of concurrent calls being set up')
+    parser.add_argument('--candidates', type=int, default=30, help='ICE candidates sent per call')
+    parser.add_argument('--spacing', type=float, default=0.005, help='seconds between two candidates')
+    parser.add_argument('--window', type=float, default=0.05, help='SIGNAL_COALESCE_WINDOW for the coalesced run')
+    parser.add_argument('--rounds', type=int, default=5, help='calls set up by every pair')
+    parser.add_argument('--mode', default='gevent', help='SERVER_MODE of the server under test')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+    write_report({'benchmark': 'signaling', 'result': asyncio.run(run(args))}, args.output)
+
+
+if __name__ == '__main__':
+    main()
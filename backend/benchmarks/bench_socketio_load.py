@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(__file__))
+from common import (free_port, git_commit, make_token, percentiles, process_rss_mb,
+                    seed_ring_friendships, seed_users, start_server, stop_server, write_report)
+import socketio
+
+"""
+Socket.IO 负载生成器：用成千上万个模拟客户端压测后端。
+
+    1. 在临时数据库中创建 --users 个用户，每个用户与环上相邻的 --friends 个用户互为好友；
+    2. 以 --mode 启动一个后端进程（只监听 127.0.0.1）；
+    3. 建连阶段: 所有客户端以最多 --concurrency 个并发连接并 authenticate，
+       建连耗时按“开始连接 -> 收到 friends_presence_snapshot”计算；
+    4. 信令风暴: 在 --duration 秒内，每个客户端以每秒 --rate 条的速度向随机一个好友发送 webrtc_signal
+       （--signal-type 为 offer 时立即转发，为 candidate 时会经过服务器的合并窗口），
+       统计每条信令的端到端延迟、客户端发送/接收速率，以及通过 /metrics 得到的服务器 emit 速率；
+    5. 重连波次: 共 --waves 波，每波断开 --wave-fraction 比例的客户端后立即重新连接并上线，
+       统计重连耗时和所有客户端收到的好友状态通知数（含下线和上线通知）；
+    6. 记录各阶段服务器进程的常驻内存，以 JSON 输出全部结果（含当前 git 提交），便于不同版本之间对比。
+
+用法（在 backend 目录下，需先安装 benchmarks/requirements.txt）:
+    python benchmarks/bench_socketio_load.py --users 2000 --rate 1 --duration 30 --output load.json
+
+注意：大量连接需要提高文件描述符上限，例如 `ulimit -n 65535`；所有客户端运行在同一个进程的事件循环中，
+客户端自身也会占用 CPU，机器核数较少时延迟中包含了负载生成器的排队时间。
+"""
+
+
+def scrape_emits(url):
+    """从 /metrics 读取服务器累计的 emit 次数；指标未开启时返回 None。"""
+    try:
+        with urllib.request.urlopen(f'{url}/metrics', timeout=5) as response:
+            text = response.read().decode('utf-8')
+    except OSError:
+        return None
+    return sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+               if line.startswith('easychat_socketio_emits_total{'))
+
+
+class SimulatedClient:
+    """一个模拟用户：负责连接、上线，并记录收到的信令延迟和好友状态通知。"""
+
+    def __init__(self, stats, username, token, friends):
+        self.stats = stats
+        self.username = username
+        self.token = token
+        self.friends = friends
+        self.client = None
+        self.ready = None
+
+    async def connect(self, url):
+        """连接并上线，返回建连耗时（秒）；失败时返回 None。"""
+        self.ready = asyncio.Event()
+        self.client = client = socketio.AsyncClient(reconnection=False)
+        stats = self.stats
+
+        @client.on('friends_presence_snapshot')
+        async def on_snapshot(data):
+            self.ready.set()
+
+        @client.on('friend_status_update')
+        async def on_status(data):
+            stats['status_updates'] += 1
+
+        @client.on('webrtc_signal')
+        async def on_signal(data):
+            stats['latencies'].append(time.perf_counter() - data['signal']['sent'])
+
+        @client.on('webrtc_signal_batch')
+        async def on_batch(data):
+            arrived = time.perf_counter()
+            stats['latencies'].extend(arrived - signal['sent'] for signal in data['signals'])
+
+        start = time.perf_counter()
+        try:
+            await client.connect(url, transports=['websocket'], auth={'token': self.token}, wait_timeout=30)
+            await client.emit('authenticate', {'port': 0})
+            await asyncio.wait_for(self.ready.wait(), timeout=30)
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    async def disconnect(self):
+        if self.client is not None:
+            try:
+                await self.client.disconnect()
+            except Exception:
+                pass
+
+    async def storm(self, rate, duration, signal_type, rng):
+        """在 duration 秒内以每秒 rate 条的速度向随机好友发送信令，返回发送条数。"""
+        if not self.friends or rate <= 0:
+            return 0
+        interval = 1.0 / rate
+        await asyncio.sleep(rng.random() * interval)
+        deadline = time.perf_counter() + duration
+        sent = 0
+        while time.perf_counter() < deadline:
+            now = time.perf_counter()
+            signal = {'type': 'offer', 'sdp': 'v=0', 'sent': now} if signal_type == 'offer' else \
+                {'type': 'candidate', 'candidate': {'sdpMid': '0', 'sdpMLineIndex': 0}, 'sent': now}
+            try:
+                await self.client.emit('webrtc_signal', {'to': rng.choice(self.friends), 'signal': signal})
+            except Exception:
+                break
+            sent += 1
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - now)))
+        return sent
+
+
+async def connect_all(clients, url, concurrency):
+    """以最多 concurrency 个并发让 clients 连接并上线，返回 (建连耗时列表, 失败数)。"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def connect_one(sim):
+        async with semaphore:
+            return await sim.connect(url)
+
+    results = await asyncio.gather(*(connect_one(sim) for sim in clients))
+    durations = [duration for duration in results if duration is not None]
+    return durations, len(results) - len(durations)
+
+
+async def run(args):
+    tmpdir = tempfile.mkdtemp()
+    db_uri = 'sqlite:///' + os.path.join(tmpdir, 'load.db')
+    ids = seed_users(db_uri, args.users, rounds=4)
+    usernames = [f'user{i}' for i in range(args.users)]
+    neighbours = seed_ring_friendships(db_uri, [ids[name] for name in usernames], args.friends)
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    server = start_server(args.mode, port, db_uri, {'METRICS_ENABLED': 'true'})
+    rng = random.Random(args.seed)
+    stats = {'latencies': [], 'status_updates': 0}
+    clients = [SimulatedClient(stats, name, make_token(ids[name]), [usernames[j] for j in neighbours[i]])
+               for i, name in enumerate(usernames)]
+    report = {
+        'commit': git_commit(),
+        'mode': args.mode,
+        'users': args.users,
+        'friends_per_user': args.friends,
+        'server_rss_mb_idle': process_rss_mb(server.pid),
+    }
+    try:
+        started = time.perf_counter()
+        connect_times, failures = await connect_all(clients, url, args.concurrency)
+        report['connect'] = {
+            'connected': len(connect_times),
+            'failures': failures,
+            'seconds_total': round(time.perf_counter() - started, 3),
+            'setup_latency': percentiles(connect_times),
+        }
+        report['server_rss_mb_connected'] = process_rss_mb(server.pid)
+
+        online = [sim for sim in clients if sim.ready is not None and sim.ready.is_set()]
+        stats['latencies'].clear()
+        emits_before = scrape_emits(url)
+        started = time.perf_counter()
+        sent = await asyncio.gather(*(sim.storm(args.rate, args.duration, args.signal_type, rng)
+                                      for sim in online))
+        send_seconds = time.perf_counter() - started
+        await asyncio.sleep(args.drain)
+        emits_after = scrape_emits(url)
+        report['signal_storm'] = {
+            'signal_type': args.signal_type,
+            'clients': len(online),
+            'signals_sent': sum(sent),
+            'signals_received': len(stats['latencies']),
+            'client_sends_per_second': round(sum(sent) / send_seconds, 1),
+            'server_emits_per_second': round((emits_after - emits_before) / send_seconds, 1)
+            if emits_before is not None and emits_after is not None else None,
+            'event_latency': percentiles(stats['latencies']),
+        }
+        report['server_rss_mb_storm'] = process_rss_mb(server.pid)
+
+        waves = []
+        for wave in range(args.waves):
+            batch = rng.sample(online, max(1, int(len(online) * args.wave_fraction)))
+            stats['status_updates'] = 0
+            await asyncio.gather(*(sim.disconnect() for sim in batch))
+            await asyncio.sleep(args.wave_pause)
+            started = time.perf_counter()
+            reconnect_times, failures = await connect_all(batch, url, args.concurrency)
+            await asyncio.sleep(args.wave_pause)
+            waves.append({
+                'wave': wave + 1,
+                'clients': len(batch),
+                'reconnected': len(reconnect_times),
+                'failures': failures,
+                'seconds_total': round(time.perf_counter() - started - args.wave_pause, 3),
+                'setup_latency': percentiles(reconnect_times),
+                'friend_status_updates': stats['status_updates'],
+            })
+        report['reconnect_waves'] = waves
+        report['server_rss_mb_final'] = process_rss_mb(server.pid)
+
+        await asyncio.gather(*(sim.disconnect() for sim in clients))
+        return report
+    finally:
+        stop_server(server)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Socket.IO load generator with simulated clients.')
+    parser.add_argument('--users', type=int, default=1000, help='number of simulated clients')
+    parser.add_argument('--friends', type=int, default=10, help='friends per user (neighbours on a ring)')
+    parser.add_argument('--mode', default='gevent', help='SERVER_MODE of the server under test')
+    parser.add_argument('--concurrency', type=int, default=200, help='maximum connection attempts in flight')
+    parser.add_argument('--rate', type=float, default=1.0, help='signals per second sent by every client')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of signal storm')
+    parser.add_argument('--signal-type', choices=('offer', 'candidate'), default='offer',
+                        help='offers are forwarded at once, candidates go through the coalescing window')
+    parser.add_argument('--drain', type=float, default=2.0, help='seconds to wait for in-flight signals')
+    parser.add_argument('--waves', type=int, default=3, help='number of reconnect waves')
+    parser.add_argument('--wave-fraction', type=float, default=0.2, help='share of clients in each wave')
+    parser.add_argument('--wave-pause', type=float, default=1.0,
+                        help='seconds between disconnecting and reconnecting, and after reconnecting')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for targets and waves')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+    write_report({'benchmark': 'socketio_load', 'result': asyncio.run(run(args))}, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone
+import bcrypt
+import jwt
+
+"""
+基准测试脚本共用的工具函数：准备临时数据库、启动/停止后端进程、生成令牌、统计分位数等。
+所有基准测试都只在本机 (127.0.0.1) 上运行。
+"""
+
+backend_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+SECRET_KEY = 'benchmark-secret-key-not-for-production'
+
+
+def free_port():
+    """向操作系统申请一个当前空闲的本地端口。"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_token(user_id, hours=24):
+    return jwt.encode(
+        {'user_id': user_id, 'exp': datetime.now(timezone.utc) + timedelta(hours=hours)},
+        SECRET_KEY, algorithm='HS256'
+    )
+
+
+def seed_users(db_uri, count, password='password', prefix='user', rounds=12):
+    """
+    在给定数据库中创建表并批量插入 count 个用户，用户名为 <prefix>0 ... <prefix>{count-1}。
+    所有用户共用同一个密码哈希（工作因子为 rounds），避免为每个用户都计算一次 bcrypt。
+    返回 {username: user_id}。
+    """
+    from app import create_app, db
+    from config import TestingConfig
+
+    class SeedConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = db_uri
+
+    app = create_app(SeedConfig)
+    with app.app_context():
+        from app.models import User
+        db.create_all()
+        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'{prefix}{i}', 'email': f'{prefix}{i}@example.com',
+             'password_hash': password_hash, 'is_online': False, 'is_admin': False}
+            for i in range(count)
+        ])
+        db.session.commit()
+        return dict(db.session.query(User.username, User.id).all())
+
+
+def seed_ring_friendships(db_uri, user_ids, friends):
+    """让每个用户与环上之后的 friends/2 个用户（向上取整）互为好友，好友关系双向存储。"""
+    from app import create_app, db
+    from app.models import friendships
+    from config import TestingConfig
+
+    class SeedConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = db_uri
+
+    pairs = set()
+    count = len(user_ids)
+    for i in range(count):
+        for step in range(1, (friends + 1) // 2 + 1):
+            j = (i + step) % count
+            if i != j:
+                pairs.add((min(i, j), max(i, j)))
+
+    app = create_app(SeedConfig)
+    with app.app_context():
+        rows = []
+        for a, b in pairs:
+            rows.append({'user_id': user_ids[a], 'friend_id': user_ids[b]})
+            rows.append({'user_id': user_ids[b], 'friend_id': user_ids[a]})
+        for start in range(0, len(rows), 50000):
+            db.session.execute(friendships.insert(), rows[start:start + 50000])
+        db.session.commit()
+    neighbours = {i: set() for i in range(count)}
+    for a, b in pairs:
+        neighbours[a].add(b)
+        neighbours[b].add(a)
+    return {i: sorted(others) for i, others in neighbours.items()}
+
+
+def start_server(mode, port, db_uri, extra_env=None):
+    """以指定的 SERVER_MODE 启动一个后端进程，等待其可以响应请求后返回 Popen 对象。"""
+    env = dict(os.environ)
+    env.update({
+        'SERVER_MODE': mode,
+        'SERVER_PORT': str(port),
+        'SERVER_HOST': '127.0.0.1',
+        'SERVER_DEBUG': '0',
+        'DATABASE_URL': db_uri,
+        'SECRET_KEY': SECRET_KEY,
+    })
+    env.update(extra_env or {})
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(backend_dir, 'run.py')],
+        cwd=backend_dir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'server in mode {mode!r} exited with code {proc.returncode}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/ping', timeout=1)
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'server in mode {mode!r} did not start')
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def process_rss_mb(pid):
+    """读取进程的常驻内存 (RSS)，单位 MB；非 Linux 平台返回 None。"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def git_commit():
+    """当前 git 提交的短哈希，写入报告便于区分版本；不在 git 仓库中时返回 None。"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=backend_dir,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentiles(values):
+    """计算一组耗时（秒）的 p50/p95/p99/max，结果以毫秒表示。"""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def write_report(report, output=None):
+    """把结果以 JSON 打印到标准输出，并在指定时写入文件，便于不同版本之间对比。"""
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
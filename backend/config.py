@@ -25,10 +25,144 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
         
+    # 数据库连接池（见 app/database.py）。SQLite 文件数据库和 PostgreSQL 都使用这些参数：
+    # 常驻连接数、高峰时允许额外打开的连接数、等待空闲连接的超时（秒）。
+    # SQLite 文件数据库的 DB_POOL_SIZE 设为 0 时不复用连接，每次都新建连接。
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 20)
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT') or 30)
+    # 仅用于 PostgreSQL 等服务器数据库：连接使用多久（秒）后回收重建，以及取出连接时是否先 ping 一次
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)
+    DB_POOL_PRE_PING = (os.environ.get('DB_POOL_PRE_PING') or '1') == '1'
+    # 仅用于 SQLite 文件数据库，在每个连接上设置：WAL 日志模式、同步级别、
+    # 内存映射大小（字节）、每个连接的页缓存大小（KiB），以及等待写锁的超时（秒）。
+    SQLITE_WAL = (os.environ.get('SQLITE_WAL') or '1') == '1'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB') or 64 * 1024)
+    SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5)
+
+    # 只读副本（见 app/replicas.py）：逗号分隔的数据库URL，与主库是同一类数据库。未设置时所有查询都使用主库。
+    DATABASE_REPLICA_URLS = [url.strip() for url in (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',')
+                             if url.strip()]
+    # 用户写入后的这段时间（秒）内，其只读请求仍使用主库，应大于副本的复制延迟
+    DB_READ_YOUR_WRITES_WINDOW = float(os.environ.get('DB_READ_YOUR_WRITES_WINDOW') or 5)
+
     # 如果设置为True，Flask-SQLAlchemy会追踪对象的修改并发送信号。
     # 这会占用额外的内存，因此除非特别需要，否则建议关闭。
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # 在线状态注册表的后端类型。
+    # 'memory' 为进程内字典，仅适用于单进程部署；
+    # 'sqlite' 为多个 worker 进程共享的 SQLite 文件，多进程部署时必须使用。
+    PRESENCE_BACKEND = os.environ.get('PRESENCE_BACKEND') or 'memory'
+    # 'sqlite' 后端使用的数据库文件路径
+    PRESENCE_DB_PATH = os.environ.get('PRESENCE_DB_PATH') or \
+        os.path.join(basedir, 'presence.db')
+    # 'sqlite' 后端中每个 worker 刷新心跳的间隔（秒），以及心跳超时的时间（秒）。
+    # 心跳超时的 worker（例如崩溃或被 SIGKILL 结束）登记的用户不再被视为在线，其记录会被其他 worker 清除。
+    PRESENCE_HEARTBEAT_INTERVAL = float(os.environ.get('PRESENCE_HEARTBEAT_INTERVAL') or 5)
+    PRESENCE_WORKER_TTL = float(os.environ.get('PRESENCE_WORKER_TTL') or 30)
+    # 上线/下线时 users 表中 is_online、ip_address、port 的批量写入间隔（秒，见 app/presence_writer.py），0 表示同步写入
+    PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL') or 0.2)
+    # 进程退出时是否把尚未写入的在线状态写入数据库；关闭后直接丢弃，退出更快，但数据库中的在线标记可能过期
+    PRESENCE_FLUSH_ON_SHUTDOWN = (os.environ.get('PRESENCE_FLUSH_ON_SHUTDOWN') or '1') == '1'
+    # 启动时是否把数据库中标记为在线、但不在在线状态注册表中的用户改为离线（见 app/lifecycle.py）
+    PRESENCE_RECONCILE_ON_STARTUP = (os.environ.get('PRESENCE_RECONCILE_ON_STARTUP') or '1') == '1'
+    # 收到 SIGTERM 后等待正在处理的 Socket.IO 事件完成的最长时间（秒），之后批量下线本进程的用户再退出
+    SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get('SHUTDOWN_DRAIN_TIMEOUT') or 10)
+
+    # 已验证身份缓存的容量（条目数）和有效期（秒）。
+    # 有效期同时也是多 worker 部署时，用户资料修改在其他进程中生效的最长延迟。
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE') or 10000)
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL') or 60)
+
+    # bcrypt 的工作因子。调高后，已有用户会在下次成功登录时自动升级为新的工作因子。
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS') or 12)
+    # 密码哈希进程池的进程数，默认等于CPU核心数；设为 0 时不使用进程池，在当前进程的线程池中计算。
+    # 集群模式下 run_cluster.py 会把CPU核心平均分给各个 worker。
+    PASSWORD_HASH_WORKERS = int(os.environ['PASSWORD_HASH_WORKERS']) \
+        if os.environ.get('PASSWORD_HASH_WORKERS') else None
+    # 允许同时排队和计算的哈希任务数，超出时注册/登录/修改密码接口返回 503
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING') or 64)
+
+    # 管理员导出用户表时每批读取的行数
+    ADMIN_EXPORT_BATCH_SIZE = int(os.environ.get('ADMIN_EXPORT_BATCH_SIZE') or 1000)
+
+    # 头像存储后端（见 app/avatar_storage.py），目前只有 'local'。
+    # 'local' 的保存目录默认为 app/static，与旧版本上传的头像在同一位置。
+    AVATAR_STORAGE = os.environ.get('AVATAR_STORAGE') or 'local'
+    AVATAR_STORAGE_PATH = os.environ.get('AVATAR_STORAGE_PATH')
+    # 内存中热点头像缓存的容量（字节）
+    AVATAR_CACHE_BYTES = int(os.environ.get('AVATAR_CACHE_BYTES') or 32 * 1024 * 1024)
+    # 由前端代理发送头像文件：'X-Accel-Redirect' (nginx) 或 'X-Sendfile' (Apache/lighttpd)，为空时由应用自己发送。
+    # X-Accel-Redirect 的值为 AVATAR_OFFLOAD_PREFIX + 文件名，nginx 中需要配置对应的 internal location。
+    AVATAR_OFFLOAD_HEADER = os.environ.get('AVATAR_OFFLOAD_HEADER')
+    AVATAR_OFFLOAD_PREFIX = os.environ.get('AVATAR_OFFLOAD_PREFIX') or '/protected/'
+
+    # 离线消息中转（见 app/relay.py）：共享的 SQLite 文件路径、消息保留时间（秒），
+    # 批量提交的间隔（秒，为 0 时每条消息同步提交）和每批最多的消息数，
+    # 进程内缓冲区的容量（字节，满时发送方收到 busy 错误）和单条密文的最大长度，
+    # 上线时每个 'relay_messages' 事件包含的消息数，以及清理已确认/已过期消息的间隔（秒，为 0 时不在后台清理）。
+    RELAY_DB_PATH = os.environ.get('RELAY_DB_PATH') or os.path.join(basedir, 'relay.db')
+    RELAY_MESSAGE_TTL = int(os.environ.get('RELAY_MESSAGE_TTL') or 7 * 24 * 3600)
+    RELAY_FLUSH_INTERVAL = float(os.environ.get('RELAY_FLUSH_INTERVAL') or 0.05)
+    RELAY_FLUSH_BATCH = int(os.environ.get('RELAY_FLUSH_BATCH') or 1000)
+    RELAY_MAX_BUFFER_BYTES = int(os.environ.get('RELAY_MAX_BUFFER_BYTES') or 16 * 1024 * 1024)
+    RELAY_MAX_PAYLOAD = int(os.environ.get('RELAY_MAX_PAYLOAD') or 64 * 1024)
+    RELAY_DELIVERY_BATCH = int(os.environ.get('RELAY_DELIVERY_BATCH') or 500)
+    RELAY_SWEEP_INTERVAL = float(os.environ.get('RELAY_SWEEP_INTERVAL') or 60)
+
+    # WebRTC 信令合并（见 app/signaling.py）：合并 ICE 候选地址的时间窗口（秒，默认 0 即逐条转发；
+    # 合并后的 'webrtc_signal_batch' 事件需要客户端支持，所有客户端升级后再设置为 0.05 左右），
+    # 每批最多的候选地址数，以及单条信令序列化后的最大字节数（超过的信令会被丢弃）。
+    SIGNAL_COALESCE_WINDOW = float(os.environ.get('SIGNAL_COALESCE_WINDOW') or 0)
+    SIGNAL_MAX_BATCH = int(os.environ.get('SIGNAL_MAX_BATCH') or 50)
+    SIGNAL_MAX_PAYLOAD = int(os.environ.get('SIGNAL_MAX_PAYLOAD') or 16 * 1024)
+
+    # 是否收集运行指标并在 /metrics 上导出（Prometheus 文本格式，见 app/metrics.py），默认关闭。
+    # 设置 METRICS_TOKEN 后抓取时必须带 'Authorization: Bearer <METRICS_TOKEN>'；
+    # 未设置时 /metrics 不需要认证，只能在仅监控系统可访问的内网中开启。
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or 'false').lower() in ('1', 'true', 'yes')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # 每个群最多的成员数（含群主）
+    GROUP_MAX_MEMBERS = int(os.environ.get('GROUP_MAX_MEMBERS') or 500)
+
+    # 好友关系图缓存：worker 启动时是否预先加载整张图（否则按用户懒加载），
+    # 读取其他 worker 变更记录的间隔（秒），以及整体清空重建的间隔（秒）。
+    # 变更记录的保留时间必须大于清空间隔，否则长时间空闲的 worker 可能错过已被清理的记录。
+    # 每次同步还会重新扫描最近 FRIEND_GRAPH_SYNC_OVERLAP 秒内写入的记录，以免漏掉较晚提交、ID 较小的变更；
+    # 它应大于最长的写事务时间与各 worker 之间的时钟偏差之和。
+    FRIEND_GRAPH_PRELOAD = (os.environ.get('FRIEND_GRAPH_PRELOAD') or '0') == '1'
+    FRIEND_GRAPH_SYNC_INTERVAL = float(os.environ.get('FRIEND_GRAPH_SYNC_INTERVAL') or 1.0)
+    FRIEND_GRAPH_REFRESH_INTERVAL = float(os.environ.get('FRIEND_GRAPH_REFRESH_INTERVAL') or 600)
+    FRIEND_GRAPH_CHANGE_RETENTION = float(os.environ.get('FRIEND_GRAPH_CHANGE_RETENTION') or 3600)
+    FRIEND_GRAPH_SYNC_OVERLAP = float(os.environ.get('FRIEND_GRAPH_SYNC_OVERLAP') or 30)
+
+    # --- 集群模式 ---
+    # Socket.IO 消息队列的URL。为空时以单进程模式运行；
+    # 多 worker 部署时所有进程必须配置同一个队列，例如：
+    #   redis://localhost:6379/0          (需要安装 redis 客户端)
+    #   sqlite:////path/to/socketio.db    (同一台机器上的多进程，无需中间件)
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    # 消息队列中使用的频道名，同一个队列上运行多个独立集群时需要区分
+    SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL') or 'easychat'
+
+    # 服务器运行模式：
+    #   'dev'     - Werkzeug 多线程开发服务器，每个连接占用一个线程，只适合开发调试；
+    #   'gevent'  - gevent 协程服务器（需安装 requirements-prod.txt），单进程可保持数万个空闲 WebSocket 连接；
+    #   'eventlet'- eventlet 协程服务器，作用同上。
+    SERVER_MODE = os.environ.get('SERVER_MODE') or 'dev'
+
+    # run.py 启动服务器时使用的监听地址、端口以及是否开启调试模式（自动重载，仅 'dev' 模式有效）。
+    # 集群中的 worker 由 run_cluster.py 启动，会关闭调试模式并分配各自的端口。
+    SERVER_HOST = os.environ.get('SERVER_HOST') or '0.0.0.0'
+    SERVER_PORT = int(os.environ.get('SERVER_PORT') or 5000)
+    SERVER_DEBUG = (os.environ.get('SERVER_DEBUG') or '1') == '1'
+    # 协程服务器允许同时处理的最大连接数（eventlet 默认只有 1024）
+    SERVER_MAX_CONNECTIONS = int(os.environ.get('SERVER_MAX_CONNECTIONS') or 50000)
+
 class TestingConfig(Config):
     """
     专用于测试环境的配置类。
@@ -41,6 +175,24 @@ class TestingConfig(Config):
     # 在测试中，使用内存中的SQLite数据库。
     # 这比使用文件数据库快得多，且测试结束后数据会自动清除。
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    DATABASE_REPLICA_URLS = []
+
+    # 测试中使用最低的工作因子，并在线程中直接计算，避免启动进程池
+    BCRYPT_ROUNDS = 4
+    PASSWORD_HASH_WORKERS = 0
+
+    # 测试中始终使用进程内的在线状态注册表，避免在磁盘上留下文件。
+    PRESENCE_BACKEND = 'memory'
+    # 在线状态同步写入数据库，便于断言
+    PRESENCE_FLUSH_INTERVAL = 0
+
+    # 中转消息保存在内存数据库中（进程内的连接共享同一个数据库），同步提交且不在后台清理，便于断言
+    RELAY_DB_PATH = ':memory:'
+    RELAY_FLUSH_INTERVAL = 0
+    RELAY_SWEEP_INTERVAL = 0
+
+    # 测试中导出运行指标
+    METRICS_ENABLED = True
     
     # 在测试环境中通常会禁用CSRF保护，以简化对表单提交的测试。
     WTF_CSRF_ENABLED = False
\ No newline at end of file
@@ -1,28 +1,106 @@
-from app import create_app, socketio
+from config import Config
+
+# 协程服务器要求在导入任何其他模块（尤其是 socket、threading）之前完成猴子补丁，
+# 这样标准库中的阻塞调用才会被替换为可让出控制权的协程版本。
+if Config.SERVER_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif Config.SERVER_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+if Config.SERVER_MODE != 'dev':
+    # 使用 PostgreSQL 时，让 psycopg2 的网络等待也能让出事件循环
+    try:
+        if Config.SERVER_MODE == 'eventlet':
+            from psycogreen.eventlet import patch_psycopg
+        else:
+            from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        # 未安装 psycogreen（例如使用 SQLite）时跳过
+        pass
+
+import signal
+from app import create_app, socketio, friend_graph, lifecycle
 from app import models  # 确保在应用启动时能识别到数据库模型
 
 # 通过应用工厂模式创建Flask应用实例
 # create_app()函数会负责初始化所有必要的扩展和API蓝图
 app = create_app()
 
-# 当该脚本被直接执行时，启动开发服务器
+
+def _drain_and_stop():
+    lifecycle.shutdown()
+    socketio.stop()
+
+
+def _graceful_shutdown(signum, frame):
+    """
+    收到 SIGTERM 时优雅关闭：拒绝新连接，排空正在处理的事件，批量下线本进程的用户后再停止服务器。
+    协程服务器在后台任务中执行，不阻塞事件循环；开发服务器的其他线程仍在运行，直接在主线程中执行。
+    """
+    if lifecycle.draining:
+        return
+    lifecycle.draining = True
+    if app.config['SERVER_MODE'] == 'dev':
+        lifecycle.shutdown()
+        raise KeyboardInterrupt
+    socketio.start_background_task(_drain_and_stop)
+
+
+# 当该脚本被直接执行时，启动服务器
 if __name__ == '__main__':
     """
     应用的主入口点。
-    
+
     使用 Flask-SocketIO 提供的 run 方法来启动服务器，
     这样可以同时支持标准的HTTP请求和WebSocket连接。
-    
-    - host='0.0.0.0' 让服务器监听在所有可用的网络接口上，
+
+    监听地址、端口和调试模式均来自配置（见 config.py 中的 SERVER_* 配置项）：
+    - SERVER_HOST 默认为 '0.0.0.0'，让服务器监听在所有可用的网络接口上，
       使得局域网内的其他设备也可以访问。
-    - port=5000 是服务监听的端口号。
-    - debug=True 开启调试模式，当代码有变动时服务器会自动重启，
-      并在出错时提供详细的错误页面。
+    - SERVER_PORT 默认为 5000，是服务监听的端口号。
+    - SERVER_DEBUG 默认开启调试模式，当代码有变动时服务器会自动重启，
+      并在出错时提供详细的错误页面。以集群模式运行时由 run_cluster.py 关闭。
+    - SERVER_MODE 为 'dev' 时使用 Werkzeug 多线程开发服务器；
+      为 'eventlet' 或 'gevent' 时使用对应的协程服务器，且总是关闭调试模式。
+    收到 SIGTERM 时先优雅关闭（见 app/lifecycle.py）再退出。
     """
-    socketio.run(
-        app,
-        host='0.0.0.0',  
-        port=5000,       
-        debug=True,
-        allow_unsafe_werkzeug=True
-    )
\ No newline at end of file
+    # 以下启动步骤只在启动服务器时执行：flask db upgrade、shell 等命令同样会导入本模块，
+    # 此时数据表可能尚未创建，也不能重置正在运行的服务器上的在线用户或加载整张好友关系图。
+
+    # 上次进程崩溃或被强制结束时，数据库中会残留 "在线" 的用户，启动时统一改为离线
+    if app.config['PRESENCE_RECONCILE_ON_STARTUP']:
+        with app.app_context():
+            reconciled = lifecycle.reconcile()
+        if reconciled:
+            print(f'[启动] 已将 {reconciled} 个残留的在线用户标记为离线。')
+    # 需要时在启动阶段一次性加载整张好友关系图，避免上线高峰期的逐个懒加载
+    if app.config['FRIEND_GRAPH_PRELOAD']:
+        with app.app_context():
+            friend_graph.warm()
+    signal.signal(signal.SIGTERM, _graceful_shutdown)
+    if app.config['SERVER_MODE'] == 'dev':
+        socketio.run(
+            app,
+            host=app.config['SERVER_HOST'],
+            port=app.config['SERVER_PORT'],
+            debug=app.config['SERVER_DEBUG'],
+            allow_unsafe_werkzeug=True
+        )
+    else:
+        # 限制同时处理的连接数（eventlet.wsgi 默认只有 1024）
+        if app.config['SERVER_MODE'] == 'eventlet':
+            server_options = {'max_size': app.config['SERVER_MAX_CONNECTIONS']}
+        else:
+            from gevent.pool import Pool
+            server_options = {'spawn': Pool(app.config['SERVER_MAX_CONNECTIONS'])}
+        socketio.run(
+            app,
+            host=app.config['SERVER_HOST'],
+            port=app.config['SERVER_PORT'],
+            debug=False,
+            log_output=False,
+            **server_options
+        )
@@ -0,0 +1,149 @@
+import argparse
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+
+"""
+集群启动器：在同一台机器上启动 N 个后端 worker 进程。
+
+每个 worker 都是一个独立的 `run.py` 进程，监听各自的端口，并共享：
+    - 同一个业务数据库（DATABASE_URL）；
+    - 同一个在线状态注册表（PRESENCE_BACKEND=sqlite）；
+    - 同一个 Socket.IO 消息队列（SOCKETIO_MESSAGE_QUEUE），用于跨进程转发 emit / disconnect。
+
+Socket.IO 的 HTTP 长轮询传输要求同一个客户端的所有请求落在同一个 worker 上，
+因此 worker 前面需要一个支持粘性会话(sticky session)的反向代理，例如 nginx 的 ip_hash：
+
+    upstream easychat {
+        ip_hash;
+        server 127.0.0.1:5001;
+        server 127.0.0.1:5002;
+    }
+    server {
+        listen 5000;
+        location / {
+            proxy_pass http://easychat;
+            proxy_http_version 1.1;
+            proxy_set_header Upgrade $http_upgrade;
+            proxy_set_header Connection "upgrade";
+            proxy_set_header Host $host;
+        }
+    }
+
+启动后本脚本会打印与实际端口对应的 upstream 配置。
+启动 worker 之前会清空共享的在线状态注册表（其中只可能有上次异常退出时残留的记录），
+之后每个 worker 在启动时把数据库中残留的在线标记改为离线；停止时各 worker 先优雅关闭再退出。
+
+用法:
+    python run_cluster.py --workers 4 --base-port 5001
+"""
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+
+def worker_env(port, queue_url, presence_path, hash_workers=None):
+    """构造单个 worker 进程的环境变量。"""
+    env = dict(os.environ)
+    if hash_workers is not None:
+        # 各 worker 平分CPU核心用于密码哈希，避免进程数远超核心数
+        env.setdefault('PASSWORD_HASH_WORKERS', str(hash_workers))
+    env['SERVER_PORT'] = str(port)
+    # 调试模式下的自动重载会额外派生子进程，集群中必须关闭
+    env['SERVER_DEBUG'] = '0'
+    env['PRESENCE_BACKEND'] = 'sqlite'
+    env.setdefault('PRESENCE_DB_PATH', presence_path)
+    env.setdefault('SOCKETIO_MESSAGE_QUEUE', queue_url)
+    return env
+
+
+def clear_presence_registry(path):
+    """清空共享的在线状态注册表。只能在没有 worker 运行时调用。"""
+    if not os.path.exists(path):
+        return
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.execute('DELETE FROM presence')
+    except sqlite3.OperationalError:
+        # 注册表尚未建表
+        pass
+    finally:
+        conn.close()
+
+
+def start_workers(count, base_port, queue_url, presence_path):
+    """启动 count 个 worker，返回 (端口, 进程) 列表。"""
+    workers = []
+    hash_workers = max(1, (os.cpu_count() or 1) // count)
+    for i in range(count):
+        port = base_port + i
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(basedir, 'run.py')],
+            cwd=basedir,
+            env=worker_env(port, queue_url, presence_path, hash_workers)
+        )
+        workers.append((port, proc))
+    return workers
+
+
+def stop_workers(workers, timeout=None):
+    """
+    先发送 SIGTERM 让 worker 优雅关闭，超时后再强制结束。
+    默认的超时在 worker 排空连接的时间（SHUTDOWN_DRAIN_TIMEOUT）之外再留出 10 秒。
+    """
+    if timeout is None:
+        timeout = float(os.environ.get('SHUTDOWN_DRAIN_TIMEOUT') or 10) + 10
+    for _, proc in workers:
+        if proc.poll() is None:
+            proc.terminate()
+    deadline = time.time() + timeout
+    for _, proc in workers:
+        try:
+            proc.wait(max(0, deadline - time.time()))
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Start several EasyChat backend workers.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('--base-port', type=int, default=5001,
+                        help='port of the first worker; others use consecutive ports')
+    parser.add_argument('--queue', default='sqlite:///' + os.path.join(basedir, 'socketio-queue.db'),
+                        help='Socket.IO message queue URL shared by all workers')
+    parser.add_argument('--presence-db', default=os.path.join(basedir, 'presence.db'),
+                        help='shared presence registry file')
+    args = parser.parse_args()
+
+    clear_presence_registry(args.presence_db)
+    workers = start_workers(args.workers, args.base_port, args.queue, args.presence_db)
+    print('Started workers on ports: ' + ', '.join(str(port) for port, _ in workers))
+    print('Sticky-session upstream for the front proxy:')
+    print('    upstream easychat {\n        ip_hash;')
+    for port, _ in workers:
+        print(f'        server 127.0.0.1:{port};')
+    print('    }')
+
+    # 收到 SIGTERM 时与 Ctrl+C 一样进入清理流程
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    try:
+        # 任意一个 worker 意外退出时，整个集群一起退出，交由外部的进程管理器重启
+        while all(proc.poll() is None for _, proc in workers):
+            time.sleep(1)
+        print('A worker exited unexpectedly, shutting down the cluster.')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_workers(workers)
+
+
+if __name__ == '__main__':
+    main()
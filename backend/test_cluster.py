@@ -0,0 +1,130 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+import jwt
+from app import create_app, db
+from app.models import User
+from config import TestingConfig
+from run_cluster import start_workers, stop_workers
+
+try:
+    import socketio
+    import requests  # noqa: F401  socketio.Client 的 HTTP 传输依赖
+    HAS_CLIENT = True
+except ImportError:
+    HAS_CLIENT = False
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/ping', timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'worker on port {port} did not start')
+
+
+# 集群模式的多进程测试：两个 worker 通过共享的 SQLite 消息队列互相转发事件
+@unittest.skipUnless(HAS_CLIENT, 'python-socketio client dependencies are not installed')
+class ClusterCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        db_uri = 'sqlite:///' + os.path.join(self.tmpdir, 'app.db')
+
+        # 在共享数据库中创建两个互为好友的用户
+        class ClusterConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = db_uri
+        app = create_app(ClusterConfig)
+        with app.app_context():
+            db.create_all()
+            alice = User(username='alice', email='alice@example.com')
+            bob = User(username='bob', email='bob@example.com')
+            alice.set_password('a')
+            bob.set_password('b')
+            db.session.add_all([alice, bob])
+            db.session.commit()
+            alice.add_friend(bob)
+            db.session.commit()
+            self.tokens = {u.username: self.make_token(app, u.id) for u in (alice, bob)}
+
+        env = {
+            'DATABASE_URL': db_uri,
+            'SECRET_KEY': app.config['SECRET_KEY'],
+            # 中转消息文件同样由两个 worker 共享，放在临时目录中，不在源码目录留下状态
+            'RELAY_DB_PATH': os.path.join(self.tmpdir, 'relay.db'),
+        }
+        self.ports = [free_port(), free_port()]
+        with patch.dict(os.environ, env):
+            self.workers = [
+                start_workers(1, port,
+                              'sqlite:///' + os.path.join(self.tmpdir, 'queue.db'),
+                              os.path.join(self.tmpdir, 'presence.db'))[0]
+                for port in self.ports
+            ]
+        for port in self.ports:
+            wait_until_up(port)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.disconnect()
+        stop_workers(self.workers)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    @staticmethod
+    def make_token(app, user_id):
+        return jwt.encode(
+            {'user_id': user_id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+            app.config['SECRET_KEY'], algorithm='HS256'
+        )
+
+    def connect(self, username, port):
+        client = socketio.Client()
+        self.clients.append(client)
+        client.connect(f'http://127.0.0.1:{port}', auth={'token': self.tokens[username]})
+        client.emit('authenticate', {'token': self.tokens[username], 'port': port})
+        return client
+
+    def test_signal_crosses_workers(self):
+        """测试 worker A 上发出的信令能够到达连接在 worker B 上的客户端"""
+        received = threading.Event()
+        payloads = []
+
+        bob = self.connect('bob', self.ports[1])
+
+        @bob.on('webrtc_signal')
+        def on_signal(data):
+            payloads.append(data)
+            received.set()
+
+        alice = self.connect('alice', self.ports[0])
+        # 等待双方的认证在各自 worker 上完成
+        time.sleep(1)
+        alice.emit('webrtc_signal', {
+            'to': 'bob',
+            'signal': {'type': 'offer', 'sdp': 'v=0'},
+            'token': self.tokens['alice']
+        })
+
+        self.assertTrue(received.wait(10), 'signal did not reach the client on the other worker')
+        self.assertEqual(payloads[0]['from'], 'alice')
+        self.assertEqual(payloads[0]['signal']['type'], 'offer')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
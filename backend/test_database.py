@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy.pool import QueuePool, StaticPool
+from app import create_app, db
+from app.database import engine_options
+from config import TestingConfig
+
+
+# 数据库引擎配置相关测试用例
+class DatabaseProfileCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def make_app(self, **overrides):
+        class FileConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(self.tmpdir, 'app.db')
+        for key, value in overrides.items():
+            setattr(FileConfig, key, value)
+        return create_app(FileConfig)
+
+    def test_sqlite_file_uses_wal_and_pooled_connections(self):
+        """测试 SQLite 文件数据库使用连接池，并在每个连接上开启 WAL 和其他 PRAGMA"""
+        app = self.make_app(SQLITE_MMAP_SIZE=1024 * 1024, SQLITE_CACHE_SIZE_KB=2048)
+        with app.app_context():
+            self.assertIsInstance(db.engine.pool, QueuePool)
+            db.create_all()
+            connection = db.session.connection()
+            pragma = lambda name: connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+            self.assertEqual(pragma('journal_mode'), 'wal')
+            self.assertEqual(pragma('synchronous'), 1)  # NORMAL
+            self.assertEqual(pragma('mmap_size'), 1024 * 1024)
+            self.assertEqual(pragma('cache_size'), -2048)
+            db.session.remove()
+
+    def test_wal_can_be_turned_off(self):
+        """测试关闭 SQLITE_WAL 后保持 SQLite 默认的回滚日志模式"""
+        app = self.make_app(SQLITE_WAL=False)
+        with app.app_context():
+            self.assertEqual(db.session.connection().exec_driver_sql('PRAGMA journal_mode').scalar(), 'delete')
+            db.session.remove()
+
+    def test_server_database_pool_options(self):
+        """测试 PostgreSQL 使用显式的连接池参数，显式配置的引擎参数优先，内存数据库保持默认"""
+        config = {key: getattr(TestingConfig, key) for key in dir(TestingConfig) if key.isupper()}
+        config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://easychat@localhost/easychat'
+        config['DB_POOL_SIZE'] = 15
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_recycle': 60}
+        self.assertEqual(engine_options(config), {
+            'pool_size': 15,
+            'max_overflow': TestingConfig.DB_MAX_OVERFLOW,
+            'pool_timeout': TestingConfig.DB_POOL_TIMEOUT,
+            'pool_recycle': 60,
+            'pool_pre_ping': True,
+        })
+
+        app = create_app(TestingConfig)
+        with app.app_context():
+            self.assertIsInstance(db.engine.pool, StaticPool)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,128 @@
+import unittest
+from app import create_app, db, friend_graph
+from app.friend_graph import FriendGraph
+from app.models import User, FriendGraphChange, friendships
+from config import TestingConfig
+from test_user_api import count_queries
+
+
+class FriendGraphConfig(TestingConfig):
+    # 测试中不主动读取变更日志，便于断言本进程内的增量维护不产生查询
+    FRIEND_GRAPH_SYNC_INTERVAL = 3600
+
+
+# 好友关系图缓存相关测试用例
+class FriendGraphCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(FriendGraphConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.users = [User(username=f'user{i}', email=f'user{i}@example.com', password_hash='x')
+                      for i in range(4)]
+        db.session.add_all(self.users)
+        db.session.commit()
+        self.alice, self.bob, self.carol, self.dave = self.users
+        self.ids = [user.id for user in self.users]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_is_friend_served_from_cache(self):
+        """测试加载后好友判断不再查询数据库，且提交后增量更新"""
+        self.alice.add_friend(self.bob)
+        db.session.commit()
+        # 首次访问时按用户从数据库加载
+        self.assertTrue(self.alice.is_friend(self.bob))
+        self.assertTrue(self.bob.is_friend(self.alice))
+
+        with count_queries() as statements:
+            for _ in range(100):
+                self.assertTrue(self.alice.is_friend(self.bob))
+                self.assertTrue(self.bob.is_friend(self.alice))
+                self.assertFalse(self.alice.is_friend(self.carol))
+        self.assertEqual([s for s in statements if 'friendships' in s], [])
+
+        self.alice.remove_friend(self.bob)
+        db.session.commit()
+        self.assertFalse(self.alice.is_friend(self.bob))
+        self.assertFalse(self.bob.is_friend(self.alice))
+        self.assertEqual(friend_graph.friend_ids(self.alice.id), frozenset())
+
+    def test_rollback_discards_pending_changes(self):
+        """测试事务回滚后缓存中不会出现未提交的好友关系"""
+        self.assertFalse(self.alice.is_friend(self.carol))
+        self.alice.add_friend(self.carol)
+        db.session.rollback()
+        self.assertFalse(self.alice.is_friend(self.carol))
+        self.assertEqual(FriendGraphChange.query.count(), 0)
+
+    def test_other_worker_sees_change(self):
+        """测试另一个进程中的缓存通过变更日志失效"""
+        other = FriendGraph()
+        other.sync_interval = 0
+        self.assertEqual(other.friend_ids(self.alice.id), frozenset())
+
+        self.alice.add_friend(self.dave)
+        db.session.commit()
+        self.assertEqual(other.friend_ids(self.alice.id), {self.dave.id})
+        self.assertEqual(other.friend_ids(self.dave.id), {self.alice.id})
+
+        self.alice.remove_friend(self.dave)
+        db.session.commit()
+        self.assertEqual(other.friend_ids(self.alice.id), frozenset())
+
+    def test_late_commit_below_cursor_is_not_skipped(self):
+        """测试较早分配ID、较晚提交的变更记录不会因为游标已越过它而被跳过"""
+        other = FriendGraph()
+        other.sync_interval = 0
+        self.assertEqual(other.friend_ids(self.alice.id), frozenset())
+
+        # 较晚开始的事务先提交（ID 10），游标越过了尚未提交的 ID 1、2
+        db.session.add(FriendGraphChange(id=10, user_id=self.carol.id))
+        db.session.commit()
+        self.assertEqual(other.friend_ids(self.alice.id), frozenset())
+        self.assertEqual(other._last_change_id, 10)
+
+        alice_id, _, _, dave_id = self.ids
+        db.session.execute(friendships.insert(), [{'user_id': alice_id, 'friend_id': dave_id},
+                                                  {'user_id': dave_id, 'friend_id': alice_id}])
+        db.session.add_all([FriendGraphChange(id=1, user_id=alice_id), FriendGraphChange(id=2, user_id=dave_id)])
+        db.session.commit()
+        self.assertEqual(other.friend_ids(alice_id), {dave_id})
+
+        # 已处理过的记录不会重复加载
+        with count_queries() as statements:
+            other.friend_ids(alice_id)
+        self.assertEqual([s for s in statements if 'friendships' in s], [])
+
+        # 写入时间早于重叠窗口的记录不再扫描
+        other.sync_overlap = 0
+        other.friend_ids(alice_id)
+        self.assertEqual(other._seen_changes, {})
+
+    def test_warm_and_user_removal(self):
+        """测试一次性加载整张图，以及删除用户后从好友的邻接表中移除"""
+        self.alice.add_friend(self.bob)
+        self.alice.add_friend(self.carol)
+        db.session.commit()
+
+        friend_graph.clear()
+        friend_graph.warm()
+        self.assertEqual(friend_graph.edge_count(), 4)
+        alice_id, bob_id, carol_id, dave_id = self.ids
+        with count_queries() as statements:
+            self.assertEqual(friend_graph.friend_ids(alice_id), {bob_id, carol_id})
+            self.assertEqual(friend_graph.friend_ids(dave_id), frozenset())
+        self.assertEqual(statements, [])
+
+        friend_graph.record_user_removed(self.bob.id)
+        db.session.delete(self.bob)
+        db.session.commit()
+        self.assertEqual(friend_graph.friend_ids(self.alice.id), {self.carol.id})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,141 @@
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+import jwt
+from app import create_app, db, socketio
+from app.models import User, ChatGroup, GroupMembership
+from config import TestingConfig
+from test_user_api import count_queries
+
+
+# 群聊相关测试用例
+class GroupsCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        users = [User(username=name, email=f'{name}@example.com', password_hash='x')
+                 for name in ('alice', 'bob', 'carol', 'dave', 'eve')]
+        db.session.add_all(users)
+        db.session.commit()
+        alice = users[0]
+        for friend in users[1:4]:
+            alice.add_friend(friend)
+        db.session.commit()
+        self.ids = {user.username: user.id for user in users}
+        self.tokens = {name: jwt.encode({'user_id': user_id,
+                                         'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                                        self.app.config['SECRET_KEY'], algorithm='HS256')
+                       for name, user_id in self.ids.items()}
+        self.sockets = []
+
+    def tearDown(self):
+        for client in self.sockets:
+            if client.is_connected():
+                client.disconnect()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def api(self, method, url, username, body=None):
+        return self.client.open(url, method=method, data=json.dumps(body) if body is not None else None,
+                                content_type='application/json',
+                                headers={'Authorization': f'Bearer {self.tokens[username]}'})
+
+    def online(self, username):
+        client = socketio.test_client(self.app, auth={'token': self.tokens[username]})
+        self.sockets.append(client)
+        client.emit('authenticate', {'port': 9000})
+        client.get_received()
+        return client
+
+    @staticmethod
+    def events(client, name):
+        return [packet['args'][0] for packet in client.get_received() if packet['name'] == name]
+
+    def test_create_and_list_groups(self):
+        """测试创建群（只能拉好友入群）和按成员身份列出群"""
+        response = self.api('POST', '/api/groups', 'alice', {'name': 'team', 'members': ['bob', 'eve']})
+        self.assertEqual(response.status_code, 400)
+        # 类型不对的请求体返回 400 而不是 500
+        for body in ({'name': 123}, {'name': ['team']}, {'name': 'team', 'members': 'bob'},
+                     {'name': 'team', 'members': [['bob']]}, {'name': 'team', 'members': [{'u': 1}]}, ['team']):
+            self.assertEqual(self.api('POST', '/api/groups', 'alice', body).status_code, 400, body)
+        response = self.api('POST', '/api/groups', 'alice', {'name': 'team', 'members': ['bob', 'carol']})
+        self.assertEqual(response.status_code, 201)
+        group_id = response.get_json()['id']
+        self.assertEqual(response.get_json()['member_count'], 3)
+        self.api('POST', '/api/groups', 'alice', {'name': 'solo'})
+
+        self.assertEqual([(g['name'], g['member_count']) for g in self.api('GET', '/api/groups', 'alice').get_json()],
+                         [('team', 3), ('solo', 1)])
+        self.assertEqual([g['id'] for g in self.api('GET', '/api/groups', 'bob').get_json()], [group_id])
+        self.assertEqual(self.api('GET', '/api/groups', 'eve').get_json(), [])
+
+        members = self.api('GET', f'/api/groups/{group_id}/members', 'bob').get_json()
+        self.assertEqual([m['username'] for m in members], ['alice', 'bob', 'carol'])
+        self.assertEqual(self.api('GET', f'/api/groups/{group_id}/members', 'eve').status_code, 404)
+
+        # 上线时查询用户的群走 (user_id, group_id) 索引
+        plan = db.session.connection().exec_driver_sql(
+            'EXPLAIN QUERY PLAN SELECT group_id FROM group_members WHERE user_id = ?', (1,)).fetchall()
+        self.assertIn('ix_group_members_user_group', ' '.join(row[-1] for row in plan))
+
+    def test_group_message_fans_out_once(self):
+        """测试群消息通过群房间一次发给其他在线成员，非成员不能发送也收不到"""
+        group_id = self.api('POST', '/api/groups', 'alice',
+                            {'name': 'team', 'members': ['bob', 'carol']}).get_json()['id']
+        alice, bob, carol, eve = (self.online(name) for name in ('alice', 'bob', 'carol', 'eve'))
+
+        with count_queries() as statements:
+            ack = alice.emit('group_message', {'group_id': group_id, 'payload': 'hi all', 'client_id': 'm1'},
+                             callback=True)
+        self.assertEqual(ack, {'status': 'sent'})
+        self.assertEqual(statements, [])
+        for client in (bob, carol):
+            messages = self.events(client, 'group_message')
+            self.assertEqual(len(messages), 1)
+            self.assertEqual((messages[0]['from'], messages[0]['payload']), ('alice', 'hi all'))
+        self.assertEqual(self.events(alice, 'group_message'), [])
+        self.assertEqual(self.events(eve, 'group_message'), [])
+
+        self.assertEqual(eve.emit('group_message', {'group_id': group_id, 'payload': 'x'}, callback=True),
+                         {'status': 'error', 'error': 'not_member'})
+
+    def test_membership_changes_update_rooms(self):
+        """测试成员加入和移出时增量更新在线连接的房间，群解散时关闭房间"""
+        group_id = self.api('POST', '/api/groups', 'alice', {'name': 'team', 'members': ['bob']}).get_json()['id']
+        alice, bob, dave = (self.online(name) for name in ('alice', 'bob', 'dave'))
+
+        self.assertEqual(self.api('POST', f'/api/groups/{group_id}/members', 'bob',
+                                  {'username': 'dave'}).status_code, 400)  # dave 不是 bob 的好友
+        self.assertEqual(self.api('POST', f'/api/groups/{group_id}/members', 'alice',
+                                  {'username': 'dave'}).status_code, 201)
+        self.assertEqual(self.events(dave, 'group_joined'), [{'group_id': group_id, 'name': 'team'}])
+        self.assertEqual(self.events(bob, 'group_member_update'),
+                         [{'group_id': group_id, 'username': 'dave', 'joined': True}])
+        alice.emit('group_message', {'group_id': group_id, 'payload': 'welcome'})
+        self.assertEqual([m['payload'] for m in self.events(dave, 'group_message')], ['welcome'])
+        self.assertEqual(dave.emit('sync_groups', callback=True), {'group_ids': [group_id]})
+
+        self.assertEqual(self.api('DELETE', f'/api/groups/{group_id}/members/dave', 'bob').status_code, 403)
+        self.assertEqual(self.api('DELETE', f'/api/groups/{group_id}/members/alice', 'alice').status_code, 400)
+        self.assertEqual(self.api('DELETE', f'/api/groups/{group_id}/members/bob', 'bob').status_code, 200)
+        self.assertEqual(self.events(bob, 'group_left'), [{'group_id': group_id}])
+        alice.emit('group_message', {'group_id': group_id, 'payload': 'bye'})
+        self.assertEqual(self.events(bob, 'group_message'), [])
+        self.assertEqual([m['payload'] for m in self.events(dave, 'group_message')], ['bye'])
+
+        self.assertEqual(self.api('DELETE', f'/api/groups/{group_id}', 'dave').status_code, 403)
+        self.assertEqual(self.api('DELETE', f'/api/groups/{group_id}', 'alice').status_code, 200)
+        self.assertEqual(self.events(dave, 'group_deleted'), [{'group_id': group_id}])
+        self.assertEqual(alice.emit('group_message', {'group_id': group_id, 'payload': 'x'}, callback=True),
+                         {'status': 'error', 'error': 'not_member'})
+        self.assertEqual(GroupMembership.query.count(), 0)
+        self.assertEqual(ChatGroup.query.count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
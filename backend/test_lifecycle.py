@@ -0,0 +1,106 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+import jwt
+from app import create_app, db, socketio, presence, lifecycle
+from app.models import User
+from config import TestingConfig
+from test_user_api import count_queries
+
+
+# 启动对账与优雅关闭相关测试用例
+class LifecycleCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.users = {}
+        for name in ('alice', 'bob', 'carol', 'dave'):
+            self.users[name] = User(username=name, email=f'{name}@example.com', password_hash='x')
+        db.session.add_all(self.users.values())
+        db.session.commit()
+        # dave 是 alice 和 bob 的好友；carol 只是 alice 的好友
+        self.users['alice'].add_friend(self.users['dave'])
+        self.users['bob'].add_friend(self.users['dave'])
+        self.users['alice'].add_friend(self.users['carol'])
+        db.session.commit()
+        self.ids = {name: user.id for name, user in self.users.items()}
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            if client.is_connected():
+                client.disconnect()
+        presence.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def connect(self, username):
+        token = jwt.encode({'user_id': self.ids[username], 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                           self.app.config['SECRET_KEY'], algorithm='HS256')
+        client = socketio.test_client(self.app, auth={'token': token})
+        self.clients.append(client)
+        return client
+
+    def stored(self, username):
+        db.session.expire_all()
+        user = User.query.get(self.ids[username])
+        return user.is_online, user.ip_address, user.port
+
+    def test_reconcile_keeps_users_in_registry(self):
+        """测试启动对账重置残留的在线标记，注册表中（其他 worker 上）的在线用户保持不变"""
+        User.query.filter(User.username.in_(['alice', 'bob', 'carol'])).update(
+            {'is_online': True, 'ip_address': '10.0.0.1', 'port': 9000}, synchronize_session=False)
+        db.session.commit()
+        presence.register('bob', 'sid-on-another-worker')
+
+        with count_queries() as statements:
+            self.assertEqual(lifecycle.reconcile(), 2)
+        self.assertEqual(len([s for s in statements if s.startswith('UPDATE users')]), 1)
+        self.assertEqual(self.stored('alice'), (False, None, None))
+        self.assertEqual(self.stored('carol'), (False, None, None))
+        self.assertEqual(self.stored('bob'), (True, '10.0.0.1', 9000))
+
+    def test_reconcile_batches_stale_rows_when_registry_is_large(self):
+        """测试注册表不为空时按ID分批更新，语句中的参数个数与在线用户数无关"""
+        User.query.update({'is_online': True}, synchronize_session=False)
+        db.session.commit()
+        presence.register('dave', 'sid-on-another-worker')
+
+        with patch('app.lifecycle._CHUNK_SIZE', 2), count_queries() as statements:
+            self.assertEqual(lifecycle.reconcile(), 3)
+        self.assertEqual(len([s for s in statements if s.startswith('UPDATE users')]), 2)
+        self.assertEqual([self.stored(name)[0] for name in ('alice', 'bob', 'carol', 'dave')],
+                         [False, False, False, True])
+
+        # 注册表为空时一条 UPDATE 重置所有在线标记
+        presence.clear()
+        with count_queries() as statements:
+            self.assertEqual(lifecycle.reconcile(), 1)
+        self.assertEqual(len([s for s in statements if s.startswith('UPDATE users')]), 1)
+        self.assertFalse([s for s in statements if s.startswith('SELECT')])
+
+    def test_shutdown_releases_local_users_in_one_batch(self):
+        """测试优雅关闭时一次写入所有下线用户，每个在线好友只收到一条通知，并拒绝新的连接"""
+        for name in ('alice', 'bob'):
+            self.connect(name).emit('authenticate', {'ip_address': '10.0.0.1', 'port': 9000})
+        self.assertEqual(self.stored('alice'), (True, '10.0.0.1', 9000))
+        # dave 连接在另一个 worker 上
+        presence.register('dave', 'sid-on-another-worker')
+
+        with patch.object(socketio, 'emit') as emit, count_queries() as statements:
+            self.assertEqual(lifecycle.shutdown(), 2)
+        self.assertEqual(len([s for s in statements if s.startswith('UPDATE users')]), 1)
+        emit.assert_called_once_with('friends_offline', {'usernames': ['alice', 'bob']}, to='dave')
+        self.assertEqual(self.stored('alice'), (False, None, None))
+        self.assertEqual(self.stored('bob'), (False, None, None))
+        self.assertEqual(presence.usernames(), ['dave'])
+        self.assertEqual(lifecycle.in_flight, 0)
+
+        self.assertFalse(self.connect('carol').is_connected())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
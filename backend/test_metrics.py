@@ -0,0 +1,122 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+import jwt
+from app import create_app, db, socketio, metrics
+from app.metrics import Histogram, MetricsRegistry
+from app.models import User
+from config import TestingConfig
+
+
+def parse_metrics(text):
+    """把 Prometheus 文本格式解析为 {'名称{标签}': 值}。"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+# 运行指标相关测试用例
+class MetricsCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        alice = User(username='alice', email='alice@example.com', password_hash='x')
+        bob = User(username='bob', email='bob@example.com', password_hash='x')
+        db.session.add_all([alice, bob])
+        db.session.commit()
+        alice.add_friend(bob)
+        db.session.commit()
+        self.tokens = {user.username: jwt.encode({'user_id': user.id,
+                                                  'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                                                 self.app.config['SECRET_KEY'], algorithm='HS256')
+                       for user in (alice, bob)}
+        self.sockets = []
+
+    def tearDown(self):
+        for client in self.sockets:
+            if client.is_connected():
+                client.disconnect()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        return parse_metrics(response.get_data(as_text=True))
+
+    def test_histogram_buckets_are_cumulative(self):
+        """测试直方图按 le 计数并导出累计桶、总和与次数"""
+        registry = MetricsRegistry()
+        family = registry.histogram('latency_seconds', 'Latency.', 'route', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            family.labels('a"b').observe(value)
+        samples = parse_metrics(registry.render())
+        self.assertEqual(samples['latency_seconds_bucket{route="a\\"b",le="0.1"}'], 2)
+        self.assertEqual(samples['latency_seconds_bucket{route="a\\"b",le="1.0"}'], 3)
+        self.assertEqual(samples['latency_seconds_bucket{route="a\\"b",le="+Inf"}'], 4)
+        self.assertEqual(samples['latency_seconds_count{route="a\\"b"}'], 4)
+        self.assertAlmostEqual(samples['latency_seconds_sum{route="a\\"b"}'], 3.65)
+        self.assertIs(family.labels('a"b'), family.labels('a"b'))
+        self.assertIsInstance(family.labels('a"b'), Histogram)
+
+    def test_routes_events_and_gauges_are_exported(self):
+        """测试 /metrics 导出 API 路由耗时、Socket.IO 事件耗时、emit 次数和在线状态仪表"""
+        before = self.scrape()
+        count = 'easychat_http_request_duration_seconds_count{endpoint="api.get_friends"}'
+        auth = 'easychat_socketio_event_duration_seconds_count{event="authenticate"}'
+        signal = 'easychat_socketio_event_duration_seconds_count{event="webrtc_signal"}'
+        emitted = 'easychat_socketio_emits_total{event="webrtc_signal"}'
+
+        for _ in range(3):
+            self.client.get('/api/friends', headers={'Authorization': f'Bearer {self.tokens["alice"]}'})
+        self.client.get('/')
+        for name in ('alice', 'bob'):
+            client = socketio.test_client(self.app, auth={'token': self.tokens[name]})
+            self.sockets.append(client)
+            client.emit('authenticate', {'port': 9000})
+        self.sockets[0].emit('webrtc_signal', {'to': 'bob', 'signal': {'type': 'offer', 'sdp': 'v=0'}})
+
+        after = self.scrape()
+        self.assertEqual(after[count] - before.get(count, 0), 3)
+        self.assertEqual(after[auth] - before.get(auth, 0), 2)
+        self.assertEqual(after[signal] - before.get(signal, 0), 1)
+        self.assertEqual(after[emitted] - before.get(emitted, 0), 1)
+        self.assertFalse(any('endpoint="index"' in name or 'endpoint="metrics"' in name for name in after))
+        self.assertEqual(after['easychat_online_users'], 2)
+        self.assertEqual(after['easychat_socketio_open_sids'], 2)
+        self.assertEqual(after['easychat_password_hash_pending'], 0)
+
+    def test_metrics_can_be_disabled(self):
+        """测试关闭指标后不再注册 /metrics 路由"""
+        class NoMetricsConfig(TestingConfig):
+            METRICS_ENABLED = False
+
+        app = create_app(NoMetricsConfig)
+        self.assertEqual(app.test_client().get('/metrics').status_code, 404)
+        metrics.enabled = True
+
+    def test_metrics_token_is_required_when_set(self):
+        """测试设置 METRICS_TOKEN 后只有带正确 Bearer 令牌的抓取请求才能读取指标"""
+        class TokenMetricsConfig(TestingConfig):
+            METRICS_TOKEN = 'scrape-secret'
+
+        client = create_app(TokenMetricsConfig).test_client()
+        self.assertEqual(client.get('/metrics').status_code, 401)
+        self.assertEqual(client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 401)
+        self.assertEqual(client.get('/metrics', headers={'Authorization': f'Bearer {self.tokens["alice"]}'}).status_code,
+                         401)
+        response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('easychat_online_users', parse_metrics(response.get_data(as_text=True)))
+        metrics.token = None
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
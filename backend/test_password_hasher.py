@@ -0,0 +1,87 @@
+import json
+import unittest
+from app import create_app, db, password_hasher
+from app.models import User
+from app.password_hasher import PasswordHasher, PasswordHasherBusy
+from config import TestingConfig
+
+
+# 密码哈希进程池相关测试用例
+class PasswordHasherPoolCase(unittest.TestCase):
+    def setUp(self):
+        self.hasher = PasswordHasher()
+        self.hasher.rounds = 4
+        self.hasher.workers = 1
+        self.hasher.max_pending = 1
+
+    def tearDown(self):
+        self.hasher.shutdown()
+
+    def test_hash_and_check_in_process_pool(self):
+        """测试在子进程中计算和校验哈希"""
+        hashed = self.hasher.hash_password('secret')
+        self.assertTrue(hashed.startswith('$2b$04$'))
+        self.assertTrue(self.hasher.check_password('secret', hashed))
+        self.assertFalse(self.hasher.check_password('wrong', hashed))
+        self.assertEqual(self.hasher.pending, 0)
+
+    def test_sheds_load_when_queue_is_full(self):
+        """测试待处理任务达到上限时立即拒绝，而不是继续排队"""
+        self.hasher.rounds = 12
+        future = self.hasher.submit_hash('slow')
+        with self.assertRaises(PasswordHasherBusy):
+            self.hasher.submit_hash('rejected')
+        future.result()
+        self.assertEqual(self.hasher.pending, 0)
+        self.hasher.rounds = 4
+        self.assertTrue(self.hasher.hash_password('accepted'))
+
+    def test_needs_rehash(self):
+        """测试根据哈希中记录的工作因子判断是否需要升级"""
+        self.assertFalse(self.hasher.needs_rehash(self.hasher.hash_password('pw')))
+        self.hasher.rounds = 5
+        self.assertTrue(self.hasher.needs_rehash('$2b$04$' + 'a' * 53))
+        self.assertTrue(self.hasher.needs_rehash('not-a-bcrypt-hash'))
+
+
+# 登录时升级哈希和繁忙时返回503的接口测试
+class PasswordEndpointsCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        user = User(username='alice', email='alice@example.com')
+        user.set_password('pw')
+        db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self):
+        return self.client.post('/api/login', data=json.dumps({'username': 'alice', 'password': 'pw'}),
+                                content_type='application/json')
+
+    def test_login_upgrades_stale_cost(self):
+        """测试调高工作因子后，登录成功时自动用新的工作因子重新计算哈希"""
+        self.assertTrue(User.query.filter_by(username='alice').first().password_hash.startswith('$2b$04$'))
+        password_hasher.rounds = 5
+        self.assertEqual(self.login().status_code, 200)
+        self.assertTrue(User.query.filter_by(username='alice').first().password_hash.startswith('$2b$05$'))
+        # 升级后的哈希仍然可以正常登录
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_busy_returns_503(self):
+        """测试哈希任务已满时接口返回503并提示重试"""
+        password_hasher.max_pending = 0
+        response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,146 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from app.presence import InMemoryPresenceBackend, SQLitePresenceBackend
+
+
+# 在线状态注册表后端的通用测试用例，两种后端必须表现一致
+class PresenceBackendMixin:
+    def make_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.backend = self.make_backend()
+
+    def test_register_and_lookup(self):
+        """测试登记后可以按用户名和按sid双向查询"""
+        self.backend.register('alice', 'sid-a')
+        self.assertEqual(self.backend.get_sid('alice'), 'sid-a')
+        self.assertEqual(self.backend.get_username('sid-a'), 'alice')
+        self.assertIsNone(self.backend.get_sid('bob'))
+        self.assertEqual(self.backend.count(), 1)
+
+    def test_reconnect_replaces_old_sid(self):
+        """测试同一用户重新连接后，旧sid的注销不会影响新连接"""
+        self.backend.register('alice', 'sid-old')
+        self.backend.register('alice', 'sid-new')
+        self.assertEqual(self.backend.get_sid('alice'), 'sid-new')
+        self.assertIsNone(self.backend.get_username('sid-old'))
+
+        self.assertIsNone(self.backend.unregister('sid-old'))
+        self.assertEqual(self.backend.get_sid('alice'), 'sid-new')
+
+        self.assertEqual(self.backend.unregister('sid-new'), 'alice')
+        self.assertIsNone(self.backend.get_sid('alice'))
+        self.assertEqual(self.backend.count(), 0)
+
+    def test_online_among(self):
+        """测试批量查询在线用户"""
+        for i in range(1200):
+            self.backend.register(f'user{i}', f'sid{i}')
+        candidates = [f'user{i}' for i in range(0, 2400, 2)]
+        online = self.backend.online_among(candidates)
+        self.assertEqual(online, {f'user{i}' for i in range(0, 1200, 2)})
+
+        self.backend.clear()
+        self.assertEqual(self.backend.online_among(candidates), set())
+
+
+    def test_connection_info(self):
+        """测试注册表保存P2P连接信息，重新连接时覆盖，注销后移除"""
+        self.backend.register('alice', 'sid-old', '10.0.0.1', 9000)
+        self.backend.register('alice', 'sid-new', '10.0.0.2', 9001)
+        self.backend.register('bob', 'sid-b', '10.0.0.3', 9002)
+        self.assertEqual(self.backend.connection_info(['alice', 'bob', 'carol']),
+                         {'alice': ('10.0.0.2', 9001), 'bob': ('10.0.0.3', 9002)})
+        self.backend.unregister('sid-old')
+        self.backend.unregister('sid-b')
+        self.assertEqual(self.backend.connection_info(['alice', 'bob']), {'alice': ('10.0.0.2', 9001)})
+
+    def test_version_changes_with_online_set(self):
+        """测试登记、注销和清空都会改变版本，注销不存在的sid不改变版本"""
+        versions = [self.backend.version()]
+        self.backend.register('alice', 'sid-a')
+        versions.append(self.backend.version())
+        self.backend.unregister('sid-missing')
+        self.assertEqual(self.backend.version(), versions[-1])
+        self.backend.unregister('sid-a')
+        versions.append(self.backend.version())
+        self.backend.unregister_many(['sid-b'])
+        self.assertEqual(self.backend.version(), versions[-1])
+        self.backend.register('bob', 'sid-b')
+        versions.append(self.backend.version())
+        self.backend.unregister_many(['sid-b'])
+        versions.append(self.backend.version())
+        self.backend.clear()
+        versions.append(self.backend.version())
+        self.assertEqual(len(set(versions)), len(versions))
+
+
+class InMemoryPresenceCase(PresenceBackendMixin, unittest.TestCase):
+    def make_backend(self):
+        return InMemoryPresenceBackend()
+
+
+class SQLitePresenceCase(PresenceBackendMixin, unittest.TestCase):
+    def make_backend(self):
+        self.tmpdir = tempfile.mkdtemp()
+        return SQLitePresenceBackend(os.path.join(self.tmpdir, 'presence.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_shared_between_instances(self):
+        """测试两个后端实例（模拟两个 worker 进程）共享同一份在线状态"""
+        other = SQLitePresenceBackend(self.backend.path)
+        self.backend.register('alice', 'sid-a')
+        self.assertEqual(other.get_sid('alice'), 'sid-a')
+        self.assertEqual(other.unregister('sid-a'), 'alice')
+        self.assertIsNone(self.backend.get_sid('alice'))
+
+
+    def test_upgrades_registry_without_connection_columns(self):
+        """测试打开旧版本创建的注册表文件时补齐连接信息列和 worker 列"""
+        path = os.path.join(self.tmpdir, 'old.db')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE presence (username TEXT PRIMARY KEY, sid TEXT NOT NULL UNIQUE,'
+                     ' updated_at REAL NOT NULL)')
+        conn.execute("INSERT INTO presence VALUES ('stale', 'sid-stale', 0)")
+        conn.commit()
+        conn.close()
+        backend = SQLitePresenceBackend(path)
+        backend.register('alice', 'sid-a', '10.0.0.1', 9000)
+        self.assertEqual(backend.connection_info(['alice']), {'alice': ('10.0.0.1', 9000)})
+        # 旧版本的记录没有 worker 标识，无法确认仍然在线
+        self.assertEqual(backend.usernames(), ['alice'])
+
+
+    def test_records_of_dead_workers_expire(self):
+        """测试心跳超时的 worker 登记的用户不再在线，其记录在其他 worker 的心跳中被清除"""
+        crashed = SQLitePresenceBackend(self.backend.path, worker_id='crashed')
+        crashed.register('alice', 'sid-a', '10.0.0.1', 9000)
+        self.backend.register('bob', 'sid-b', '10.0.0.2', 9001)
+        self.assertEqual(self.backend.online_among(['alice', 'bob']), {'alice', 'bob'})
+
+        version = self.backend.version()
+
+        # 模拟 crashed 被强制结束：心跳停在 TTL 之前，版本随之改变
+        conn = sqlite3.connect(self.backend.path)
+        with conn:
+            conn.execute('UPDATE presence_workers SET heartbeat_at = 0 WHERE worker = ?', ('crashed',))
+        self.assertEqual(self.backend.online_among(['alice', 'bob']), {'bob'})
+        self.assertEqual(self.backend.connection_info(['alice', 'bob']), {'bob': ('10.0.0.2', 9001)})
+        self.assertIsNone(self.backend.get_sid('alice'))
+        self.assertEqual(self.backend.usernames(), ['bob'])
+
+        self.assertNotEqual(self.backend.version(), version)
+        self.backend.heartbeat()
+        self.assertEqual(conn.execute('SELECT username FROM presence').fetchall(), [('bob',)])
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM presence_workers').fetchone()[0], 1)
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
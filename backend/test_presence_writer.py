@@ -0,0 +1,112 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+import jwt
+from app import create_app, db, socketio, presence_writer
+from app.models import User
+from config import TestingConfig
+from test_user_api import count_queries
+
+
+class BufferedConfig(TestingConfig):
+    # 间隔足够长，测试中由 flush() 手动写入
+    PRESENCE_FLUSH_INTERVAL = 3600
+
+
+# 在线状态延迟写入相关测试用例
+class PresenceWriterCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(BufferedConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.alice = User(username='alice', email='alice@example.com', password_hash='x')
+        self.bob = User(username='bob', email='bob@example.com', password_hash='x')
+        db.session.add_all([self.alice, self.bob])
+        db.session.commit()
+        self.alice.add_friend(self.bob)
+        db.session.commit()
+        self.alice_id, self.bob_id = self.alice.id, self.bob.id
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            if client.is_connected():
+                client.disconnect()
+        presence_writer.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def connect(self, user_id):
+        token = jwt.encode({'user_id': user_id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                           self.app.config['SECRET_KEY'], algorithm='HS256')
+        client = socketio.test_client(self.app, auth={'token': token})
+        self.clients.append(client)
+        return client
+
+    def stored(self, user_id):
+        db.session.expire_all()
+        user = User.query.get(user_id)
+        return user.is_online, user.ip_address, user.port
+
+    def test_flapping_connections_collapse_into_one_update(self):
+        """测试同一用户反复上线/下线只保留最后的状态，刷新时一条批量 UPDATE 写入所有用户"""
+        version = User.query.get(self.alice_id).row_version
+        for port in range(10):
+            presence_writer.set_online(self.alice_id, '10.0.0.1', port)
+            presence_writer.set_offline(self.alice_id)
+        presence_writer.set_online(self.alice_id, '10.0.0.2', 9000)
+        presence_writer.set_online(self.bob_id, '10.0.0.3', 9001)
+        self.assertEqual(presence_writer.pending, 2)
+        self.assertEqual(self.stored(self.alice_id), (False, None, None))
+        self.assertEqual(presence_writer.overlay(self.alice_id, False, None, None), (True, '10.0.0.2', 9000))
+
+        with count_queries() as statements:
+            self.assertEqual(presence_writer.flush(), 2)
+        self.assertEqual(len([s for s in statements if s.startswith('UPDATE users')]), 1)
+        self.assertEqual(presence_writer.pending, 0)
+        self.assertEqual(self.stored(self.alice_id), (True, '10.0.0.2', 9000))
+        self.assertEqual(self.stored(self.bob_id), (True, '10.0.0.3', 9001))
+        # 列表接口的ETag依赖行版本号
+        self.assertGreater(User.query.get(self.alice_id).row_version, version)
+
+    def test_readers_see_buffered_presence(self):
+        """测试尚未写入数据库的上线信息已经出现在好友快照和连接信息接口中"""
+        bob = self.connect(self.bob_id)
+        bob.emit('authenticate', {'ip_address': '10.0.0.3', 'port': 9001})
+        self.assertEqual(self.stored(self.bob_id), (False, None, None))
+
+        alice = self.connect(self.alice_id)
+        alice.emit('authenticate', {'port': 9000})
+        snapshot = [p for p in alice.get_received() if p['name'] == 'friends_presence_snapshot'][0]
+        self.assertEqual(snapshot['args'][0]['friends'],
+                         [{'username': 'bob', 'is_online': True, 'ip_address': '10.0.0.3', 'port': 9001}])
+
+        token = jwt.encode({'user_id': self.alice_id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                           self.app.config['SECRET_KEY'], algorithm='HS256')
+        headers = {'Authorization': f'Bearer {token}'}
+        info = self.app.test_client().get('/api/users/bob/info', headers=headers).get_json()
+        self.assertEqual((info['ip_address'], info['port']), ('10.0.0.3', 9001))
+        friends = self.app.test_client().get('/api/friends', headers=headers).get_json()
+        self.assertEqual((friends[0]['is_online'], friends[0]['port']), (True, 9001))
+
+        bob.disconnect()
+        presence_writer.flush()
+        self.assertEqual(self.stored(self.bob_id), (False, None, None))
+        self.assertEqual(self.stored(self.alice_id)[0], True)
+
+    def test_shutdown_flushes_or_discards(self):
+        """测试进程退出时按配置写入或丢弃缓冲区"""
+        presence_writer.set_online(self.alice_id, '10.0.0.1', 9000)
+        presence_writer.shutdown()
+        self.assertEqual(self.stored(self.alice_id), (True, '10.0.0.1', 9000))
+
+        presence_writer.flush_on_shutdown = False
+        presence_writer.set_offline(self.alice_id)
+        presence_writer.shutdown()
+        self.assertEqual(presence_writer.pending, 0)
+        self.assertEqual(self.stored(self.alice_id), (True, '10.0.0.1', 9000))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,218 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+import jwt
+from app import create_app, db, socketio, relay, lifecycle
+from app.models import User
+from app.relay import SQLiteRelayStore
+from config import TestingConfig
+
+
+# 中转消息存储相关测试用例
+class RelayStoreCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = SQLiteRelayStore(os.path.join(self.tmpdir, 'relay.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def append(self, recipient, count, expires_at=None):
+        now = time.time()
+        return self.store.append_many([(recipient, 'alice', f'cipher-{i}', None, now, expires_at or now + 60)
+                                       for i in range(count)])
+
+    def test_append_pending_ack_and_sweep(self):
+        """测试批量追加分配连续ID，确认游标之前和已过期的消息不再投递并会被清理"""
+        first = self.append('bob', 3)
+        self.assertEqual(first, [1, 2, 3])
+        self.assertEqual(self.append('carol', 2), [4, 5])
+        self.append('bob', 1, expires_at=time.time() - 1)
+
+        now = time.time()
+        self.assertEqual([row[0] for row in self.store.pending('bob', 0, now, 10)], [1, 2, 3])
+        self.assertEqual([row[0] for row in self.store.pending('bob', 1, now, 1)], [2])
+
+        self.store.ack('bob', 2)
+        self.store.ack('bob', 1)  # 游标不会后退
+        self.assertEqual([row[0] for row in self.store.pending('bob', 0, now, 10)], [3])
+
+        # 过期的 1 条和已确认的 2 条被删除
+        self.assertEqual(self.store.sweep(now, limit=1), 3)
+        self.assertEqual(self.store.count(), 3)
+
+        # 已确认的消息按接收者走 (recipient, id) 索引删除，游标没有推进的接收者不再处理
+        # 单线程使用时连接池总是借出同一个连接，在它上面记录之后 sweep 执行的语句
+        with self.store._connect() as conn:
+            plan = conn.execute('EXPLAIN QUERY PLAN DELETE FROM relay_messages WHERE recipient = ? AND id <= ?',
+                                ('bob', 2)).fetchall()
+            self.assertIn('ix_relay_messages_recipient_id', ' '.join(row[-1] for row in plan))
+            statements = []
+            conn.set_trace_callback(statements.append)
+        self.addCleanup(conn.set_trace_callback, None)
+        self.assertEqual(self.store.sweep(now), 0)
+        self.assertTrue(statements)
+        self.assertFalse([s for s in statements if s.startswith('DELETE FROM relay_messages WHERE recipient')])
+        self.store.ack('carol', 4)
+        self.store.ack('bob', 3)
+        self.assertEqual(self.store.sweep(now, limit=1), 2)
+        self.assertEqual(self.store.count(), 1)
+
+    def test_cursor_table_from_older_version_is_upgraded(self):
+        """测试旧版本创建的游标表在连接时补上 swept_id 列"""
+        path = os.path.join(self.tmpdir, 'old.db')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE relay_cursors (recipient TEXT PRIMARY KEY, acked_id INTEGER NOT NULL)')
+        conn.execute("INSERT INTO relay_cursors VALUES ('bob', 5)")
+        conn.commit()
+        conn.close()
+        store = SQLiteRelayStore(path)
+        store.append_many([('bob', 'alice', 'cipher', None, time.time(), time.time() + 60)])
+        self.assertEqual(store.sweep(time.time()), 1)
+        self.assertEqual(store.count(), 0)
+
+
+# 通过 Socket.IO 中转消息的端到端测试用例
+class RelayEventsCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        alice = User(username='alice', email='alice@example.com', password_hash='x')
+        bob = User(username='bob', email='bob@example.com', password_hash='x')
+        eve = User(username='eve', email='eve@example.com', password_hash='x')
+        db.session.add_all([alice, bob, eve])
+        db.session.commit()
+        alice.add_friend(bob)
+        db.session.commit()
+        self.tokens = {user.username: self.make_token(user.id) for user in (alice, bob, eve)}
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            if client.is_connected():
+                client.disconnect()
+        relay.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def make_token(self, user_id):
+        return jwt.encode({'user_id': user_id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                          self.app.config['SECRET_KEY'], algorithm='HS256')
+
+    def online(self, username):
+        client = socketio.test_client(self.app, auth={'token': self.tokens[username]})
+        self.clients.append(client)
+        client.emit('authenticate', {'port': 9000})
+        return client
+
+    @staticmethod
+    def relayed(client):
+        return [message for packet in client.get_received() if packet['name'] == 'relay_messages'
+                for message in packet['args'][0]['messages']]
+
+    def test_offline_delivery_and_ack(self):
+        """测试消息在接收者离线时暂存，上线时批量投递，确认后不再投递"""
+        relay.delivery_batch = 2
+        alice = self.online('alice')
+        for i in range(3):
+            ack = alice.emit('private_message', {'to': 'bob', 'payload': f'cipher-{i}', 'client_id': i},
+                             callback=True)
+            self.assertEqual(ack, {'status': 'queued'})
+
+        bob = self.online('bob')
+        messages = self.relayed(bob)
+        self.assertEqual([m['payload'] for m in messages], ['cipher-0', 'cipher-1', 'cipher-2'])
+        self.assertEqual([m['client_id'] for m in messages], ['0', '1', '2'])
+        self.assertEqual({m['from'] for m in messages}, {'alice'})
+
+        bob.emit('relay_ack', {'up_to': messages[1]['id']})
+        bob.disconnect()
+        bob = self.online('bob')
+        self.assertEqual([m['payload'] for m in self.relayed(bob)], ['cipher-2'])
+
+    def test_online_recipient_receives_immediately(self):
+        """测试接收者在线时，消息提交后立即推送"""
+        alice = self.online('alice')
+        bob = self.online('bob')
+        bob.get_received()
+        alice.emit('private_message', {'to': 'bob', 'payload': 'hello'}, callback=True)
+        self.assertEqual([m['payload'] for m in self.relayed(bob)], ['hello'])
+
+    def test_rejects_strangers_and_oversized_payloads(self):
+        """测试只能向好友中转消息，且密文长度和缓冲区大小受限"""
+        eve = self.online('eve')
+        self.assertEqual(eve.emit('private_message', {'to': 'bob', 'payload': 'x'}, callback=True),
+                         {'status': 'error', 'error': 'not_friends'})
+        alice = self.online('alice')
+        self.assertEqual(alice.emit('private_message', {'to': 'nobody', 'payload': 'x'}, callback=True),
+                         {'status': 'error', 'error': 'not_friends'})
+        self.assertEqual(alice.emit('private_message', {'to': 'bob', 'payload': 'x' * (relay.max_payload + 1)},
+                                    callback=True),
+                         {'status': 'error', 'error': 'payload_too_large'})
+        with patch.object(relay, 'max_buffer_bytes', 3):
+            self.assertEqual(alice.emit('private_message', {'to': 'bob', 'payload': 'long'}, callback=True),
+                             {'status': 'error', 'error': 'busy'})
+        self.assertEqual(relay.store.count(), 0)
+
+    def test_batched_flush(self):
+        """测试启用批量提交时消息先进入缓冲区，由一次 flush 分批写入"""
+        with patch.object(relay, 'flush_interval', 1.0), patch.object(relay, '_flusher_started', True):
+            for i in range(25):
+                relay.enqueue('alice', 'bob', f'cipher-{i}')
+        self.assertEqual(relay.buffered, 25)
+        self.assertEqual(relay.store.count(), 0)
+        with patch.object(relay, 'flush_batch', 10), \
+                patch.object(relay.store, 'append_many', wraps=relay.store.append_many) as append:
+            self.assertEqual(relay.flush(), 25)
+        self.assertEqual([len(call.args[0]) for call in append.call_args_list], [10, 10, 5])
+        self.assertEqual(relay.buffered, 0)
+        self.assertEqual(relay.store.count(), 25)
+
+
+    def test_sweeper_runs_without_batched_flush(self):
+        """测试每条消息同步提交时清理任务照常启动（每个进程一个），失败时记录到应用日志"""
+        started = []
+        with patch.object(relay, 'sweep_interval', 60), patch.object(relay, '_sweeper_started', False), \
+                patch.object(socketio, 'start_background_task',
+                             side_effect=lambda func, *args: started.append(func)):
+            relay.enqueue('alice', 'bob', 'cipher')
+            relay.ack('bob', 1)
+        self.assertEqual(started, [relay._sweep_loop])
+        self.assertEqual(relay.store.count(), 1)
+
+        with patch.object(relay, 'sweep_interval', 60), patch.object(socketio, 'sleep'), \
+                patch.object(relay, 'sweep', side_effect=[RuntimeError('disk full'), 1, KeyboardInterrupt]), \
+                self.assertLogs(self.app.logger, 'ERROR') as logs:
+            with self.assertRaises(KeyboardInterrupt):
+                relay._sweep_loop()
+        self.assertIn('Relay sweep failed', logs.output[0])
+
+    def test_buffered_messages_survive_shutdown(self):
+        """测试已回复 queued、仍在缓冲区中的消息在优雅关闭和进程退出时写入存储"""
+        with patch.object(relay, 'flush_interval', 1.0), patch.object(relay, '_flusher_started', True):
+            alice = self.online('alice')
+            for i in range(3):
+                self.assertEqual(alice.emit('private_message', {'to': 'bob', 'payload': f'cipher-{i}'},
+                                            callback=True), {'status': 'queued'})
+            self.assertEqual(relay.buffered, 3)
+            lifecycle.shutdown()
+            self.assertEqual((relay.buffered, relay.store.count()), (0, 3))
+
+            # atexit 兜底：关闭之后到达的消息在进程退出时写入
+            relay.enqueue('alice', 'bob', 'late')
+            self.assertEqual(relay.shutdown(), 1)
+            self.assertEqual(relay.shutdown(), 0)
+        self.assertEqual([row[2] for row in relay.store.pending('bob', 0, time.time(), 10)],
+                         ['cipher-0', 'cipher-1', 'cipher-2', 'late'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+import jwt
+from app import create_app, db, replicas
+from app.models import User, FriendRequest, friendships
+from config import TestingConfig
+
+
+# 读写分离相关测试用例：用两个 SQLite 文件分别充当主库和副本，副本不做复制，
+# 因此只存在于主库中的数据可以用来判断一次读取落在了哪个数据库上。
+class ReplicaRoutingCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+        class ReplicaConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(self.tmpdir, 'primary.db')
+            DATABASE_REPLICA_URLS = ['sqlite:///' + os.path.join(self.tmpdir, 'replica.db')]
+            DB_READ_YOUR_WRITES_WINDOW = 0.3
+
+        self.app = create_app(ReplicaConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.replica = replicas.engines[0]
+        db.metadata.create_all(bind=self.replica)
+        # 两个库中都有相同的用户
+        rows = [{'id': 1, 'username': 'alice', 'email': 'alice@example.com', 'password_hash': 'x'},
+                {'id': 2, 'username': 'bob', 'email': 'bob@example.com', 'password_hash': 'x'}]
+        db.session.execute(User.__table__.insert(), rows)
+        db.session.commit()
+        with self.replica.begin() as conn:
+            conn.execute(User.__table__.insert(), rows)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.get_engine(self.app).dispose()
+        self.replica.dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def headers(self, user_id):
+        token = jwt.encode({'user_id': user_id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                           self.app.config['SECRET_KEY'], algorithm='HS256')
+        return {'Authorization': f'Bearer {token}'}
+
+    def inbox(self, user_id):
+        response = self.client.get('/api/friend-requests', headers=self.headers(user_id))
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_read_only_endpoint_uses_replica(self):
+        """测试只读接口从副本读取，副本连接同样设置了 PRAGMA"""
+        db.session.add(FriendRequest(requester_id=2, receiver_id=1))
+        db.session.commit()
+        self.assertEqual(self.inbox(1), [])
+        with self.replica.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql('PRAGMA journal_mode').scalar(), 'wal')
+
+    def test_own_write_reads_from_primary_within_window(self):
+        """测试用户写入后的窗口期内，其只读请求改为从主库读取，窗口过后恢复使用副本"""
+        db.session.add(FriendRequest(requester_id=2, receiver_id=1))
+        db.session.commit()
+        response = self.client.put('/api/user/profile', headers=self.headers(1),
+                                   data=json.dumps({'bio': 'hello'}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.inbox(1)), 1)
+        # 其他用户不受影响
+        self.assertEqual(self.inbox(2), [])
+        time.sleep(0.4)
+        self.assertEqual(self.inbox(1), [])
+
+    def test_writes_go_to_primary_and_notified_user_sticks(self):
+        """测试写接口写入主库，收到好友请求的用户在窗口期内从主库读取收件箱"""
+        with patch('app.api.friends.socketio.emit'):
+            response = self.client.post('/api/friend-requests', headers=self.headers(2),
+                                        data=json.dumps({'username': 'alice'}),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(FriendRequest.query.count(), 1)
+        with self.replica.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql('SELECT COUNT(*) FROM friend_requests').scalar(), 0)
+        self.assertEqual(self.inbox(1)[0]['requester_username'], 'bob')
+
+    def test_friend_graph_loads_from_primary(self):
+        """测试只读接口中的好友关系图仍从主库加载，不会缓存副本上过期的好友关系"""
+        db.session.execute(friendships.insert(), [{'user_id': 1, 'friend_id': 2}, {'user_id': 2, 'friend_id': 1}])
+        db.session.commit()
+        response = self.client.get('/api/users/bob/info', headers=self.headers(1))
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
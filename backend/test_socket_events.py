@@ -0,0 +1,161 @@
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+import jwt
+from app import create_app, db, socketio, presence, signal_coalescer
+from app.models import User
+from config import TestingConfig
+from test_user_api import count_queries
+
+
+# WebSocket 事件处理相关测试用例
+class SocketEventsCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.alice = User(username='alice', email='alice@example.com')
+        self.bob = User(username='bob', email='bob@example.com')
+        self.alice.password_hash = self.bob.password_hash = 'x'
+        db.session.add_all([self.alice, self.bob])
+        db.session.commit()
+        self.alice.add_friend(self.bob)
+        db.session.commit()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            if client.is_connected():
+                client.disconnect()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def make_token(self, user, hours=1):
+        return jwt.encode(
+            {'user_id': user.id, 'exp': datetime.now(timezone.utc) + timedelta(hours=hours)},
+            self.app.config['SECRET_KEY'], algorithm='HS256'
+        )
+
+    def connect(self, auth):
+        client = socketio.test_client(self.app, auth=auth)
+        self.clients.append(client)
+        return client
+
+    def test_handshake_rejects_bad_tokens(self):
+        """测试握手阶段拒绝缺失、无效或过期的令牌"""
+        self.assertFalse(self.connect(None).is_connected())
+        self.assertFalse(self.connect({'token': 'not-a-jwt'}).is_connected())
+        self.assertFalse(self.connect({'token': self.make_token(self.alice, hours=-1)}).is_connected())
+        self.assertTrue(self.connect({'token': self.make_token(self.alice)}).is_connected())
+
+    def test_authenticate_registers_presence(self):
+        """测试上线事件会在注册表中登记，断开后注销"""
+        client = self.connect({'token': self.make_token(self.alice)})
+        client.emit('authenticate', {'port': 9000})
+        self.assertTrue(presence.is_online('alice'))
+        self.assertTrue(User.query.filter_by(username='alice').first().is_online)
+
+        client.disconnect()
+        self.assertFalse(presence.is_online('alice'))
+
+    def test_signal_uses_session_identity(self):
+        """测试握手之后的信令事件无需令牌，也不访问数据库"""
+        alice = self.connect({'token': self.make_token(self.alice)})
+        bob = self.connect({'token': self.make_token(self.bob)})
+        alice.emit('authenticate', {'port': 9000})
+        bob.emit('authenticate', {'port': 9001})
+        bob.get_received()
+
+        with count_queries() as statements:
+            for i in range(5):
+                alice.emit('webrtc_signal', {'to': 'bob', 'signal': {'candidate': i}})
+        self.assertEqual(statements, [])
+
+        signals = [p for p in bob.get_received() if p['name'] == 'webrtc_signal']
+        self.assertEqual(len(signals), 5)
+        self.assertEqual(signals[0]['args'][0]['from'], 'alice')
+
+    def test_candidates_are_coalesced(self):
+        """测试 ICE 候选地址在窗口内合并为一个事件，offer 立即转发且不会越过之前的候选地址，超大信令被丢弃"""
+        signal_coalescer.window = 0.1
+        signal_coalescer.max_batch = 4
+        alice = self.connect({'token': self.make_token(self.alice)})
+        bob = self.connect({'token': self.make_token(self.bob)})
+        alice.emit('authenticate', {'port': 9000})
+        bob.emit('authenticate', {'port': 9001})
+        bob.get_received()
+
+        for i in range(2):
+            alice.emit('webrtc_signal', {'to': 'bob', 'signal': {'type': 'candidate', 'candidate': {'n': i}}})
+        self.assertEqual(bob.get_received(), [])
+        self.assertEqual(alice.emit('webrtc_signal', {'to': 'bob', 'signal': {'type': 'offer', 'sdp': 'v=0'}},
+                                    callback=True), {'status': 'sent'})
+        received = [(p['name'], p['args'][0]) for p in bob.get_received()]
+        self.assertEqual(received, [
+            ('webrtc_signal_batch', {'from': 'alice', 'signals': [{'type': 'candidate', 'candidate': {'n': 0}},
+                                                                  {'type': 'candidate', 'candidate': {'n': 1}}]}),
+            ('webrtc_signal', {'from': 'alice', 'signal': {'type': 'offer', 'sdp': 'v=0'}}),
+        ])
+
+        # 窗口结束时发出；达到 max_batch 时立即发出
+        for i in range(6):
+            alice.emit('webrtc_signal', {'to': 'bob', 'signal': {'candidate': i}})
+        self.assertEqual([len(p['args'][0]['signals']) for p in bob.get_received()], [4])
+        time.sleep(0.3)
+        self.assertEqual([len(p['args'][0]['signals']) for p in bob.get_received()], [2])
+        self.assertEqual(signal_coalescer.pending, 0)
+
+        huge = {'candidate': 'x' * self.app.config['SIGNAL_MAX_PAYLOAD']}
+        self.assertEqual(alice.emit('webrtc_signal', {'to': 'bob', 'signal': huge}, callback=True),
+                         {'status': 'error', 'error': 'payload_too_large'})
+        # 无法序列化为 JSON 的信令（如二进制附件）同样被丢弃，不会抛出异常
+        self.assertEqual(alice.emit('webrtc_signal', {'to': 'bob', 'signal': {'candidate': b'\x00'}}, callback=True),
+                         {'status': 'error', 'error': 'payload_too_large'})
+        time.sleep(0.2)
+        self.assertEqual(bob.get_received(), [])
+
+
+    def test_authenticate_fans_out_once_per_friend(self):
+        """测试上线时每个在线好友只收到一条通知，上线者收到一条好友状态快照，且查询数与好友数量无关"""
+        friends = [User(username=f'friend{i}', email=f'friend{i}@example.com', password_hash='x')
+                   for i in range(20)]
+        db.session.add_all(friends)
+        db.session.commit()
+        for friend in friends:
+            self.alice.add_friend(friend)
+        db.session.commit()
+
+        bob = self.connect({'token': self.make_token(self.bob)})
+        bob.emit('authenticate', {'port': 9001})
+        bob.get_received()
+
+        alice = self.connect({'token': self.make_token(self.alice)})
+        alice.get_received()
+        with count_queries() as statements:
+            alice.emit('authenticate', {'port': 9000})
+        # 加载用户、更新在线状态、查询好友列表、查询所在的群，不会为每个好友单独查询
+        self.assertLessEqual(len([s for s in statements if s.lstrip().upper().startswith('SELECT')]), 3)
+
+        updates = [p for p in bob.get_received() if p['name'] == 'friend_status_update']
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(updates[0]['args'][0]['username'], 'alice')
+
+        received = alice.get_received()
+        self.assertEqual([p['name'] for p in received], ['friends_presence_snapshot'])
+        snapshot = {f['username']: f for f in received[0]['args'][0]['friends']}
+        self.assertEqual(len(snapshot), 21)
+        self.assertTrue(snapshot['bob']['is_online'])
+        self.assertEqual(snapshot['bob']['port'], 9001)
+        self.assertFalse(snapshot['friend0']['is_online'])
+        self.assertIsNone(snapshot['friend0']['port'])
+
+        alice.disconnect()
+        offline = [p for p in bob.get_received() if p['name'] == 'friend_status_update']
+        self.assertEqual(len(offline), 1)
+        self.assertFalse(offline[0]['args'][0]['is_online'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -31,7 +31,7 @@ class UserClient:
         @self.sio.event
         def connect():
             print(f"[{self.username}] Connection established.")
-            self.sio.emit('authenticate', {'token': self.token})
+            self.sio.emit('authenticate', {})
             print(f"[{self.username}] Sent authentication.")
             self.is_connected = True
 
@@ -53,7 +53,8 @@ class UserClient:
             print(f"[{self.username}] Received error: {data}")
 
     def connect(self):
-        self.sio.connect(BASE_URL)
+        # The server authenticates the socket once, during the handshake
+        self.sio.connect(BASE_URL, auth={'token': self.token})
 
     def disconnect(self):
         if self.is_connected:
@@ -70,8 +71,7 @@ class UserClient:
         print(f"[{self.username}] Sending message to {recipient_username}.")
         self.sio.emit('private_message', {
             'to': recipient_username,
-            'message': message,
-            'token': self.token
+            'message': message
         })
 
 # --- Main Execution ---
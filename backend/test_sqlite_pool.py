@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from app.sqlite_pool import SQLiteConnectionPool
+
+try:
+    import gevent
+    HAS_GEVENT = True
+except ImportError:
+    HAS_GEVENT = False
+
+
+class SQLiteConnectionPoolCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.opened = []
+        self.pool = SQLiteConnectionPool(os.path.join(self.tmpdir, 'pool.db'), size=2, setup=self.opened.append)
+
+    def test_connections_are_reused(self):
+        """测试依次借出时复用同一个连接，setup 只执行一次"""
+        for _ in range(10):
+            with self.pool.connection() as conn:
+                conn.execute('SELECT 1')
+        self.assertEqual(len(self.opened), 1)
+        self.assertEqual(self.pool.idle_count(), 1)
+
+    def test_idle_connections_are_bounded(self):
+        """测试同时借出的连接超过 size 时，多出的连接在归还时关闭"""
+        barrier = threading.Barrier(5)
+
+        def borrow():
+            with self.pool.connection() as conn:
+                conn.execute('SELECT 1')
+                barrier.wait()
+        threads = [threading.Thread(target=borrow) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.opened), 5)
+        self.assertEqual(self.pool.idle_count(), 2)
+
+        # 空闲连接可以在创建它的线程之外使用
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self._select_one()))
+        thread.start()
+        thread.join()
+        self.assertEqual(results, [1])
+        self.assertEqual(len(self.opened), 5)
+
+    def _select_one(self):
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT 1').fetchone()[0]
+
+    def test_open_transaction_is_rolled_back_on_release(self):
+        """测试归还时仍处于事务中的连接会先回滚"""
+        with self.pool.connection() as conn:
+            conn.execute('CREATE TABLE t (x INTEGER)')
+        with self.assertRaises(RuntimeError):
+            with self.pool.connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('INSERT INTO t VALUES (1)')
+                raise RuntimeError('boom')
+        with self.pool.connection() as conn:
+            self.assertFalse(conn.in_transaction)
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone()[0], 0)
+
+    def test_memory_database_is_shared_between_connections(self):
+        """测试 ':memory:' 连接池中的所有连接看到同一个数据库"""
+        pool = SQLiteConnectionPool(':memory:')
+        with pool.connection() as first, pool.connection() as second:
+            first.execute('CREATE TABLE t (x INTEGER)')
+            first.execute('INSERT INTO t VALUES (1)')
+            self.assertEqual(second.execute('SELECT x FROM t').fetchall(), [(1,)])
+        with pool.connection() as conn:
+            self.assertEqual(conn.execute('SELECT x FROM t').fetchall(), [(1,)])
+        # 不同连接池之间互不可见
+        with SQLiteConnectionPool(':memory:').connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 't'").fetchone()[0], 0)
+
+    @unittest.skipUnless(HAS_GEVENT, 'gevent is not installed')
+    def test_greenlets_share_pooled_connections(self):
+        """测试大量协程使用连接池时，连接被复用而不是按协程创建"""
+        def borrow():
+            with self.pool.connection() as conn:
+                conn.execute('SELECT 1')
+                gevent.sleep(0)
+
+        gevent.joinall([gevent.spawn(borrow) for _ in range(50)])
+        opened = len(self.opened)
+        self.assertEqual(self.pool.idle_count(), 2)
+        for _ in range(5):
+            gevent.joinall([gevent.spawn(borrow) for _ in range(2)])
+        self.assertEqual(len(self.opened), opened)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
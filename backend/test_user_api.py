@@ -1,9 +1,33 @@
 import unittest
 import json
-from app import create_app, db
-from app.models import User
+import io
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone
+import jwt
+from app import create_app, db, presence, presence_writer, socketio, avatar_pipeline
+from app.avatar_storage import LocalAvatarStorage
+from app.models import User, FriendRequest
 from config import TestingConfig
 from unittest.mock import patch
+from contextlib import contextmanager
+from sqlalchemy import event
+
+
+@contextmanager
+def count_queries():
+    """统计代码块中执行的SQL语句，产出一个记录了所有语句文本的列表。"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
 
 # 用户模型相关测试用例
 class UserModelCase(unittest.TestCase):
@@ -85,18 +109,20 @@ class UserModelCase(unittest.TestCase):
             content_type='application/json'
         )
 
-        # 测试用例1：登录成功
-        response = self.client.post(
-            '/api/login',
-            data=json.dumps({
-                'username': 'testloginuser',
-                'password': 'password123'
-            }),
-            content_type='application/json'
-        )
+        # 测试用例1：登录成功。查询用户、分配行版本号、更新用户共 3 条语句，提交后不再重新加载用户
+        with count_queries() as statements:
+            response = self.client.post(
+                '/api/login',
+                data=json.dumps({
+                    'username': 'testloginuser',
+                    'password': 'password123'
+                }),
+                content_type='application/json'
+            )
         self.assertEqual(response.status_code, 200)
         json_response = response.get_json()
         self.assertIn('token', json_response)
+        self.assertLessEqual(len(statements), 3)
 
         # 测试用例2：密码错误
         response = self.client.post(
@@ -224,6 +250,7 @@ class UserModelCase(unittest.TestCase):
         user1.ip_address = '127.0.0.1'
         user1.port = 5000
         db.session.commit()
+        presence.register('user1', 'sid-user1')
 
         # 3. 登录user2以获取令牌
         response = self.client.post('/api/login', data=json.dumps({'username': 'user2', 'password': 'pw2'}), content_type='application/json')
@@ -248,6 +275,7 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(data['port'], 5000)
 
         # 7. 模拟user1断开连接
+        presence.unregister('sid-user1')
         user1.is_online = False
         user1.ip_address = None
         user1.port = None
@@ -259,6 +287,47 @@ class UserModelCase(unittest.TestCase):
         data = response.get_json()
         self.assertFalse(data['is_online'])
 
+    def test_batch_user_info_uses_presence(self):
+        """测试批量获取连接信息：只能查询好友，连接信息来自在线状态注册表，查询数与好友数无关"""
+        viewer = User(username='viewer', email='viewer@example.com', password_hash='x')
+        friends = [User(username=f'friend{i}', email=f'friend{i}@example.com', password_hash='x') for i in range(200)]
+        stranger = User(username='stranger', email='stranger@example.com', password_hash='x')
+        db.session.add_all([viewer, stranger] + friends)
+        db.session.commit()
+        for friend in friends:
+            viewer.add_friend(friend)
+        db.session.commit()
+        for i in range(0, 200, 2):
+            presence.register(f'friend{i}', f'sid-{i}', f'10.0.0.{i % 250}', 9000 + i)
+        presence.register('stranger', 'sid-stranger', '10.1.1.1', 9999)
+        self.addCleanup(presence.clear)
+        token = jwt.encode({'user_id': viewer.id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                           self.app.config['SECRET_KEY'], algorithm='HS256')
+        headers = {'Authorization': f'Bearer {token}'}
+        body = json.dumps({'usernames': [f'friend{i}' for i in range(200)] + ['stranger', 'ghost', 'viewer']})
+
+        with count_queries() as statements:
+            response = self.client.post('/api/users/info', headers=headers, data=body,
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        # 请求者身份、用户名解析、好友关系图各一次，与好友数无关
+        self.assertLessEqual(len(statements), 3)
+        data = response.get_json()
+        self.assertEqual(data['denied'], ['stranger'])
+        self.assertEqual(data['missing'], ['ghost'])
+        users = {user['username']: user for user in data['users']}
+        self.assertEqual(len(users), 201)
+        self.assertEqual(users['friend4'], {'username': 'friend4', 'is_online': True,
+                                            'ip_address': '10.0.0.4', 'port': 9004})
+        self.assertEqual(users['friend5'], {'username': 'friend5', 'is_online': False})
+        self.assertFalse(users['viewer']['is_online'])
+
+        # 缓存已预热，再次请求已存在的用户时不访问数据库
+        body = json.dumps({'usernames': [f'friend{i}' for i in range(200)] + ['stranger', 'viewer']})
+        with count_queries() as statements:
+            self.client.post('/api/users/info', headers=headers, data=body, content_type='application/json')
+        self.assertEqual(statements, [])
+
     def test_public_key_api(self):
         """测试公钥上传和检索的API."""
         # 创建一个用户并登录以获取令牌
@@ -302,6 +371,60 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(get_key_resp_fail.status_code, 404)
         self.assertIn('User has not uploaded a public key', get_key_resp_fail.get_data(as_text=True))
 
+    def test_public_key_fingerprints_and_bulk_lookup(self):
+        """测试公钥指纹、单个公钥的条件请求和批量查询只返回发生变化的公钥"""
+        users = []
+        for name in ('viewer', 'k1', 'k2', 'k3', 'nokey'):
+            user = User(username=name, email=f'{name}@example.com', password_hash='x')
+            users.append(user)
+        db.session.add_all(users)
+        db.session.commit()
+        for user in users[1:4]:
+            user.set_public_key(f'KEY-{user.username}-1')
+        db.session.commit()
+        token = jwt.encode({'user_id': users[0].id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                           self.app.config['SECRET_KEY'], algorithm='HS256')
+        headers = {'Authorization': f'Bearer {token}'}
+
+        # 重复上传同一把公钥不改变版本号
+        k1 = users[1]
+        fingerprint = k1.public_key_fingerprint
+        self.assertFalse(k1.set_public_key('KEY-k1-1'))
+        self.assertEqual(k1.public_key_version, 1)
+
+        # 单个公钥：ETag为指纹，指纹未变化时返回 304，一次查询
+        response = self.client.get('/api/users/k1/public_key', headers=headers)
+        self.assertEqual(response.get_etag(), (fingerprint, False))
+        self.assertEqual(response.get_json()['fingerprint'], fingerprint)
+        with count_queries() as statements:
+            response = self.client.get('/api/users/k1/public_key',
+                                       headers={**headers, 'If-None-Match': f'"{fingerprint}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(statements), 1)
+
+        # 批量查询：k1 未变化，k2 已更换公钥，k3 客户端没有缓存，nokey 和不存在的用户在 missing 中
+        k2 = users[2]
+        old_fingerprint = k2.public_key_fingerprint
+        self.assertTrue(k2.set_public_key('KEY-k2-2'))
+        db.session.commit()
+        body = {'usernames': ['k1', 'k2', 'k3', 'nokey', 'ghost'], 'known': {'k1': fingerprint, 'k2': old_fingerprint}}
+        with count_queries() as statements:
+            response = self.client.post('/api/users/public_keys', headers=headers, data=json.dumps(body),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        data = response.get_json()
+        self.assertEqual(data['unchanged'], ['k1'])
+        self.assertEqual(data['missing'], ['nokey', 'ghost'])
+        keys = {key['username']: key for key in data['keys']}
+        self.assertEqual(set(keys), {'k2', 'k3'})
+        self.assertEqual((keys['k2']['public_key'], keys['k2']['key_version']), ('KEY-k2-2', 2))
+        self.assertEqual(keys['k3']['public_key'], 'KEY-k3-1')
+
+        response = self.client.post('/api/users/public_keys', headers=headers, data=json.dumps({'usernames': 'k1'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
     def test_admin_api(self):
         """测试仅限管理员的API端点."""
         # 创建用户：一个管理员，一个普通用户
@@ -350,8 +473,8 @@ class UserModelCase(unittest.TestCase):
         reg_user_db.is_online = True
         db.session.commit()
 
-        with patch('app.api.admin.get_sid_by_username', return_value='fake_sid') as mock_get_sid:
-            with patch('app.api.admin.socketio') as mock_socketio:
+        with patch.object(presence, 'get_sid', return_value='fake_sid') as mock_get_sid:
+            with patch('app.api.admin.disconnect') as mock_disconnect:
                 
                 # 测试用例3：管理员成功断开在线用户
                 response = self.client.post(
@@ -362,7 +485,7 @@ class UserModelCase(unittest.TestCase):
                 self.assertIn('Disconnect signal sent', response.get_data(as_text=True))
                 
                 mock_get_sid.assert_called_once_with('regular')
-                mock_socketio.disconnect.assert_called_once_with('fake_sid')
+                mock_disconnect.assert_called_once_with('fake_sid', namespace='/')
 
         # 测试用例4：尝试断开离线用户
         reg_user_db.is_online = False
@@ -371,5 +494,412 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn('User is already offline', response.get_data(as_text=True))
 
+    def test_identity_cache(self):
+        """测试认证身份缓存：命中时不查询数据库，修改资料或删除用户后立即失效"""
+        admin_user = User(username='admin', email='admin@example.com', is_admin=True)
+        admin_user.set_password('adminpass')
+        u1 = User(username='cached', email='cached@example.com')
+        u1.set_password('pw')
+        db.session.add_all([admin_user, u1])
+        db.session.commit()
+
+        def login(username, password):
+            resp = self.client.post('/api/login', data=json.dumps({'username': username, 'password': password}),
+                                    content_type='application/json')
+            return {'Authorization': f"Bearer {resp.get_json()['token']}"}
+
+        headers = login('cached', 'pw')
+        admin_headers = login('admin', 'adminpass')
+
+        # 第一次请求填充缓存，之后的请求不再查询 users 表来认证或按用户名查找
+        self.client.get('/api/users/cached/profile', headers=headers)
+        with count_queries() as statements:
+            response = self.client.get('/api/users/cached/profile', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(statements, [])
+
+        # 更新资料后缓存失效，读取到的是新数据
+        response = self.client.put('/api/user/profile', headers=headers,
+                                   data=json.dumps({'bio': 'hello'}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/users/cached/profile', headers=headers)
+        self.assertEqual(response.get_json()['bio'], 'hello')
+
+        # 更新密码后，用新密码可以登录
+        response = self.client.put('/api/user/password', headers=headers,
+                                   data=json.dumps({'current_password': 'pw', 'new_password': 'pw2'}),
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.client.get('/api/friends', headers=headers)
+        response = self.client.put('/api/user/password', headers=headers,
+                                   data=json.dumps({'current_password': 'pw2', 'new_password': 'pw3'}),
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        # 删除用户后，其令牌立即失效
+        response = self.client.delete('/api/admin/users/cached', headers=admin_headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/friends', headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_friend_request_query_counts(self):
+        """测试好友请求收件箱和发送请求的SQL查询数量不随请求数量增长，并且使用联合索引"""
+        receiver = User(username='popular', email='popular@example.com', password_hash='x')
+        requesters = [User(username=f'fan{i}', email=f'fan{i}@example.com', password_hash='x',
+                           avatar_url=f'avatars/fan{i}.png') for i in range(10)]
+        db.session.add_all([receiver] + requesters)
+        db.session.commit()
+        receiver_id = receiver.id
+        token = jwt.encode({'user_id': receiver_id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                           self.app.config['SECRET_KEY'], algorithm='HS256')
+        headers = {'Authorization': f'Bearer {token}'}
+
+        def inbox_queries():
+            with count_queries() as statements:
+                response = self.client.get('/api/friend-requests', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            return response.get_json(), statements
+
+        # 先发一次请求，填充身份缓存
+        self.client.get('/api/friend-requests', headers=headers)
+
+        db.session.add(FriendRequest(requester_id=requesters[0].id, receiver_id=receiver_id))
+        db.session.commit()
+        inbox, statements = inbox_queries()
+        self.assertEqual(len(inbox), 1)
+        self.assertEqual(len(statements), 1)
+
+        db.session.add_all([FriendRequest(requester_id=u.id, receiver_id=receiver_id) for u in requesters[1:]])
+        db.session.commit()
+        inbox, statements = inbox_queries()
+        self.assertEqual(len(inbox), 10)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(inbox[0]['requester_username'], 'fan0')
+        self.assertTrue(inbox[0]['requester_avatar_url'].endswith('/static/avatars/fan0.png'))
+
+        # 收件箱查询由 (receiver_id, status, timestamp) 联合索引完成过滤和排序
+        plan = db.session.connection().exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + statements[0], (receiver_id, 'pending')).fetchall()
+        plan_text = ' '.join(str(row) for row in plan)
+        self.assertIn('ix_friend_requests_receiver_status_timestamp', plan_text)
+        self.assertNotIn('TEMP B-TREE', plan_text)
+
+        # 发送好友请求：查找接收者、好友判断、重复请求检查和插入都是常数次查询，提交后也不再重新加载
+        other = User(username='newcomer', email='newcomer@example.com', password_hash='x')
+        db.session.add(other)
+        db.session.commit()
+        with patch('app.api.friends.socketio.emit'), count_queries() as statements:
+            response = self.client.post('/api/friend-requests', headers=headers,
+                                        data=json.dumps({'username': 'newcomer'}),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertLessEqual(len(statements), 5)
+
+    def test_list_pagination_and_etag(self):
+        """测试好友列表和管理员用户列表的键集分页与条件请求"""
+        admin_user = User(username='admin', email='admin@example.com', password_hash='x', is_admin=True)
+        owner = User(username='owner', email='owner@example.com', password_hash='x')
+        friends = [User(username=f'pal{i}', email=f'pal{i}@example.com', password_hash='x') for i in range(5)]
+        db.session.add_all([admin_user, owner] + friends)
+        db.session.commit()
+        for friend in friends:
+            owner.add_friend(friend)
+        db.session.commit()
+
+        def headers_for(user):
+            token = jwt.encode({'user_id': user.id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                               self.app.config['SECRET_KEY'], algorithm='HS256')
+            return {'Authorization': f'Bearer {token}'}
+        headers, admin_headers = headers_for(owner), headers_for(admin_user)
+
+        # 按ID顺序逐页读取，最后一页没有下一页游标
+        pages, url = [], '/api/friends?limit=2'
+        while url:
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            pages.append([f['username'] for f in response.get_json()])
+            cursor = response.headers.get('X-Next-Cursor')
+            url = f'/api/friends?limit=2&after={cursor}' if cursor else None
+        self.assertEqual(pages, [['pal0', 'pal1'], ['pal2', 'pal3'], ['pal4']])
+        self.assertEqual(self.client.get('/api/friends?limit=0', headers=headers).status_code, 400)
+        self.assertEqual(self.client.get('/api/friends?after=x', headers=headers).status_code, 400)
+
+        # 列表未变化时返回304，只执行一次计算版本的查询
+        response = self.client.get('/api/friends', headers=headers)
+        self.assertEqual(len(response.get_json()), 5)
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        with count_queries() as statements:
+            response = self.client.get('/api/friends', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(statements), 1)
+
+        def friends_etag_changes():
+            response = self.client.get('/api/friends', headers=dict(headers, **{'If-None-Match': etag}))
+            return response.status_code == 200 and response.headers['ETag'] != etag
+
+        # 好友资料变化、删除好友、新增好友都会使ETag失效
+        User.query.filter_by(username='pal3').first().bio = 'changed'
+        db.session.commit()
+        self.assertTrue(friends_etag_changes())
+        etag = self.client.get('/api/friends', headers=headers).headers['ETag']
+        owner = User.query.filter_by(username='owner').first()
+        pal0 = User.query.filter_by(username='pal0').first()
+        owner.remove_friend(pal0)
+        db.session.commit()
+        self.assertTrue(friends_etag_changes())
+        etag = self.client.get('/api/friends', headers=headers).headers['ETag']
+        owner.add_friend(pal0)
+        db.session.commit()
+        self.assertTrue(friends_etag_changes())
+
+        # 尚未写入数据库的在线状态会覆盖列表中的 is_online，缓冲区变化同样使ETag失效
+        etag = self.client.get('/api/friends', headers=headers).headers['ETag']
+        with patch.object(presence_writer, 'flush_interval', 1.0), \
+                patch.object(presence_writer, '_flusher_started', True):
+            presence_writer.set_online(pal0.id, '10.0.0.9', 5000)
+            self.assertTrue(friends_etag_changes())
+            etag = self.client.get('/api/friends', headers=headers).headers['ETag']
+            self.assertTrue(next(f for f in self.client.get('/api/friends', headers=headers).get_json()
+                                 if f['username'] == 'pal0')['is_online'])
+            presence_writer.flush()
+        self.assertTrue(friends_etag_changes())
+
+        # 管理员用户列表
+        response = self.client.get('/api/admin/users?limit=3', headers=admin_headers)
+        self.assertEqual([u['username'] for u in response.get_json()], ['admin', 'owner', 'pal0'])
+        self.assertIn('rel="next"', response.headers['Link'])
+        etag = response.headers['ETag']
+        response = self.client.get('/api/admin/users?limit=3',
+                                   headers=dict(admin_headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+
+        def admin_etag_changes():
+            response = self.client.get('/api/admin/users?limit=3',
+                                       headers=dict(admin_headers, **{'If-None-Match': etag}))
+            return response.status_code == 200 and response.headers['ETag'] != etag
+
+        # is_online 来自在线状态注册表，登记和注销都会使ETag失效
+        presence.register('pal0', 'sid-pal0')
+        self.assertTrue(admin_etag_changes())
+        etag = self.client.get('/api/admin/users?limit=3', headers=admin_headers).headers['ETag']
+        presence.unregister('sid-pal0')
+        self.assertTrue(admin_etag_changes())
+        etag = self.client.get('/api/admin/users?limit=3', headers=admin_headers).headers['ETag']
+        db.session.delete(User.query.filter_by(username='pal4').first())
+        db.session.commit()
+        response = self.client.get('/api/admin/users?limit=3',
+                                   headers=dict(admin_headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+
+        # 版本号来自计数器行：删除版本号最大的用户后，之后的修改也不会重复使用它
+        newest = User.query.order_by(User.row_version.desc()).first()
+        version = newest.row_version
+        db.session.delete(newest)
+        db.session.commit()
+        pal1 = User.query.filter_by(username='pal1').first()
+        pal1.bio = 'changed'
+        db.session.commit()
+        self.assertGreater(pal1.row_version, version)
+
+    def test_admin_export_streams_in_batches(self):
+        """测试管理员以NDJSON/CSV流式导出用户表，支持列选择和过滤，并按批次查询"""
+        self.app.config['ADMIN_EXPORT_BATCH_SIZE'] = 10
+        admin_user = User(username='admin', email='admin@example.com', password_hash='x', is_admin=True)
+        db.session.add(admin_user)
+        db.session.add_all([User(username=f'member{i}', email=f'member{i}@example.com', password_hash='x')
+                            for i in range(24)])
+        db.session.commit()
+        token = jwt.encode({'user_id': admin_user.id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                           self.app.config['SECRET_KEY'], algorithm='HS256')
+        headers = {'Authorization': f'Bearer {token}'}
+        presence.register('member3', 'sid-3')
+        self.addCleanup(presence.unregister, 'sid-3')
+
+        # 先请求一次填充身份缓存，之后只剩分批扫描的查询
+        self.client.get('/api/admin/users/export', headers=headers).get_data()
+        with count_queries() as statements:
+            response = self.client.get('/api/admin/users/export', headers=headers)
+            self.assertTrue(response.is_streamed)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            lines = response.get_data(as_text=True).splitlines()
+        # 25 个用户、每批 10 行：3 批数据加一次确认结束的空查询
+        self.assertEqual(len(statements), 4)
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(len(records), 25)
+        self.assertEqual(list(records[0]), ['id', 'username', 'email', 'is_online', 'ip_address', 'is_admin'])
+        self.assertEqual([r['username'] for r in records if r['is_online']], ['member3'])
+
+        response = self.client.get('/api/admin/users/export?format=csv&columns=username,is_online&online=1',
+                                   headers=headers)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(response.get_data(as_text=True).splitlines(), ['username,is_online', 'member3,True'])
+
+        response = self.client.get('/api/admin/users/export?format=csv&columns=id,username&admin=1',
+                                   headers=headers)
+        self.assertEqual(response.get_data(as_text=True).splitlines(), ['id,username', f'{admin_user.id},admin'])
+
+        response = self.client.get('/api/admin/users/export?columns=username,password_hash', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/admin/users/export?format=xml', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_avatar_pipeline(self):
+        """测试头像上传后在后台生成多尺寸的WebP/JPEG版本，完成后才替换数据库中的头像"""
+        from PIL import Image
+        static_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_folder, ignore_errors=True)
+        self.app.static_folder = static_folder
+        avatar_pipeline.storage = LocalAvatarStorage(static_folder)
+        user = User(username='painter', email='painter@example.com', password_hash='x',
+                    avatar_url='avatars/painter.png')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        os.makedirs(os.path.join(static_folder, 'avatars'))
+        open(os.path.join(static_folder, 'avatars', 'painter.png'), 'wb').close()
+        token = jwt.encode({'user_id': user_id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                           self.app.config['SECRET_KEY'], algorithm='HS256')
+        headers = {'Authorization': f'Bearer {token}'}
+
+        # 一张带 EXIF 的非正方形大图
+        buffer = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x010f] = 'SecretCamera'
+        Image.effect_noise((1600, 1200), 64).convert('RGB').save(buffer, 'PNG', exif=exif)
+        upload = buffer.getvalue()
+
+        started = []
+        with patch.object(socketio, 'start_background_task',
+                          side_effect=lambda func, *args: started.append((func, args))):
+            response = self.client.post('/api/user/avatar', headers=headers,
+                                        data={'avatar': (io.BytesIO(upload), 'me.png')})
+        self.assertEqual(response.status_code, 202)
+        body = response.get_json()
+        self.assertTrue(body['avatar_url'].endswith('/512.webp'))
+        self.assertIn('{size}.{format}', body['avatar_url_template'])
+        # 后台处理完成前数据库中仍是旧头像
+        self.assertEqual(User.query.get(user_id).avatar_url, 'avatars/painter.png')
+
+        func, args = started[0]
+        func(*args)
+        key = User.query.get(user_id).avatar_url
+        self.assertTrue(body['avatar_url'].endswith(f'/api/{key}/512.webp'))
+        self.assertFalse(os.path.exists(os.path.join(static_folder, 'avatars', 'painter.png')))
+        for size in (48, 128, 512):
+            for ext, fmt in (('webp', 'WEBP'), ('jpg', 'JPEG')):
+                with Image.open(os.path.join(static_folder, key, f'{size}.{ext}')) as image:
+                    self.assertEqual((image.format, image.size), (fmt, (size, size)))
+                    self.assertNotIn('exif', image.info)
+        thumbnail = os.path.getsize(os.path.join(static_folder, key, '48.webp'))
+        self.assertLess(thumbnail * 100, len(upload))
+
+        response = self.client.get('/api/users/painter/profile?avatar_size=48', headers=headers)
+        self.assertTrue(response.get_json()['avatar_url'].endswith(f'/api/{key}/48.webp'))
+
+        # 另一个用户上传同一张图片时复用已有的文件，不重新处理
+        other = User(username='copycat', email='copycat@example.com', password_hash='x')
+        db.session.add(other)
+        db.session.commit()
+        with patch.object(socketio, 'start_background_task',
+                          side_effect=lambda func, *args: func(*args)), \
+                patch('app.avatars.render_variants') as render, self.app.test_request_context():
+            avatar_pipeline.submit(other.id, upload)
+        render.assert_not_called()
+        self.assertEqual(User.query.filter_by(username='copycat').first().avatar_url, key)
+
+        response = self.client.post('/api/user/avatar', headers=headers,
+                                    data={'avatar': (io.BytesIO(b'not an image'), 'fake.png')})
+        self.assertEqual(response.status_code, 400)
+
+    def test_avatar_cleanup_rechecks_under_lock(self):
+        """测试旧头像只在持锁确认无人引用后删除，复用的版本目录在持锁时缺失会重新生成"""
+        from PIL import Image
+        storage_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage_root, ignore_errors=True)
+        self.addCleanup(setattr, avatar_pipeline, 'storage', avatar_pipeline.storage)
+        storage = avatar_pipeline.storage = LocalAvatarStorage(storage_root)
+
+        def upload(color):
+            buffer = io.BytesIO()
+            Image.new('RGB', (64, 64), color).save(buffer, 'PNG')
+            return buffer.getvalue()
+        first, second = upload('red'), upload('blue')
+        owner = User(username='owner', email='owner@example.com', password_hash='x')
+        adopter = User(username='adopter', email='adopter@example.com', password_hash='x')
+        db.session.add_all([owner, adopter])
+        db.session.commit()
+        owner_id, adopter_id = owner.id, adopter.id
+
+        def process(user_id, data):
+            with patch.object(socketio, 'start_background_task', side_effect=lambda func, *args: func(*args)), \
+                    self.app.test_request_context():
+                return avatar_pipeline.submit(user_id, data)
+        old_key = process(owner_id, first)
+        self.assertTrue(avatar_pipeline._is_complete(old_key))
+
+        # 另一个用户在清理者检查引用之前复用了旧头像（提交后清理者才取得锁），旧头像不能被删除
+        lock = storage.lock
+
+        @contextmanager
+        def adopt_before_cleanup(name):
+            if name == old_key:
+                User.query.filter_by(id=adopter_id).update({'avatar_url': old_key})
+                db.session.commit()
+            with lock(name):
+                yield
+        with patch.object(storage, 'lock', side_effect=adopt_before_cleanup):
+            process(owner_id, second)
+        self.assertTrue(avatar_pipeline._is_complete(old_key))
+
+        # 复用前检查时文件还在、持锁时已被删除：重新生成后再写入数据库
+        storage.delete(old_key)
+        with patch.object(avatar_pipeline, '_is_complete', side_effect=[True, False]):
+            self.assertEqual(process(owner_id, first), old_key)
+        self.assertTrue(avatar_pipeline._is_complete(old_key))
+
+    def test_avatar_serving(self):
+        """测试头像接口的永久缓存头、强ETag、304、Range请求、内存缓存和代理发送"""
+        storage_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage_root, ignore_errors=True)
+        avatar_pipeline.storage = LocalAvatarStorage(storage_root)
+        avatar_pipeline.cache.clear()
+        content = bytes(range(256)) * 4
+        avatar_pipeline.storage.save('avatars/0123abcd/128.webp', content)
+
+        response = self.client.get('/api/avatars/0123abcd/128.webp')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, content)
+        self.assertEqual(response.mimetype, 'image/webp')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+        etag, weak = response.get_etag()
+        self.assertFalse(weak)
+
+        response = self.client.get('/api/avatars/0123abcd/128.webp', headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        # 第一次请求后内容已进入内存缓存，删除文件后仍能返回
+        os.remove(os.path.join(storage_root, 'avatars', '0123abcd', '128.webp'))
+        response = self.client.get('/api/avatars/0123abcd/128.webp', headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, content[10:20])
+        self.assertEqual(response.headers['Content-Range'], f'bytes 10-19/{len(content)}')
+
+        self.assertEqual(self.client.get('/api/avatars/0123abcd/48.webp').status_code, 404)
+        self.assertEqual(self.client.get('/api/avatars/../config.py').status_code, 404)
+        self.assertEqual(self.client.get('/api/avatars/0123abcd/128.png').status_code, 404)
+
+        self.app.config['AVATAR_OFFLOAD_HEADER'] = 'X-Accel-Redirect'
+        response = self.client.get('/api/avatars/0123abcd/48.jpg')
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected/avatars/0123abcd/48.jpg')
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        self.assertEqual(response.data, b'')
+        self.app.config['AVATAR_OFFLOAD_HEADER'] = 'X-Sendfile'
+        response = self.client.get('/api/avatars/0123abcd/48.jpg')
+        self.assertEqual(response.headers['X-Sendfile'],
+                         os.path.join(storage_root, 'avatars', '0123abcd', '48.jpg'))
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
\ No newline at end of file